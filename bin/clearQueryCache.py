@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""
+%prog [options] queryCacheDir [database ...]
+
+Remove the query results pipeQA cached in queryCacheDir (config queryCacheDir),
+for the databases listed, or for all databases.
+"""
+
+import sys
+import optparse
+
+from lsst.testing.pipeQA.QueryCache import QueryCache
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage=__doc__)
+    opts, args = parser.parse_args()
+
+    if len(args) < 1:
+        parser.print_help()
+        sys.exit(1)
+
+    queryCache = QueryCache(args[0])
+    if len(args) == 1:
+        queryCache.invalidate()
+    else:
+        for database in args[1:]:
+            queryCache.invalidate(database)
@@ -1,4 +1,5 @@
-import sys, os, re, copy
+import sys, os, re, copy, time
+from multiprocessing.pool import ThreadPool
 
 import lsst.daf.persistence             as dafPersist
 import lsst.afw.detection               as afwDet
@@ -50,9 +51,11 @@ class ButlerQaData(QaData):
         
         @param haveManifest verify files in dataDir are present according to manifest
         @param verifyChecksum verify files in dataDir have correct checksum as listed in manifest
+        @param loadThreads number of threads used to read per-sensor data (1 reads serially)
+        @param cacheMaxBytes memory budget for the cached data (None for no limit)
         """
         
-        QaData.__init__(self, label, rerun, cameraInfo)
+        QaData.__init__(self, label, rerun, cameraInfo, cacheMaxBytes=kwargs.get('cacheMaxBytes', None))
         self.rerun = rerun
         self.dataDir = dataDir
 
@@ -65,6 +68,7 @@ class ButlerQaData(QaData):
         self.haveManifest   = self.kwargs.get('haveManifest', False)
         self.verifyChecksum = self.kwargs.get('verifyChecksum', False)
         self.shapeAlg       = self.kwargs.get('shapeAlg', 'HSM_REGAUSS')
+        self.loadThreads    = self.kwargs.get('loadThreads', 1)
 
         knownAlgs = ["HSM_REGAUSS", "HSM_BJ", "HSM_LINEAR", "HSM_SHAPELET", "HSM_KSB"]
         if not self.shapeAlg in set(knownAlgs):
@@ -113,6 +117,9 @@ class ButlerQaData(QaData):
         # availableDataTuples may be a *very* *large* list.  Be sure to call reduceAvailableDataTupleList
         self.dataTuples = self.availableDataTuples
 
+        # indices of the data tuple lists searched by _regexMatchDataIds(), by id() of the list
+        self.dataTupleIndexes = {}
+
     
     def reduceAvailableDataTupleList(self, dataIdRegexDict):
         """Reduce availableDataTupleList by keeping only dataIds that match the input regex."""
@@ -123,7 +130,8 @@ class ButlerQaData(QaData):
         QaData.initCache(self)
         # need to intialize these differently than base class
         # ... Db has 'object' and 'source' matching to be cached
-        self.matchListCache = { 'obj': {}, 'src': {} }
+        self.matchListCache = { 'obj': self.cacheManager.makeCache("matchList"),
+                                'src': self.cacheManager.makeCache("matchList") }
         self.matchQueryCache = { 'obj' : {}, 'src': {} }
 
         
@@ -194,6 +202,36 @@ class ButlerQaData(QaData):
         return copy.copy(self.brokenDataIdList)
     
 
+    def _fetchBySensor(self, fetch, dataTuples):
+        """Call fetch(dataId) for each dataTuple, using a pool of loadThreads threads.
+
+        Butler reads are I/O bound, so threads overlap them well.  Only fetch() runs in the
+        pool; the caller merges the results into the caches, so the caches (and the
+        printStartLoad() bookkeeping) are only touched by this thread.
+        Returns a list of [result, seconds] in the same order as dataTuples.
+
+        @param fetch      Function of a dataId which reads and returns the data for one sensor
+        @param dataTuples The data tuples to fetch
+        """
+
+        def timedFetch(dataTuple):
+            t0 = time.time()
+            result = fetch(self._dataTupleToDataId(dataTuple))
+            return [result, time.time() - t0]
+
+        nThread = min(self.loadThreads, len(dataTuples))
+        if nThread > 1:
+            pool = ThreadPool(nThread)
+            try:
+                results = pool.map(timedFetch, dataTuples)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [timedFetch(dataTuple) for dataTuple in dataTuples]
+        return results
+
+
     def getMatchListBySensor(self, dataIdRegex, useRef=None):
         """Get a dict of all SourceMatches matching dataId, with sensor name as dict keys.
 
@@ -210,16 +248,34 @@ class ButlerQaData(QaData):
         dataTuplesToFetch = self._regexMatchDataIds(dataIdRegex, self.dataTuples)
         
         # get the datasets corresponding to the request
-        matchListDict = {}
         typeDict = {}
+        dataTuplesToLoad = []
         for dataTuple in dataTuplesToFetch:
-            dataId = self._dataTupleToDataId(dataTuple)
             dataKey = self._dataTupleToString(dataTuple)
-            
             if self.matchListCache[useRef].has_key(dataKey):
                 typeDict[dataKey] = copy.copy(self.matchListCache[useRef][dataKey])
-                continue
+            else:
+                dataTuplesToLoad.append(dataTuple)
 
+        # read the matches for all sensors first, so the reads can run concurrently
+        def readMatches(dataId):
+            # make sure we actually have the output file
+            isWritten = self.outButler.datasetExists('icMatch', dataId) and \
+                self.outButler.datasetExists('calexp', dataId)
+            if not isWritten:
+                return None
+            return measAstrom.astrom.readMatches(self.outButler, dataId)
+
+        if len(dataTuplesToLoad) > 1:
+            # the sources and calexps are needed below, load them all in one go too
+            self.loadCalexp(dataIdRegex)
+            self.getSourceSetBySensor(dataIdRegex)
+        fetched = self._fetchBySensor(readMatches, dataTuplesToLoad)
+        
+        for dataTuple, matchesAndTime in zip(dataTuplesToLoad, fetched):
+            dataId = self._dataTupleToDataId(dataTuple)
+            dataKey = self._dataTupleToString(dataTuple)
+            matches, tRead = matchesAndTime
             
             filterObj = self.getFilterBySensor(dataId)
             filterName = "unknown"
@@ -227,21 +283,16 @@ class ButlerQaData(QaData):
                 filterName = filterObj[dataKey].getName()
                 filterName = flookup[filterName]
                 
-            # make sure we actually have the output file
-            isWritten = self.outButler.datasetExists('icMatch', dataId) and \
-                self.outButler.datasetExists('calexp', dataId)
-            multiplicity = {}
             matchList = []
             
-            if not isWritten:
+            if matches is None:
                 print str(dataTuple) + " output file missing.  Skipping."
                 continue
             
             else:
 
                 self.printStartLoad("Loading MatchList for: " + dataKey + "...")
-                
-                matches = measAstrom.astrom.readMatches(self.outButler, dataId)
+                self.printMidLoad("read %.2fs, " % (tRead))
                 
                 sourcesDict    = self.getSourceSetBySensor(dataId)
                 refObjectsDict = self.getRefObjectSetBySensor(dataId)
@@ -250,112 +301,56 @@ class ButlerQaData(QaData):
                 calib = calibDict[dataKey]
 
                 
-                fmag0, fmag0err = calib.getFluxMag0()
+                fmag0, fmag0Err = calib.getFluxMag0()
+
+                # gather the matches into columns
+                refNames = ['Id', 'Ra', 'Dec', 'PsfFlux']
+                names = ['Id', 'Extendedness', 'XAstrom', 'YAstrom', 'Ra', 'Dec',
+                         'PsfFlux', 'ApFlux', 'ModelFlux', 'InstFlux',
+                         'PsfFluxErr', 'ApFluxErr', 'ModelFluxErr', 'InstFluxErr',
+                         'FlagPixInterpCen', 'FlagNegative', 'FlagPixEdge', 'FlagBadCentroid',
+                         'FlagPixSaturCen']
+                rows = []
                 for m in matches:
                     srefIn, sIn, dist = m
                     if ((srefIn is not None) and (sIn is not None)):
-
-                        if not matchListDict.has_key(dataKey):
-                            refCatObj = pqaSource.RefCatalog()
-                            refCat    = refCatObj.catalog
-                            catObj    = pqaSource.Catalog()
-                            cat       = catObj.catalog
-
-                            matchListDict[dataKey] = []
-
-                            refRaKey   = refCatObj.keyDict['Ra']
-                            refDecKey  = refCatObj.keyDict['Dec']
-                            refPsfKey  = refCatObj.keyDict['PsfFlux']
-                            refApKey   = refCatObj.keyDict['ApFlux']
-                            refModKey  = refCatObj.keyDict['ModelFlux']
-                            refInstKey = refCatObj.keyDict['InstFlux']
-
-                            psfKey     = catObj.keyDict['PsfFlux']
-                            apKey      = catObj.keyDict['ApFlux']
-                            modKey     = catObj.keyDict['ModelFlux']
-                            instKey    = catObj.keyDict['InstFlux']
-
-                            psfErrKey  = catObj.keyDict['PsfFluxErr']
-                            apErrKey   = catObj.keyDict['ApFluxErr']
-                            modErrKey  = catObj.keyDict['ModelFluxErr']
-                            instErrKey = catObj.keyDict['InstFluxErr']
-
-                            intCenKey  = catObj.keyDict['FlagPixInterpCen']     
-                            negKey     = catObj.keyDict['FlagNegative']    
-                            edgeKey    = catObj.keyDict['FlagPixEdge']     
-                            badCenKey  = catObj.keyDict['FlagBadCentroid'] 
-                            satCenKey  = catObj.keyDict['FlagPixSaturCen']     
-                            extKey     = catObj.keyDict['Extendedness']
-
-
-                        matchList = matchListDict[dataKey]
-
-                        # reference objects
-                        sref = refCat.addNew()
-
-                        sref.setId(srefIn.getId()) # this should be refobjId
-                        sref.setD(refRaKey, srefIn.getRa().asDegrees())
-                        sref.setD(refDecKey, srefIn.getDec().asDegrees())
-                        flux = srefIn.get('flux')
-
-                        sref.setD(refPsfKey, flux)
-                        sref.setD(refApKey, flux)
-                        sref.setD(refModKey, flux)
-                        sref.setD(refInstKey, flux)
-
-                        # sources
-                        s = cat.addNew()
-                        s.setId(sIn.getId())
-                        isStar = srefIn.get('stargal')+0.0
-                        s.setD(catObj.keyDict['Extendedness'], isStar)
-
-                        s.setD(catObj.keyDict['XAstrom'], sIn.getX())
-                        s.setD(catObj.keyDict['YAstrom'], sIn.getY())
-                        s.setD(catObj.keyDict['Ra'], sIn.getRa().asDegrees())
-                        s.setD(catObj.keyDict['Dec'], sIn.getDec().asDegrees())
-                        s.setD(psfKey,  sIn.getPsfFlux())
-                        s.setD(apKey,   sIn.getApFlux())
-                        s.setD(modKey,  sIn.getModelFlux())
-                        s.setD(instKey, sIn.getInstFlux())
-
-                        s.setD(intCenKey, sIn.get('flags.pixel.interpolated.center')+0.0)
-                        s.setD(negKey,    sIn.get('flags.negative')+0.0)
-                        s.setD(edgeKey,   sIn.get('flags.pixel.edge')+0.0)
-                        s.setD(badCenKey, sIn.get('flags.badcentroid')+0.0)
-                        s.setD(satCenKey, sIn.get('flags.pixel.saturated.center')+0.0)
-                        s.setD(extKey,    sIn.get('classification.extendedness')+0.0)
-
-                        fmag0, fmag0Err = calib.getFluxMag0()
-
-                        # fluxes
-                        s.setD(psfKey,   s.getD(psfKey)/fmag0)
-                        s.setD(apKey,    s.getD(apKey)/fmag0)
-                        s.setD(modKey,   s.getD(modKey)/fmag0)
-                        s.setD(instKey,  s.getD(instKey)/fmag0)
-
-                        # flux errors
-                        psfFluxErr  = qaDataUtils.calibFluxError(sIn.getPsfFlux(), sIn.getPsfFluxErr(),
-                                                                 fmag0, fmag0Err)
-                        s.setD(psfErrKey, psfFluxErr)
-
-                        apFluxErr   = qaDataUtils.calibFluxError(sIn.getApFlux(),  sIn.getApFluxErr(),
-                                                                 fmag0, fmag0Err)
-                        s.setD(apErrKey, apFluxErr)
-
-                        modFluxErr  = qaDataUtils.calibFluxError(sIn.getModelFlux(), sIn.getModelFluxErr(),
-                                                                 fmag0, fmag0Err)
-                        s.setD(modErrKey, modFluxErr)
-
-                        instFluxErr = qaDataUtils.calibFluxError(sIn.getInstFlux(),  sIn.getInstFluxErr(),
-                                                                 fmag0, fmag0Err)
-                        s.setD(instErrKey, instFluxErr)
-
-                        if multiplicity.has_key(s.getId()):
-                            multiplicity[s.getId()] += 1
-                        else:
-                            multiplicity[s.getId()] = 1
-
-                        matchList.append([sref, s, dist])
+                        rows.append((srefIn.getId(), # this should be refobjId
+                                     srefIn.getRa().asDegrees(), srefIn.getDec().asDegrees(),
+                                     srefIn.get('flux'),
+                                     sIn.getId(), sIn.get('classification.extendedness')+0.0,
+                                     sIn.getX(), sIn.getY(),
+                                     sIn.getRa().asDegrees(), sIn.getDec().asDegrees(),
+                                     sIn.getPsfFlux(), sIn.getApFlux(), sIn.getModelFlux(), sIn.getInstFlux(),
+                                     sIn.getPsfFluxErr(), sIn.getApFluxErr(),
+                                     sIn.getModelFluxErr(), sIn.getInstFluxErr(),
+                                     sIn.get('flags.pixel.interpolated.center')+0.0,
+                                     sIn.get('flags.negative')+0.0,
+                                     sIn.get('flags.pixel.edge')+0.0,
+                                     sIn.get('flags.badcentroid')+0.0,
+                                     sIn.get('flags.pixel.saturated.center')+0.0,
+                                     dist))
+
+                refs = pqaSource.RefColumnCatalog(len(rows))
+                sources = pqaSource.ColumnCatalog(len(rows))
+                dists = None
+                if len(rows) > 0:
+                    columns = zip(*rows)
+                    for i in range(len(refNames)):
+                        refs.setColumn(refNames[i], columns[i])
+                    for name in ('ApFlux', 'ModelFlux', 'InstFlux'):
+                        refs.setColumn(name, refs.getColumn('PsfFlux'))
+                    for i in range(len(names)):
+                        sources.setColumn(names[i], columns[len(refNames) + i])
+                    dists = numpy.array(columns[-1], dtype=numpy.float64)
+
+                    # calibrate the matched sources, a column at a time
+                    for name in ('Psf', 'Ap', 'Model', 'Inst'):
+                        flux, fluxErr = qaDataUtils.calibrateFluxes(sources.getColumn(name+'Flux'),
+                                                                    sources.getColumn(name+'FluxErr'),
+                                                                    fmag0, fmag0Err)
+                        sources.setColumn(name+'Flux', flux)
+                        sources.setColumn(name+'FluxErr', fluxErr)
+                matchList = pqaSource.MatchList(sources, refs, dists)
 
                 self.dataIdLookup[dataKey] = dataId
                 
@@ -371,58 +366,9 @@ class ButlerQaData(QaData):
                 else:
                     refObjects = simRefObj.SimRefObjectSet() # an empty set
 
-
-                typeDict[dataKey] = {}
-
-                refIds     = []
-                for ro in refObjects:
-                    refIds.append(ro.getId())
-
-                srcIds     = []
-                for so in sources:
-                    srcIds.append(so.getId())
-
-                matRef     = []
-                matSrc     = []
-                for ma in matchList:
-                    matRef.append(ma[0].getId())
-                    matSrc.append(ma[1].getId())
-
-                refIds = set(refIds)
-                srcIds = set(srcIds)
-                matRef = set(matRef)
-                matSrc = set(matSrc)
-
-                undetectedIds = refIds - matRef
-                orphanIds     = srcIds - matSrc
-                matchedIds    = srcIds & matSrc   # Does not know about duplicates
-                #print 'Undet, orphan, matched:', len(undetectedIds), len(orphanIds), len(matchedIds)
-
-                undetected = []
-                orphans    = []
-                matched    = []
-                blended    = []
-                for ro in refObjects:
-                    if ro.getId() in undetectedIds:
-                        undetected.append(ro)
-                matchListById = dict([(m[1].getId(), m) for m in matchList])
-                matchIdsSet = set(matchListById.keys())
-                for so in sources:
-                    soid = so.getId()
-                    if soid in orphanIds:
-                        orphans.append(so)
-                    if soid in matchedIds and soid in matchIdsSet:
-                        if multiplicity[soid] == 1:
-                            matched.append(matchListById[soid])
-                        else:
-                            blended.append(matchListById[soid])
-
-
-
-                typeDict[dataKey]['orphan']     = orphans
-                typeDict[dataKey]['matched']    = matchList # a hack b/c src and icSrc Ids are different
-                typeDict[dataKey]['blended']    = blended
-                typeDict[dataKey]['undetected'] = undetected
+                # multiplicity is counted from the match list
+                typeDict[dataKey] = self._classifyMatchList(sources, refObjects, matchList)
+                typeDict[dataKey]['matched'] = matchList # a hack b/c src and icSrc Ids are different
 
                 # cache it
                 self.matchListCache[useRef][dataKey] = typeDict[dataKey]
@@ -462,20 +408,33 @@ class ButlerQaData(QaData):
 
         # get the datasets corresponding to the request
         ssDict = {}
+        dataTuplesToLoad = []
         for dataTuple in dataTuplesToFetch:
-            dataId = self._dataTupleToDataId(dataTuple)
             dataKey = self._dataTupleToString(dataTuple)
-            
             if self.sourceSetCache.has_key(dataKey):
                 ssDict[dataKey] = copy.copy(self.sourceSetCache[dataKey])
-                continue
+            else:
+                dataTuplesToLoad.append(dataTuple)
+
+        def readSources(dataId):
+            # make sure we actually have the output file
+            if self.outButler.datasetExists('src', dataId):
+                return self.outButler.get('src', dataId)
+            return None
+
+        if len(dataTuplesToLoad) > 1:
+            self.loadCalexp(dataIdRegex)
+        fetched = self._fetchBySensor(readSources, dataTuplesToLoad)
+        
+        for dataTuple, sourcesAndTime in zip(dataTuplesToLoad, fetched):
+            dataId = self._dataTupleToDataId(dataTuple)
+            dataKey = self._dataTupleToString(dataTuple)
+            sourceCatalog, tRead = sourcesAndTime
 
             self.printStartLoad("Loading SourceSets for: " + dataKey + "...")
             
-            # make sure we actually have the output file
-            isWritten = self.outButler.datasetExists('src', dataId)
-            if isWritten:
-                sourceCatalog = self.outButler.get('src', dataId)
+            if sourceCatalog is not None:
+                self.printMidLoad("read %.2fs, " % (tRead))
 
                 calibDict = self.getCalibBySensor(dataId)
                 calib = calibDict[dataKey]
@@ -487,86 +446,44 @@ class ButlerQaData(QaData):
                     fmag0, fmag0Err = 1.0, 1.0
 
 
-                catObj = pqaSource.Catalog()
-                cat  = catObj.catalog
-
-                raKey  = catObj.keyDict['Ra']     
-                decKey = catObj.keyDict['Dec']    
-                xKey   = catObj.keyDict['XAstrom']
-                yKey   = catObj.keyDict['YAstrom']
-
-                ixxKey = catObj.keyDict['Ixx']
-                iyyKey = catObj.keyDict['Iyy']
-                ixyKey = catObj.keyDict['Ixy']
-
-                intCenKey  = catObj.keyDict['FlagPixInterpCen']     
-                negKey     = catObj.keyDict['FlagNegative']    
-                edgeKey    = catObj.keyDict['FlagPixEdge']     
-                badCenKey  = catObj.keyDict['FlagBadCentroid'] 
-                satCenKey  = catObj.keyDict['FlagPixSaturCen']     
-                extKey     = catObj.keyDict['Extendedness']
-
-
-                psfKey = catObj.keyDict['PsfFlux']
-                apKey  = catObj.keyDict['ApFlux']
-                modKey = catObj.keyDict['ModelFlux']
-                instKey = catObj.keyDict['InstFlux']
-            
-                psfErrKey = catObj.keyDict['PsfFluxErr']
-                apErrKey  = catObj.keyDict['ApFluxErr']
-                modErrKey = catObj.keyDict['ModelFluxErr']
-                instErrKey = catObj.keyDict['InstFluxErr']
-                    
-                for s in sourceCatalog:
-
-                    rec = cat.addNew()
-                    rec.setId(s.getId())
-
-                    rec.setD(raKey,    float(s.getRa()))
-                    rec.setD(decKey,   float(s.getDec()))
-                    rec.setD(xKey,     float(s.getX())) #Astrom()))
-                    rec.setD(yKey,     float(s.getY())) #Astrom()))
-                    
-                    # fluxes
-                    rec.setD(psfKey,   float(s.getPsfFlux())/fmag0)
-                    rec.setD(apKey,    float(s.getApFlux())/fmag0)
-                    rec.setD(modKey,   float(s.getModelFlux())/fmag0)
-                    rec.setD(instKey,  float(s.getInstFlux())/fmag0)
-
-                    # shapes
-                    rec.setD(ixxKey,   float(s.getIxx()))
-                    rec.setD(iyyKey,   float(s.getIyy()))
-                    rec.setD(ixyKey,   float(s.getIxy()))
-                    
-                    # flags
-                    rec.setD(intCenKey, s.get('flags.pixel.interpolated.center')+0.0)
-                    rec.setD(negKey,    s.get('flags.negative')+0.0)
-                    rec.setD(edgeKey,   s.get('flags.pixel.edge')+0.0)
-                    rec.setD(badCenKey, s.get('flags.badcentroid')+0.0)
-                    rec.setD(satCenKey, s.get('flags.pixel.saturated.center')+0.0)
-                    rec.setD(extKey,    s.get('classification.extendedness')+0.0)
-                    
-                    
-                    # flux errors
-                    psfFluxErr  = qaDataUtils.calibFluxError(float(s.getPsfFlux()), float(s.getPsfFluxErr()),
-                                                             fmag0, fmag0Err)
-                    rec.setD(psfErrKey, psfFluxErr)
-
-                    apFluxErr   = qaDataUtils.calibFluxError(float(s.getApFlux()),  float(s.getApFluxErr()),
-                                                             fmag0, fmag0Err)
-                    rec.setD(apErrKey, apFluxErr)
-                    
-                    modFluxErr  = qaDataUtils.calibFluxError(float(s.getModelFlux()), float(s.getModelFluxErr()),
-                                                             fmag0, fmag0Err)
-                    rec.setD(modErrKey, modFluxErr)
-                    
-                    instFluxErr = qaDataUtils.calibFluxError(float(s.getInstFlux()),  float(s.getInstFluxErr()),
-                                                             fmag0, fmag0Err)
-                    rec.setD(instErrKey, instFluxErr)
-
-
-                self.sourceSetCache[dataKey] = catObj.catalog
-                ssDict[dataKey] = copy.copy(catObj.catalog)
+                # the butler catalog is read contiguously from disk, so we can take whole columns
+                if not sourceCatalog.isContiguous():
+                    sourceCatalog = sourceCatalog.copy(deep=True)
+                columns = sourceCatalog.columns
+
+                cat = pqaSource.ColumnCatalog(len(sourceCatalog))
+                cat.setColumn('Id',      sourceCatalog.get('id'))
+                cat.setColumn('Ra',      sourceCatalog.get('coord.ra'))
+                cat.setColumn('Dec',     sourceCatalog.get('coord.dec'))
+                cat.setColumn('XAstrom', columns.getX())
+                cat.setColumn('YAstrom', columns.getY())
+
+                # shapes
+                cat.setColumn('Ixx',     columns.getIxx())
+                cat.setColumn('Iyy',     columns.getIyy())
+                cat.setColumn('Ixy',     columns.getIxy())
+
+                # flags
+                for name, field in (('FlagPixInterpCen', 'flags.pixel.interpolated.center'),
+                                    ('FlagNegative',     'flags.negative'),
+                                    ('FlagPixEdge',      'flags.pixel.edge'),
+                                    ('FlagBadCentroid',  'flags.badcentroid'),
+                                    ('FlagPixSaturCen',  'flags.pixel.saturated.center'),
+                                    ('Extendedness',     'classification.extendedness')):
+                    cat.setColumn(name, sourceCatalog.get(field))
+
+                # fluxes and flux errors
+                for name, flux, fluxErr in (
+                    ('Psf',   columns.getPsfFlux(),   columns.getPsfFluxErr()),
+                    ('Ap',    columns.getApFlux(),    columns.getApFluxErr()),
+                    ('Model', columns.getModelFlux(), columns.getModelFluxErr()),
+                    ('Inst',  columns.getInstFlux(),  columns.getInstFluxErr())):
+                    flux, fluxErr = qaDataUtils.calibrateFluxes(flux, fluxErr, fmag0, fmag0Err)
+                    cat.setColumn(name+'Flux', flux)
+                    cat.setColumn(name+'FluxErr', fluxErr)
+
+                self.sourceSetCache[dataKey] = cat
+                ssDict[dataKey] = copy.copy(cat)
                 self.dataIdLookup[dataKey] = dataId
 
  
@@ -601,12 +518,8 @@ class ButlerQaData(QaData):
         # if the dataIdRegex is identical to an earlier query, we must already have all the data
         dataIdStr = self._dataIdToString(dataIdRegex)
         if self.refObjectQueryCache.has_key(dataIdStr):
-            sroDict = {}
             # get only the ones that match the request
-            for key, sro in self.refObjectCache.items():
-                if re.search(dataIdStr, key):
-                    sroDict[key] = sro
-            return sroDict
+            return self._getMatchingEntries(self.refObjectCache, dataIdRegex, defineFully=False)
 
         self.printStartLoad("Loading RefObjects for: " + dataIdStr + "...")
         
@@ -618,9 +531,16 @@ class ButlerQaData(QaData):
 
         # get the datasets corresponding to the request
         sroDict = {}
+        # the reference catalog query shares one Astrometry object, so it isn't threaded
+        self.loadCalexp(dataIdRegex)
         for dataTuple in dataTuplesToFetch:
             dataId = self._dataTupleToDataId(dataTuple)
             dataKey = self._dataTupleToString(dataTuple)
+
+            # an earlier query for a different dataIdRegex may have loaded this one
+            if self.refObjectCache.has_key(dataKey):
+                sroDict[dataKey] = self.refObjectCache[dataKey]
+                continue
             
             wcs = self.getWcsBySensor(dataId)[dataKey]
             filterName = self.getFilterBySensor(dataId)[dataKey].getName()
@@ -628,21 +548,26 @@ class ButlerQaData(QaData):
             pixelMargin = 0.0
             refCat = astrom.getReferenceSourcesForWcs(wcs, imageSize, filterName, pixelMargin)
         
-            if not sroDict.has_key(dataKey):
-                sroDict[dataKey] = []
-            sros = sroDict[dataKey]
-            
-            for rec in refCat:
-                sro = simRefObj.SimRefObject()
-                sro.refObjectId = rec.getId()
-                sro.isStar = rec.get('stargal') + 0
-
+            n = len(refCat)
+            ids    = numpy.empty(n, dtype=numpy.int64)
+            isStar = numpy.empty(n, dtype=numpy.int32)
+            ra     = numpy.empty(n)
+            decl   = numpy.empty(n)
+            flux   = numpy.empty(n)
+            for i, rec in enumerate(refCat):
+                ids[i]    = rec.getId()
+                isStar[i] = rec.get('stargal') + 0
                 coo = rec.get('coord')
-                sro.setRa(coo.getRa().asDegrees())
-                sro.setDecl(coo.getDec().asDegrees())
-                sro.setFlux(rec.get('flux'), filterName)
+                ra[i]     = coo.getRa().asDegrees()
+                decl[i]   = coo.getDec().asDegrees()
+                flux[i]   = rec.get('flux')
 
-                sros.append(sro)
+            # only the filter we have a flux for gets a magnitude
+            mag = numpy.zeros((simRefObj.SimRefObjectSet.nMag, n), dtype=numpy.float32)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                mag[simRefObj.SimRefObject.flookup[filterName]] = \
+                    numpy.where(flux > 0, -2.5*numpy.log10(flux), numpy.NaN)
+            sroDict[dataKey] = simRefObj.SimRefObjectSet(ids, isStar, ra, decl, mag)
 
         self.printStopLoad()
         
@@ -665,20 +590,41 @@ class ButlerQaData(QaData):
         
         dataTuplesToFetch = self._regexMatchDataIds(dataIdRegex, self.dataTuples)
 
-        # get the datasets corresponding to the request
+        # the parts of a calexp are evicted together, but make sure we have them all
+        caches = [self.calexpCache, self.wcsCache, self.detectorCache, self.filterCache, self.calibCache]
+        dataTuplesToLoad = []
         for dataTuple in dataTuplesToFetch:
+            dataKey = self._dataTupleToString(dataTuple)
+            if not all([cache.has_key(dataKey) for cache in caches]):
+                dataTuplesToLoad.append(dataTuple)
+
+        def readCalexp(dataId):
+            if not self.outButler.datasetExists('calexp_md', dataId):
+                return None, None
+            calexp_md = self.outButler.get('calexp_md', dataId)
+            try:
+                psf = self.outButler.get("psf", visit=dataId['visit'],
+                                         raft=dataId['raft'], sensor=dataId['sensor'])
+            except Exception, e:
+                psf = None
+            return calexp_md, psf
+
+        fetched = self._fetchBySensor(readCalexp, dataTuplesToLoad)
+        
+        # get the datasets corresponding to the request
+        for dataTuple, calexpAndTime in zip(dataTuplesToLoad, fetched):
             dataId = self._dataTupleToDataId(dataTuple)
             dataKey = self._dataTupleToString(dataTuple)
-
-            if self.calexpCache.has_key(dataKey):
-                continue
+            calexpAndPsf, tRead = calexpAndTime
+            calexp_md, psf = calexpAndPsf
 
             self.printStartLoad("Loading Calexp for: " + dataKey + "...")
 
-            if self.outButler.datasetExists('calexp_md', dataId):
-                calexp_md = self.outButler.get('calexp_md', dataId)
+            if calexp_md is not None:
+                self.printMidLoad("read %.2fs, " % (tRead))
                 
-                self.wcsCache[dataKey]      = afwImage.makeWcs(calexp_md)
+                wcs = afwImage.makeWcs(calexp_md)
+                self.wcsCache[dataKey]      = wcs
 
                 ccdName = calexp_md.getAsString('DETNAME').strip()
                 names = ccdName.split()
@@ -698,23 +644,22 @@ class ButlerQaData(QaData):
                 self.calibCache[dataKey]    = afwImage.Calib(calexp_md)
 
                 # store the calexp as a dict
-                if not self.calexpCache.has_key(dataKey):
-                    self.calexpCache[dataKey] = {}
+                calexp = {}
 
                 nameLookup = qaDataUtils.getCalexpNameLookup()
                 for n in calexp_md.names():
                     val = calexp_md.get(n)
-                    self.calexpCache[dataKey][n] = val
+                    calexp[n] = val
 
                     # assign an alias to provide the same name as the database version uses.
                     if nameLookup.has_key(n):
                         n2 = nameLookup[n]
-                        self.calexpCache[dataKey][n2] = val
+                        calexp[n2] = val
 
                 # if we're missing anything in nameLookup ... put in a NaN
                 for calexpName,qaName in nameLookup.items():
-                    if not self.calexpCache[dataKey].has_key(qaName):
-                        self.calexpCache[dataKey][qaName] = numpy.NaN
+                    if not calexp.has_key(qaName):
+                        calexp[qaName] = numpy.NaN
 
 
                 # check the fwhm ... we know we need it
@@ -723,17 +668,16 @@ class ButlerQaData(QaData):
                 #  it wasn't already set by SEEING
                 sigmaToFwhm = 2.0*math.sqrt(2.0*math.log(2.0))
                 try:
-                    psf = self.outButler.get("psf", visit=dataId['visit'],
-                                             raft=dataId['raft'], sensor=dataId['sensor'])
                     fwhm = (psf.computeShape().getDeterminantRadius() *
-                            self.wcsCache[dataKey].pixelScale().asArcseconds() * sigmaToFwhm)
+                            wcs.pixelScale().asArcseconds() * sigmaToFwhm)
                 except Exception, e:
                     fwhm = -1.0
 
-                if (self.calexpCache[dataKey].has_key('fwhm') and
-                    numpy.isnan(self.calexpCache[dataKey]['fwhm'])):
-                    self.calexpCache[dataKey]['fwhm'] = fwhm
-                
+                if (calexp.has_key('fwhm') and numpy.isnan(calexp['fwhm'])):
+                    calexp['fwhm'] = fwhm
+
+                # set it once filled, so it's counted at its full size
+                self.calexpCache[dataKey] = calexp
                 self.calexpQueryCache[dataKey] = True
                 self.dataIdLookup[dataKey] = dataId
 
@@ -787,33 +731,91 @@ class ButlerQaData(QaData):
         @param availableDataTuples data sets available to be retrieved.
         """
 
-        # go through the list of what's available, and compare to what we're asked for
-        # Put matches in a list of tuples, eg. [(vis1,sna1,raf1,sen1),(vis2,sna2,raf2,sen2)] 
-        dataTuples = []
-        for dataTuple in availableDataTuples:
-            if verbose:
+        if verbose:
+            for dataTuple in availableDataTuples:
                 print dataTuple
-            # start true and fail if any dataId keys fail ... eg. 'visit' doesn't match
-            match = True
+
+        # a dataId value matches if its regex is found in it (eg. visit 85 matches 855 and 1855)
+        regexes = tuple([str(dataIdRegexDict.get(dataIdName, '.*')) for dataIdName in self.dataIdNames])
+
+        index = self._getDataTupleIndex(availableDataTuples)
+        if not index['matches'].has_key(regexes):
+            # go through the values available for each dataId name, and compare to what we're asked for
+            nodes = [index['tree']]
             for i in range(len(self.dataIdNames)):
-                dataIdName = self.dataIdNames[i]   # eg. 'visit', 'sensor', etc
-                regexForThisId = dataIdRegexDict.get(dataIdName, '.*') # default to '.*' or 'anything'
-                dataId = dataTuple[i]
-
-                # if it doesn't match, this frame isn't to be run.
-                if not re.search(str(regexForThisId),  str(dataId)):
-                    match = False
-                    break
+                matching = self._matchDataIdValues(index, i, regexes[i])
+                nextNodes = []
+                for node in nodes:
+                    if len(matching) < len(node):
+                        nextNodes += [node[value] for value in matching if node.has_key(value)]
+                    else:
+                        nextNodes += [child for value, child in node.iteritems() if value in matching]
+                nodes = nextNodes
+
+            # Put matches in a list of tuples, eg. [(vis1,sna1,raf1,sen1),(vis2,sna2,raf2,sen2)],
+            # in the order they're available
+            positions = sorted([position for node in nodes for position in node])
+            index['matches'][regexes] = [availableDataTuples[position] for position in positions]
                 
-                # ignore the guiding ccds on the hsc camera
-                if re.search('^hsc.*', self.cameraInfo.name) and dataIdName == 'ccd' and dataId > 99:
-                    match = False
-                    break
+        return list(index['matches'][regexes])
 
-            if match:
-                dataTuples.append(dataTuple)
-                
-        return dataTuples
+    def _getDataTupleIndex(self, availableDataTuples):
+        """Get the index _regexMatchDataIds() uses for a list of data tuples, making it if needed.
+
+        The index is a tree of dicts keyed by the values of each dataId name in turn, with lists
+        of the tuples' positions at the bottom, plus memos of what's been matched so far.
+
+        @param availableDataTuples data sets available to be retrieved.
+        """
+        index = self.dataTupleIndexes.get(id(availableDataTuples))
+        if (index is None) or (index['dataTuples'] is not availableDataTuples) or \
+                (index['length'] != len(availableDataTuples)):
+            n = len(self.dataIdNames)
+            tree = {}
+            for position, dataTuple in enumerate(availableDataTuples):
+                node = tree
+                for value in dataTuple[0:n-1]:
+                    if not node.has_key(value):
+                        node[value] = {}
+                    node = node[value]
+                if not node.has_key(dataTuple[n-1]):
+                    node[dataTuple[n-1]] = []
+                node[dataTuple[n-1]].append(position)
+
+            index = {
+                'dataTuples' : availableDataTuples,
+                'length'     : len(availableDataTuples),
+                'tree'       : tree,
+                'values'     : [set(values) for values in zip(*availableDataTuples)] or [set()]*n,
+                'valueMatches' : [{} for i in range(n)],  # regex -> matching values, for each name
+                'matches'    : {},                        # regexes -> matching tuples
+                }
+            self.dataTupleIndexes[id(availableDataTuples)] = index
+        return index
+
+    def _matchDataIdValues(self, index, i, regex):
+        """Get the set of available values of the i'th dataId name which match regex.
+
+        @param index The _getDataTupleIndex() index to look in
+        @param i     Which of self.dataIdNames to match
+        @param regex The regex for it, found anywhere in the value
+        """
+        valueMatches = index['valueMatches'][i]
+        if not valueMatches.has_key(regex):
+            if regex == '.*':
+                matching = set(index['values'][i])
+            elif re.search("[.^$*+?{}\\[\\]\\\\|()]", regex):
+                compiled = re.compile(regex)
+                matching = set([value for value in index['values'][i] if compiled.search(str(value))])
+            else:
+                # no special characters, the regex is just a substring
+                matching = set([value for value in index['values'][i] if regex in str(value)])
+
+            # ignore the guiding ccds on the hsc camera
+            if re.search('^hsc.*', self.cameraInfo.name) and self.dataIdNames[i] == 'ccd':
+                matching = set([value for value in matching if not value > 99])
+            valueMatches[regex] = matching
+        return valueMatches[regex]
                 
 
     
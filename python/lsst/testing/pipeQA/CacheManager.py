@@ -0,0 +1,186 @@
+import sys
+import collections
+import numpy
+
+
+def approxSize(obj, depth=0):
+    """Estimate the memory used by a cached object, in bytes.
+
+    numpy arrays count their data; lists, dicts and python objects count their contents
+    (long lists from a sample of their entries).  Wrapped C++ objects (eg. afw records)
+    don't show their size to python, so they're counted as a few hundred bytes.
+
+    @param obj   The object to size
+    @param depth How deeply nested obj is (deep contents are sized more roughly)
+    """
+    if isinstance(obj, numpy.ndarray):
+        return obj.nbytes + 96
+    if obj is None or isinstance(obj, (bool, int, long, float, basestring)):
+        return sys.getsizeof(obj)
+    if depth > 4:
+        return 256
+
+    if isinstance(obj, dict):
+        size = sys.getsizeof(obj)
+        for key, value in obj.iteritems():
+            size += approxSize(key, depth+1) + approxSize(value, depth+1)
+        return size
+    if isinstance(obj, (list, tuple)):
+        size = sys.getsizeof(obj)
+        n = len(obj)
+        if n > 0:
+            # assume the rest are like a sample of the entries
+            sample = obj[::max(1, n//8)][0:8]
+            size += n*sum([approxSize(x, depth+1) for x in sample])//len(sample)
+        return size
+    if hasattr(obj, '__dict__'):
+        return sys.getsizeof(obj) + approxSize(obj.__dict__, depth+1)
+    return max(sys.getsizeof(obj), 256)
+
+
+class LruCache(dict):
+    """A dict whose entries are kept within the memory budget of a CacheManager.
+
+    Setting an entry, or getting one with [] or get(), marks it as most recently used.
+    The manager may remove entries when others are set.
+    """
+
+    def __init__(self, manager, name):
+        """
+        @param manager The CacheManager keeping track of this cache
+        @param name    What's cached, for printouts
+        """
+        dict.__init__(self)
+        self.manager = manager
+        self.name    = name
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.manager.add(self, key, value)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        self.manager.touch(self, key)
+        return value
+
+    def get(self, key, default=None):
+        if dict.has_key(self, key):
+            return self[key]
+        return default
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.manager.remove(self, key)
+
+    def clear(self):
+        for key in self.keys():
+            del self[key]
+
+
+class CacheManager(object):
+    """Keep the total size of the entries of several LruCaches within a memory budget.
+
+    When the total goes over maxBytes, the least recently used entries are removed,
+    except those which are pinned (eg. the data for the dataId being tested) and the one
+    just added.  Caches can be linked, so an entry is removed from all of them together.
+    """
+
+    def __init__(self, maxBytes=None, onEvict=None):
+        """
+        @param maxBytes Largest total size of the cached entries (None for no limit)
+        @param onEvict  Function called with the list of keys removed after each eviction
+        """
+        self.maxBytes = maxBytes
+        self.onEvict  = onEvict
+        self.isPinned = None
+        self.links    = {}  # id(cache) -> the caches linked with it
+
+        # [cache, key, size] for each entry, least recently used first
+        self.entries  = collections.OrderedDict()
+        self.nBytes   = 0
+
+    def makeCache(self, name):
+        """Make a new LruCache kept by this manager.
+
+        @param name What's cached, for printouts
+        """
+        return LruCache(self, name)
+
+    def link(self, caches):
+        """Evict the entries of several caches together, eg. the parts of one calexp.
+
+        When an entry is evicted from one of the caches, the entries with the same key are
+        evicted from the others, so a loader can check any one of them to see what's loaded.
+
+        @param caches List of LruCaches made by this manager
+        """
+        for cache in caches:
+            self.links[id(cache)] = caches
+
+    def pin(self, isPinned):
+        """Keep entries from being evicted.
+
+        @param isPinned Function which takes a cache key and returns True if it mustn't be evicted,
+                        or None to allow any entry to be evicted
+        """
+        self.isPinned = isPinned
+
+    def add(self, cache, key, value):
+        """Note that cache[key] has been set to value, and evict entries if we're over budget."""
+        self.remove(cache, key)
+        size = approxSize(value)
+        self.entries[(id(cache), key)] = [cache, key, size]
+        self.nBytes += size
+        self.evict()
+
+    def touch(self, cache, key):
+        """Note that cache[key] has been used."""
+        ident = (id(cache), key)
+        entry = self.entries.pop(ident, None)
+        if entry is not None:
+            self.entries[ident] = entry
+
+    def remove(self, cache, key):
+        """Forget about cache[key] (it's been deleted)."""
+        entry = self.entries.pop((id(cache), key), None)
+        if entry is not None:
+            self.nBytes -= entry[2]
+
+    def evict(self):
+        """Remove the least recently used entries which aren't pinned until we're within maxBytes."""
+        if (self.maxBytes is None) or (self.nBytes <= self.maxBytes):
+            return
+
+        evicted = []
+        idents = self.entries.keys()
+        # keep the one just added, and the parts linked with it (they're probably being filled)
+        newCache, newKey = self.entries[idents[-1]][0:2]
+        for ident in idents[:-1]:
+            if self.nBytes <= self.maxBytes:
+                break
+            if not self.entries.has_key(ident):
+                continue            # already evicted with a linked cache
+            cache, key, size = self.entries[ident]
+            if (self.isPinned is not None) and self.isPinned(key):
+                continue
+            linkedCaches = self.links.get(id(cache), [cache])
+            if key == newKey and [c for c in linkedCaches if c is newCache]:
+                continue
+            for linked in linkedCaches:
+                entry = self.entries.pop((id(linked), key), None)
+                if entry is not None:
+                    dict.__delitem__(linked, key)
+                    self.nBytes -= entry[2]
+            evicted.append(key)
+
+        if len(evicted) > 0 and self.onEvict is not None:
+            self.onEvict(evicted)
+
+    def printSummary(self):
+        """Print the number of entries and bytes held by each cache."""
+        summary = {}
+        for cache, key, size in self.entries.values():
+            n, nBytes = summary.get(cache.name, (0, 0))
+            summary[cache.name] = (n + 1, nBytes + size)
+        for name in sorted(summary.keys()):
+            print "%-20s %6d %10.1f Mb" % (name, summary[name][0], summary[name][1]/1024.0**2)
@@ -1,9 +1,16 @@
-import os
+import os, re
+import threading
+import collections
 import MySQLdb
+import MySQLdb.cursors
 import lsst.pex.policy as pexPolicy
 import time
 from lsst.pex.logging import Trace
 
+import numpy
+
+from QueryCache import QueryCache, normalizeSql, toColumn
+
 class DatabaseIdentity:
     """
     Requires file that looks like:
@@ -30,6 +37,132 @@ class DatabaseIdentity:
         self.mySqlPasswd = authPolicy.get("password")
         
 
+# Connection pooling
+class PooledConnection(object):
+    """A DB-API connection with the process which opened it and when it was last used."""
+    def __init__(self, conn):
+        self.conn     = conn
+        self.pid      = os.getpid()
+        self.lastUsed = time.time()
+
+
+class ConnectionPool(object):
+    """Open connections to one database, kept for reuse between queries.
+
+    A connection inherited through a fork belongs to the parent process.  Using or closing
+    it would break the parent's session (deleting it closes it too), so the child keeps a
+    reference to it and opens its own.
+    """
+    
+    def __init__(self, connectFunc, maxIdle=4, pingInterval=60.0):
+        """
+        @param connectFunc  Function returning a new DB-API connection
+        @param maxIdle      Most unused connections to keep open
+        @param pingInterval Check a connection is alive if it's been idle this long (seconds)
+        """
+        self.connectFunc  = connectFunc
+        self.maxIdle      = maxIdle
+        self.pingInterval = pingInterval
+        self.idle         = []
+        self.inherited    = []
+        self.lock         = threading.Lock()
+
+    def keepInherited(self, pooled):
+        """Hold on to a connection inherited through a fork, so it's never closed."""
+        self.lock.acquire()
+        try:
+            for other in self.inherited:
+                if other is pooled:
+                    return
+            self.inherited.append(pooled)
+        finally:
+            self.lock.release()
+
+    def isUsable(self, pooled):
+        """Check that pooled belongs to this process and is still connected."""
+        if pooled.pid != os.getpid():
+            self.keepInherited(pooled)
+            return False
+        if time.time() - pooled.lastUsed > self.pingInterval:
+            try:
+                if hasattr(pooled.conn, 'ping'):
+                    pooled.conn.ping()
+                else:
+                    cursor = pooled.conn.cursor()
+                    cursor.execute("SELECT 1")
+                    cursor.fetchall()
+                    cursor.close()
+            except Exception, e:
+                self.discard(pooled)
+                return False
+        return True
+        
+    def acquire(self):
+        """Get a usable connection, reusing an idle one if possible."""
+        self.lock.acquire()
+        try:
+            idle, self.idle = self.idle, []
+        finally:
+            self.lock.release()
+            
+        pooled = None
+        while idle:
+            candidate = idle.pop()
+            if candidate.pid != os.getpid():
+                self.keepInherited(candidate)
+            elif pooled is not None:
+                self.release(candidate)
+            elif self.isUsable(candidate):
+                pooled = candidate
+        
+        if pooled is None:
+            pooled = PooledConnection(self.connectFunc())
+        return pooled
+
+    def release(self, pooled):
+        """Return a connection from acquire() to the pool."""
+        if pooled.pid != os.getpid():
+            self.keepInherited(pooled)
+            return
+        pooled.lastUsed = time.time()
+        self.lock.acquire()
+        try:
+            if len(self.idle) < self.maxIdle:
+                self.idle.append(pooled)
+                return
+        finally:
+            self.lock.release()
+        self.discard(pooled)
+
+    def discard(self, pooled):
+        """Close a connection from acquire() which is broken or not needed."""
+        if pooled.pid != os.getpid():
+            self.keepInherited(pooled)
+            return
+        try:
+            pooled.conn.close()
+        except Exception, e:
+            pass
+
+
+# one pool per database, shared by all the LsstSimDbInterface objects using it
+_connectionPools = {}
+
+def getConnectionPool(dbId):
+    """Get the ConnectionPool for the MySQL database described by a DatabaseIdentity."""
+    key = (dbId.mySqlHost, dbId.mySqlDb, dbId.mySqlUser)
+    if not _connectionPools.has_key(key):
+        def connectFunc():
+            return MySQLdb.connect(
+                host   = dbId.mySqlHost,
+                db     = dbId.mySqlDb,
+                user   = dbId.mySqlUser,
+                passwd = dbId.mySqlPasswd
+                )
+        _connectionPools[key] = ConnectionPool(connectFunc)
+    return _connectionPools[key]
+
+    
 # Base class
 class DatabaseInterface():
     def __init__(self):
@@ -41,59 +174,238 @@ class LsstSimDbInterface(DatabaseInterface):
     # Mapping from filter names to database names
     filterMap = { "u" : 0, "g" : 1, "r" : 2, "i" : 3, "z" : 4 }
 
-    def __init__(self, dbId):
+    def __init__(self, dbId, connectFunc=None):
         """
-        @param dbId  A databaseIdentity object contain connection information
+        @param dbId        A databaseIdentity object contain connection information
+        @param connectFunc Function returning a new DB-API connection to use instead of MySQL,
+                           eg. to run against a local sqlite3 database.
         """
         self.dbId = dbId
         DatabaseInterface.__init__(self)
 
+        if connectFunc is None:
+            self.pool = getConnectionPool(dbId)
+            self.streamCursorClass = MySQLdb.cursors.SSCursor
+        else:
+            self.pool = ConnectionPool(connectFunc)
+            self.streamCursorClass = None
+
+        # queries go to one connection, so session variables (eg. @poly) carry over
+        self.session = None
+        self.streaming = False
         self.connect()
 
+        self.queryCache = None
+
+    def __del__(self):
+        # give our connection back for the next LsstSimDbInterface to use
+        try:
+            if self.session is not None:
+                self.pool.release(self.session)
+                self.session = None
+        except Exception, e:
+            pass
+
 
     def connect(self):
-        self.db     = MySQLdb.connect(
-            host   = self.dbId.mySqlHost,
-            db     = self.dbId.mySqlDb,
-            user   = self.dbId.mySqlUser,
-            passwd = self.dbId.mySqlPasswd
-            )
-        self.cursor = self.db.cursor()
+        """Make sure our session connection is usable, replacing it if not."""
+        if (self.session is None) or (not self.pool.isUsable(self.session)):
+            self.session = self.pool.acquire()
 
+    def _cursor(self, pooled, cursorClass=None):
+        if cursorClass is None:
+            return pooled.conn.cursor()
+        return pooled.conn.cursor(cursorClass)
 
-    def execute(self, sql):
-        """Execute an sql command
+    def _executeOn(self, sql, cursorClass=None):
+        """Execute sql on the session connection, or on a spare one while a stream is using it.
 
-        @param sql Command to be executed.
+        Returns the connection used and the cursor.
         """
-        Trace("lsst.testing.pipeQA.LsstSimDbInterface", 3, "Executing: %s" % (sql))
-        t0 = time.time()
-
-        #print "mysql>", sql
         
-        # forking to handle plotting the summary figures causes (i think)
-        # a disconnection when the child exits.  Need to reconnect when
-        connected = True
+        if self.streaming:
+            pooled = self.pool.acquire()
+        else:
+            self.connect()
+            pooled = self.session
+
+        # forking to handle plotting the summary figures used to cause a disconnection
+        # when the child exited, and the server may drop idle connections.  If the
+        # query fails, retry it once on a new connection ... unless it uses session
+        # variables (eg. @poly), which the new connection wouldn't have.
         try:
-            self.cursor.execute(sql)
+            cursor = self._cursor(pooled, cursorClass)
+            cursor.execute(sql)
         except Exception, e:
-            connected = False
-
-        if not connected:
-            #print "Mysql connection broken.  Reconnecting."
-            self.connect()
+            if "@" in sql:
+                print sql
+                raise
+            self.pool.discard(pooled)
+            pooled = self.pool.acquire()
+            if not self.streaming:
+                self.session = pooled
 
             # if something blows-up lets see the query and re-raise
             try:
-                self.cursor.execute(sql)
+                cursor = self._cursor(pooled, cursorClass)
+                cursor.execute(sql)
             except Exception, e:
                 print sql
                 raise
+        return pooled, cursor
+        
+
+    def setQueryCache(self, queryCache):
+        """Keep the results of queries in a QueryCache, so they're reused by later runs.
+
+        Statements which only set up the session (SELECT ... INTO @var, SET @var, CALL)
+        are held back until a query which depends on them isn't in the cache.  A query
+        mentioning a session variable is keyed by the statements which set up the session.
+        Only the latest statement for each target (eg. @poly) is kept, so a run of cached
+        queries doesn't leave a backlog of statements to replay.
+        
+        @param queryCache A QueryCache, or None to stop caching.
+        """
+        self.queryCache     = queryCache
+        self.sessionState   = {}  # what each session statement sets -> its normalized sql
+        self.pendingSession = collections.OrderedDict()  # target -> latest statement not yet run
+
+    def _sessionTarget(self, sql):
+        """Get what a session set-up statement sets (eg. '@poly'), or None for other statements."""
+        m = re.search("\\bINTO\\s+(@\\w+)", sql, re.IGNORECASE) or \
+            re.match("SET\\s+(@\\w+)", sql, re.IGNORECASE)
+        if m:
+            return m.group(1)
+        m = re.match("CALL\\s+([\\w.]+)", sql, re.IGNORECASE)
+        if m:
+            return "CALL " + m.group(1)
+        return None
+
+    def _runPendingSession(self):
+        pending, self.pendingSession = self.pendingSession, collections.OrderedDict()
+        for sql in pending.values():
+            self._execute(sql)
+
+    def execute(self, sql):
+        """Execute an sql command
+
+        @param sql Command to be executed.
+        """
+        if self.queryCache is None:
+            return self._execute(sql)
+
+        norm = normalizeSql(sql)
+        target = self._sessionTarget(norm)
+        if target is not None:
+            self.sessionState[target] = norm
+            # replace any earlier statement for the target, and run this one after the others
+            self.pendingSession.pop(target, None)
+            self.pendingSession[target] = sql
+            return ()
+        
+        if not re.match("SELECT\\b", norm, re.IGNORECASE):
+            # eg. CREATE or INSERT ... run it, and don't cache it
+            self._runPendingSession()
+            return self._execute(sql)
+
+        database, context = self._cacheKey(norm)
+        results = self.queryCache.get(database, norm, context)
+        if results is None:
+            # the query may also depend on what the session statements made (eg. scisql.Region)
+            self._runPendingSession()
+            results = self._execute(sql)
+            self.queryCache.put(database, norm, context, results)
+        else:
+            Trace("lsst.testing.pipeQA.LsstSimDbInterface", 3, "Cached: %s" % (sql))
+        return results
+
+    def _cacheKey(self, norm):
+        """Get the database and session context which the cached result of a query is keyed by.
 
-        results = self.cursor.fetchall()
+        @param norm The normalized query
+        """
+        context = []
+        if "@" in norm:
+            context = [self.sessionState[k] for k in sorted(self.sessionState.keys())]
+        return str(getattr(self.dbId, 'mySqlDb', "")), context
+    
+    def _execute(self, sql):
+        Trace("lsst.testing.pipeQA.LsstSimDbInterface", 3, "Executing: %s" % (sql))
+        t0 = time.time()
+
+        #print "mysql>", sql
+        
+        pooled, cursor = self._executeOn(sql)
+        results = cursor.fetchall()
+        cursor.close()
+        if pooled is not self.session:
+            self.pool.release(pooled)
+        
         t1 = time.time()
         #print " (t=%.2fs) " % (t1-t0)
         Trace("lsst.testing.pipeQA.LsstSimDbInterface", 2, "Time for SQL query: %.2f s" % (t1-t0))
         return results
 
-    
+
+    def executeStream(self, sql, batchSize=10000):
+        """Execute an sql command, and yield the rows in lists of at most batchSize.
+
+        The rows are read from the server as they're needed (with a MySQL SSCursor), so
+        only one batch is held in memory.  Other queries can be run while the stream is
+        open, but they go to a different connection, without our session variables.
+
+        With a QueryCache, a cached result is read back in batches instead.  Otherwise
+        each batch is packed into numpy columns as it's passed on, and the result is
+        stored once the stream is read to the end.
+
+        @param sql       Command to be executed.
+        @param batchSize Number of rows in each batch.
+        """
+        Trace("lsst.testing.pipeQA.LsstSimDbInterface", 3, "Streaming: %s" % (sql))
+        t0 = time.time()
+
+        chunks = None
+        if self.queryCache is not None:
+            norm = normalizeSql(sql)
+            if re.match("SELECT\\b", norm, re.IGNORECASE):
+                database, context = self._cacheKey(norm)
+                cached = self.queryCache.getColumns(database, norm, context)
+                if cached is not None:
+                    Trace("lsst.testing.pipeQA.LsstSimDbInterface", 3, "Cached: %s" % (sql))
+                    nRow, columns = cached
+                    for i in range(0, nRow, batchSize):
+                        yield zip(*[column[i:i+batchSize].tolist() for column in columns])
+                    return
+                chunks = []
+            if "@" in norm:
+                self._runPendingSession()
+
+        nRow = 0
+        pooled, cursor = self._executeOn(sql, self.streamCursorClass)
+        ownSession = pooled is self.session
+        if ownSession:
+            self.streaming = True
+        try:
+            while True:
+                rows = cursor.fetchmany(batchSize)
+                if not rows:
+                    break
+                rows = list(rows)
+                if chunks is not None:
+                    chunks.append([toColumn(values) for values in zip(*rows)])
+                    nRow += len(rows)
+                yield rows
+        finally:
+            # an SSCursor reads any rows left unread when it's closed
+            cursor.close()
+            if ownSession:
+                self.streaming = False
+            else:
+                self.pool.release(pooled)
+
+        if chunks is not None:
+            columns = [numpy.concatenate(column) for column in zip(*chunks)]
+            self.queryCache.putColumns(database, norm, context, nRow, columns)
+            
+        t1 = time.time()
+        Trace("lsst.testing.pipeQA.LsstSimDbInterface", 2, "Time for SQL stream: %.2f s" % (t1-t0))
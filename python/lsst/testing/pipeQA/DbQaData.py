@@ -11,9 +11,11 @@ import lsst.afw.cameraGeom              as cameraGeom
 import CameraInfo                       as qaCamInfo
 
 from DatabaseQuery import LsstSimDbInterface, DatabaseIdentity
+from QueryCache    import QueryCache
 from QaData        import QaData
 
 import QaDataUtils as qaDataUtils
+import Htm          as htm
 import simRefObject as simRefObj
 import source       as pqaSource
 
@@ -61,16 +63,28 @@ class Timer(object):
 class DbQaData(QaData):
     #Qa__init__(self, label, rerun, dataInfo):
 
+    # most sensors to load reference objects for in one query
+    refObjectBatchSize = 64
+
     def __init__(self, database, rerun, cameraInfo, **kwargs):
         """
         @param database The name of the database to connect to
         @param rerun The data rerun to use
         @param cameraInfo A cameraInfo object describing the camera for these data
+
+        @param queryCacheDir      keep query results in this directory, to reuse them in later runs
+        @param queryCacheMaxBytes largest total size of the query results kept in queryCacheDir
+        @param cacheMaxBytes      memory budget for the data cached in memory (None for no limit)
         """
-        QaData.__init__(self, database, rerun, cameraInfo)
+        QaData.__init__(self, database, rerun, cameraInfo, cacheMaxBytes=kwargs.get('cacheMaxBytes', None))
         self.dbId        = DatabaseIdentity(self.label)
         self.dbInterface = LsstSimDbInterface(self.dbId)
 
+        queryCacheDir = kwargs.get('queryCacheDir', None)
+        if queryCacheDir is not None:
+            queryCache = QueryCache(queryCacheDir, kwargs.get('queryCacheMaxBytes', 1024**3))
+            self.dbInterface.setQueryCache(queryCache)
+
         self.refStr = {'obj' : ('Obj', 'object'), 'src' : ('Src', 'source') }
 
         self.coaddTable  = kwargs.get('coaddTable', 'goodSeeing')
@@ -155,18 +169,31 @@ class DbQaData(QaData):
         QaData.initCache(self)
         # need to intialize these differently than base class
         # ... Db has 'object' and 'source' matching to be cached
-        self.matchListCache = { 'obj': {}, 'src': {} }
+        self.matchListCache = { 'obj': self.cacheManager.makeCache("matchList"),
+                                'src': self.cacheManager.makeCache("matchList") }
         self.matchQueryCache = { 'obj' : {}, 'src': {} }
         
 
-    def calibFluxError(self, f, df, f0, df0):
-        val = numpy.NaN 
-        try:
-            return (df/f + df0/f0)*f/f0
-        except FloatingPointError:
-            val = numpy.NaN 
-        return val
+    def _dbColumnToArray(self, values):
+        """Convert a column of query results to a float array.
+
+        NULLs become NaN, and single-character (BIT) flags become 1.0 or 0.0.
 
+        @param values Sequence of values for one column, as returned by the database
+        """
+        try:
+            return numpy.array(values, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            column = numpy.empty(len(values), dtype=numpy.float64)
+            for i in xrange(len(values)):
+                value = values[i]
+                if value is None:
+                    value = numpy.NaN
+                elif isinstance(value, str) and len(value) == 1:
+                    value = 1.0 if ord(value) else 0.0
+                column[i] = value
+            return column
+        
     def getMatchListBySensor(self, dataIdRegex, useRef='src'):
         """Get a dict of all SourceMatches matching dataId, with sensor name as dict keys.
 
@@ -213,19 +240,15 @@ class DbQaData(QaData):
         if not re.search("\%", idWhere) and haveAllKeys:
             dataIdCopy = copy.copy(dataIdRegex)
             dataIdCopy['snap'] = "0"
-            key = self._dataIdToString(dataIdCopy, defineFully=True)
+            key = self._dataIdToKey(dataIdCopy)
             if self.matchListCache[useRef].has_key(key):
                 return {key : self.matchListCache[useRef][key]}
 
         # if the dataIdRegex is identical to an earlier query, we must already have all the data
         dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)
         if self.matchQueryCache[useRef].has_key(dataIdStr):
-            matchListDict = {}
             # get only the ones that match the request
-            for key, matchList in self.matchListCache[useRef].items():
-                if re.search(dataIdStr, key):
-                    matchListDict[key] = matchList
-            return matchListDict
+            return self._getMatchingEntries(self.matchListCache[useRef], dataIdRegex)
 
         
         sql += idWhere
@@ -263,115 +286,62 @@ class DbQaData(QaData):
         
         self.sqlCache['match'][dataIdStr] = sql
         
-        # parse results and put them in a sourceSet
+        # group the rows by sensor
+        nFields = 7 + nDataId
+        keyLookup = {}
+        rowsByKey = {}
+        for row in results:
+            idValues = row[0:nDataId]
+            if not keyLookup.has_key(idValues):
+                dataIdTmp = {}
+                for j in range(nDataId):
+                    dataIdTmp[sceNames[j][0]] = idValues[j]
+                key = self._dataIdToKey(dataIdTmp)
+                self.dataIdLookup[key] = dataIdTmp
+                keyLookup[idValues] = key
+            key = keyLookup[idValues]
+            if not rowsByKey.has_key(key):
+                rowsByKey[key] = []
+            rowsByKey[key].append(row)
+
+        # put each sensor's matches in columns, and calibrate them
+        # note: the ApFlux error has always been computed with the PsfFlux
         multiplicity = {}
         matchListDict = {}
-        for row in results:
-
-
-            nFields = 7 + nDataId
-            
-            mag, ra, dec, isStar, refObjId, srcId, nMatches = row[nDataId:nFields]
-            dataIdTmp = {}
-            for j in range(nDataId):
-                idName = sceNames[j][0]
-                dataIdTmp[idName] = row[j]
-
-
-            key = self._dataIdToString(dataIdTmp, defineFully=True)            
-            self.dataIdLookup[key] = dataIdTmp
-
-            if not matchListDict.has_key(key):
-                refCatObj = pqaSource.RefCatalog()
-                refCat    = refCatObj.catalog
-                catObj    = pqaSource.Catalog()
-                cat       = catObj.catalog
-                
-                matchListDict[key] = []
-                
-                refRaKey   = refCatObj.keyDict['Ra']
-                refDecKey  = refCatObj.keyDict['Dec']
-                refPsfKey  = refCatObj.keyDict['PsfFlux']
-                refApKey   = refCatObj.keyDict['ApFlux']
-                refModKey  = refCatObj.keyDict['ModelFlux']
-                refInstKey = refCatObj.keyDict['InstFlux']
-
-                psfKey     = catObj.keyDict['PsfFlux']
-                apKey      = catObj.keyDict['ApFlux']
-                modKey     = catObj.keyDict['ModelFlux']
-                instKey    = catObj.keyDict['InstFlux']
-                
-                psfErrKey  = catObj.keyDict['PsfFluxErr']
-                apErrKey   = catObj.keyDict['ApFluxErr']
-                modErrKey  = catObj.keyDict['ModelFluxErr']
-                instErrKey = catObj.keyDict['InstFluxErr']
-
-                
-            matchList = matchListDict[key]
-
-            # reference objects
-            sref = refCat.addNew()
-
-            sref.setId(refObjId)
-            sref.setD(refRaKey, ra)
-            sref.setD(refDecKey, dec)
-            
+        for key, rows in rowsByKey.items():
+            columns = zip(*rows)
+            nRow = len(rows)
+            mag, ra, dec, isStar, refObjId, srcId, nMatches = columns[nDataId:nFields]
+
+            refs = pqaSource.RefColumnCatalog(nRow)
+            refs.setColumn('Id', refObjId)
+            refs.setColumn('Ra', self._dbColumnToArray(ra))
+            refs.setColumn('Dec', self._dbColumnToArray(dec))
             # clip at -30
-            if mag < -30:
-                mag = -30
-            flux = 10**(-mag/2.5)
-
-            sref.setD(refPsfKey, flux)
-            sref.setD(refApKey, flux)
-            sref.setD(refModKey, flux)
-            sref.setD(refInstKey, flux)
-
-            # sources
-            s = cat.addNew()
-            s.setId(srcId)
-            s.setD(catObj.keyDict['Extendedness'], 0.0 if isStar else 1.0)
-            
-            i = 0
-            for value in row[nFields:]:
-               if value is not None:
-                    setKey = catObj.setKeys[i]
-                    if isinstance(value, str):
-                        value = 1.0 if ord(value) else 0.0
-                    s.setD(setKey, value)
-               i += 1
-
-            #sref.setFlagForDetection(sss.getFlagForDetection() | pqaSource.STAR)
+            flux = 10**(-numpy.maximum(self._dbColumnToArray(mag), -30.0)/2.5)
+            for name in ('PsfFlux', 'ApFlux', 'ModelFlux', 'InstFlux'):
+                refs.setColumn(name, flux)
+
+            sources = pqaSource.ColumnCatalog(nRow)
+            sources.setColumn('Id', srcId)
+            for i in range(len(setMethods)):
+                sources.setColumn(setMethods[i], self._dbColumnToArray(columns[nFields+i]))
+            # the reference star/galaxy flag stands in for a missing extendedness
+            ext = sources.getColumn('Extendedness')
+            noExt = numpy.isnan(ext)
+            ext[noExt] = numpy.where(numpy.array(isStar, dtype=bool)[noExt], 0.0, 1.0)
 
             fmag0, fmag0Err = calib[key].getFluxMag0()
-
-            # fluxes
-            s.setD(psfKey,   s.getD(psfKey)/fmag0)
-            s.setD(apKey,    s.getD(apKey)/fmag0)
-            s.setD(modKey,   s.getD(modKey)/fmag0)
-            s.setD(instKey,  s.getD(instKey)/fmag0)
-
-            # flux errors
-            psfFluxErr  = qaDataUtils.calibFluxError(s.getD(psfKey), s.getD(psfErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(psfErrKey, psfFluxErr)
-
-            apFluxErr   = qaDataUtils.calibFluxError(s.getD(psfKey),  s.getD(apErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(apErrKey, apFluxErr)
-
-            modFluxErr  = qaDataUtils.calibFluxError(s.getD(modKey), s.getD(modErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(modErrKey, modFluxErr)
-
-            instFluxErr = qaDataUtils.calibFluxError(s.getD(instKey),  s.getD(instErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(instErrKey, instFluxErr)
-
-            dist = 0.0
-
-            matchList.append([sref, s, dist])
-            multiplicity[s.getId()] = nMatches
-
+            for name in ('Psf', 'Ap', 'Model', 'Inst'):
+                sources.setColumn(name+'Flux', sources.getColumn(name+'Flux')/fmag0)
+            for name, fluxName in (('Psf', 'Psf'), ('Ap', 'Psf'), ('Model', 'Model'), ('Inst', 'Inst')):
+                sources.setColumn(name+'FluxErr',
+                                  qaDataUtils.calibFluxErrorArray(sources.getColumn(fluxName+'Flux'),
+                                                                  sources.getColumn(name+'FluxErr'),
+                                                                  fmag0, fmag0Err))
+
+            matchListDict[key] = pqaSource.MatchList(sources, refs)
+            multiplicity[key] = numpy.array(nMatches, dtype=numpy.int64)
         
         ######
         ######
@@ -387,62 +357,14 @@ class DbQaData(QaData):
             else:
                 refObjects = simRefObj.SimRefObjectSet() # an empty set
 
-                
-            typeDict[key] = {}
-                            
-            refIds     = []
-            for ro in refObjects:
-                refIds.append(ro.getId())
-                    
-            srcIds     = []
-            for so in sources:
-                srcIds.append(so.getId())
-                    
-            matRef     = []
-            matSrc     = []
-            for ma in matchList:
-                matRef.append(ma[0].getId())
-                matSrc.append(ma[1].getId())
-            
-            refIds = set(refIds)
-            srcIds = set(srcIds)
-            matRef = set(matRef)
-            matSrc = set(matSrc)
-            
-            undetectedIds = refIds - matRef
-            orphanIds     = srcIds - matSrc
-            matchedIds    = srcIds & matSrc   # Does not know about duplicates
-            #print 'Undet, orphan, matched:', len(undetectedIds), len(orphanIds), len(matchedIds)
-    
-            undetected = []
-            orphans    = []
-            matched    = []
-            blended    = []
-            for ro in refObjects:
-                if ro.getId() in undetectedIds:
-                    undetected.append(ro)
-            matchListById = dict([(m[1].getId(), m) for m in matchList])
-            matchIdsSet = set(matchListById.keys())
-            for so in sources:
-                soid = so.getId()
-                if soid in orphanIds:
-                    orphans.append(so)
-                if soid in matchedIds and soid in matchIdsSet:
-                    if multiplicity[soid] == 1:
-                        matched.append(matchListById[soid])
-                    else:
-                        #print -2.5*numpy.log10(so.getD(psfKey)), multiplicity[soid]
-                        blended.append(matchListById[soid])
+            # the database gives the number of matches (nMatches) for each source
+            typeDict[key] = self._classifyMatchList(sources, refObjects, matchList, multiplicity[key])
                         
             self.printMidLoad('\n        %s: Undet, orphan, matched, blended = %d %d %d %d' % (
-                key, len(undetected), len(orphans), len(matched), len(blended))
+                key, len(typeDict[key]['undetected']), len(typeDict[key]['orphan']),
+                len(typeDict[key]['matched']), len(typeDict[key]['blended']))
                               )
 
-            typeDict[key]['orphan']     = orphans
-            typeDict[key]['matched']    = matched
-            typeDict[key]['blended']    = blended
-            typeDict[key]['undetected'] = undetected
-
             typeDict[key]['sql'] = sql
             
             # cache it
@@ -511,75 +433,68 @@ class DbQaData(QaData):
         if not re.search("\%", sql) and haveAllKeys:
             dataIdCopy = copy.copy(dataIdRegex)
             dataIdCopy['snap'] = "0"
-            key = self._dataIdToString(dataIdCopy, defineFully=True)
+            key = self._dataIdToKey(dataIdCopy)
             if self.sourceSetCache.has_key(key):
                 return {key : self.sourceSetCache[key]}
 
         # if the dataIdRegex is identical to an earlier query, we must already have all the data
         dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)
         if self.queryCache.has_key(dataIdStr):
-            ssDict = {}
             # get only the ones that match the request
-            for key, ss in self.sourceSetCache.items():
-                if re.search(dataIdStr, key):
-                    ssDict[key] = ss
-            return ssDict
+            return self._getMatchingEntries(self.sourceSetCache, dataIdRegex)
 
         self.queryCache[dataIdStr] = True
         
         self.printStartLoad("Loading SourceSets for: " + dataIdStr + "...")
 
-        # run the query
-        results  = self.dbInterface.execute(sql)
-        self.sqlCache['src'][dataIdStr] = sql
         calib = self.getCalibBySensor(dataIdRegex)
 
-        
-        # parse results and put them in a sourceSet
+        # stream the query, turning each batch of rows into columns as it arrives,
+        # so only one batch of row tuples is held in memory at a time
+        nIdKeys = len(sceNames) + 1
+        keyLookup = {}
+        chunksByKey = {}
+        for batch in self.dbInterface.executeStream(sql):
+
+            # group the rows by sensor
+            rowsByKey = {}
+            for row in batch:
+                idValues = row[:nIdKeys-1]
+                if not keyLookup.has_key(idValues):
+                    dataIdTmp = {}
+                    for i in range(len(sceNames)):
+                        dataIdTmp[sceNames[i][0]] = idValues[i]
+                    key = self._dataIdToKey(dataIdTmp)
+                    self.dataIdLookup[key] = dataIdTmp
+                    keyLookup[idValues] = key
+                key = keyLookup[idValues]
+                if not rowsByKey.has_key(key):
+                    rowsByKey[key] = []
+                rowsByKey[key].append(row)
+
+            for key, rows in rowsByKey.items():
+                columns = zip(*rows)
+                chunk = [numpy.array(columns[nIdKeys-1], dtype=numpy.int64)]
+                for i in range(len(setMethods)):
+                    chunk.append(self._dbColumnToArray(columns[nIdKeys+i]))
+                if not chunksByKey.has_key(key):
+                    chunksByKey[key] = []
+                chunksByKey[key].append(chunk)
+            
+        self.sqlCache['src'][dataIdStr] = sql
+
+        # parse results and put them in a column catalog
         ssDict = {}
         for k in calib.keys():
-            catObj = pqaSource.Catalog()
-            ssDict[k] = catObj.catalog
-
-            psfKey = catObj.keyDict['PsfFlux']
-            apKey  = catObj.keyDict['ApFlux']
-            modKey = catObj.keyDict['ModelFlux']
-            instKey = catObj.keyDict['InstFlux']
-
-            psfErrKey = catObj.keyDict['PsfFluxErr']
-            apErrKey  = catObj.keyDict['ApFluxErr']
-            modErrKey = catObj.keyDict['ModelFluxErr']
-            instErrKey = catObj.keyDict['InstFluxErr']
-                
+            ssDict[k] = pqaSource.ColumnCatalog()
 
-        for row in results:
-
-            # get the values for the dataId
-            i = 0
-            dataIdTmp = {}
-            for idName, dbName in sceNames:
-                dataIdTmp[idName] = row[i]
-                i += 1
-            sid = row[i]
-            nIdKeys = i+1
-
-            key = self._dataIdToString(dataIdTmp, defineFully=True)
-            self.dataIdLookup[key] = dataIdTmp
-
-            s = ssDict[key].addNew()
-            
-            s.setId(sid)
-            
-            i = 0
-            for value in row[nIdKeys:]:
-                if value is not None:
-                    setKey = catObj.setKeys[i]
-                    #print value, type(value)
-                    if isinstance(value, str) and len(value) == 1:
-                        value = 1.0 if ord(value) else 0.0
-                    s.setD(setKey, value)
-                    #print catObj.setNames[i], value
-                i += 1
+        for key, chunks in chunksByKey.items():
+            columns = [numpy.concatenate(column) for column in zip(*chunks)]
+            cat = pqaSource.ColumnCatalog(len(columns[0]))
+            cat.setColumn('Id', columns[0])
+            for i in range(len(setMethods)):
+                cat.setColumn(setMethods[i], columns[1+i])
+            ssDict[key] = cat
 
             # calibrate it
             fmag0, fmag0Err = calib[key].getFluxMag0()
@@ -587,35 +502,15 @@ class DbQaData(QaData):
             if (fmag0 == 0.0):
                 continue
 
-            pf, af, sf = s.getD(psfKey), s.getD(apKey), s.getD(modKey)
-
-            #if pf > 1000.0:
-            #    print dataIdTmp
-            #    print "%8.2f %8.2f %8.2f    %8.4f %8.4f" % (pf, af, sf, pf/af - 1.0, pf/sf - 1.0)
-            
-            # fluxes
-            s.setD(psfKey,   s.getD(psfKey)/fmag0)
-            s.setD(apKey,    s.getD(apKey)/fmag0)
-            s.setD(modKey,   s.getD(modKey)/fmag0)
-            s.setD(instKey,  s.getD(instKey)/fmag0)
+            for name in ('Psf', 'Ap', 'Model', 'Inst'):
+                cat.setColumn(name+'Flux', cat.getColumn(name+'Flux')/fmag0)
 
             # flux errors
-            psfFluxErr  = qaDataUtils.calibFluxError(s.getD(psfKey), s.getD(psfErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(psfErrKey, psfFluxErr)
-
-            apFluxErr   = qaDataUtils.calibFluxError(s.getD(psfKey),  s.getD(apErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(apErrKey, apFluxErr)
-
-            modFluxErr  = qaDataUtils.calibFluxError(s.getD(modKey), s.getD(modErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(modErrKey, modFluxErr)
-
-            instFluxErr = qaDataUtils.calibFluxError(s.getD(instKey),  s.getD(instErrKey),
-                                                     fmag0, fmag0Err)
-            s.setD(instErrKey, instFluxErr)
-                
+            # note: the ApFlux error has always been computed with the PsfFlux
+            for name, fluxName in (('Psf', 'Psf'), ('Ap', 'Psf'), ('Model', 'Model'), ('Inst', 'Inst')):
+                flux    = cat.getColumn(fluxName+'Flux')
+                fluxErr = cat.getColumn(name+'FluxErr')
+                cat.setColumn(name+'FluxErr', qaDataUtils.calibFluxErrorArray(flux, fluxErr, fmag0, fmag0Err))
 
         # cache it
         for k, ss in ssDict.items():
@@ -669,162 +564,194 @@ class DbQaData(QaData):
         """ Get a dict of all Catalog Sources matching dataId, but
         within another Science_Ccd_Exposure's polygon"""
 
+        return self.getVisitMatchesBySensorForVisits(matchDatabase, [matchVisit], dataIdRegex)[matchVisit]
 
-        # If the dataIdEntry is identical to an earlier query, we must already have all the data
-        dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)  # E.g. visit862826551-snap.*-raft.*-sensor.*
 
-        if self.visitMatchQueryCache.has_key(matchDatabase):
-            if self.visitMatchQueryCache[matchDatabase].has_key(matchVisit):
-                vmqCache = self.visitMatchQueryCache[matchDatabase][matchVisit]
+    def getVisitMatchesBySensorForVisits(self, matchDatabase, matchVisits, dataIdRegex):
+        """Get getVisitMatchesBySensor() for several visits, keyed by visit.
 
-                if vmqCache.has_key(dataIdStr):
-                    vmCache = self.visitMatchCache[matchDatabase][matchVisit]
-                    vmDict = {}
-                    for key, ss in vmCache.items():
-                        if re.search(dataIdStr, key):
-                            vmDict[key] = ss
-                    return vmDict
+        The visits which aren't cached yet are loaded together, with one query for all
+        the sensors matching dataIdRegex.  Each sensor's entry is a list of [sref, s, filter]
+        for the matched sources of the other visits which fall in the sensor's polygon.
 
+        The sources are found through the htmId20 index: the htmId20 ranges covering each
+        sensor (see Htm.polygonRanges()) are sent with the query, and only the sources in
+        those ranges are tested against the sensor's polygon.
+        
+        @param matchDatabase The database with the visits to match to
+        @param matchVisits   List of visits to match to
+        @param dataIdRegex   dataId dict of regular expressions for our sensors
+        """
 
-        # Load each of the dataIds
-        dataIdList = self.getDataIdsFromRegex(dataIdRegex)
+        # If the dataIdEntry is identical to an earlier query, we must already have all the data
+        dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)  # E.g. visit862826551-snap.*-raft.*-sensor.*
 
+        vmDicts = {}
+        visitsToLoad = []
+        for matchVisit in matchVisits:
+            if self.visitMatchQueryCache.has_key(matchDatabase) and \
+                    self.visitMatchQueryCache[matchDatabase].has_key(matchVisit) and \
+                    self.visitMatchQueryCache[matchDatabase][matchVisit].has_key(dataIdStr):
+                vmCache = self.visitMatchCache[matchDatabase][matchVisit]
+                vmDicts[matchVisit] = self._getMatchingEntries(vmCache, dataIdRegex)
+            elif not matchVisit in visitsToLoad:
+                visitsToLoad.append(matchVisit)
+
+        if len(visitsToLoad) == 0:
+            return vmDicts
+        
         # Set up the outputs
         calib = self.getCalibBySensor(dataIdRegex)
-        vmDict = {}
-        for k in calib.keys():
-            vmDict[k] = []
+        visitLookup = {}
+        for matchVisit in visitsToLoad:
+            visitLookup[str(matchVisit)] = matchVisit
+            vmDicts[matchVisit] = {}
+            for k in calib.keys():
+                vmDicts[matchVisit][k] = []
+
+        sceNames = [['visit', 'sce.visit'], ['raft', 'sce.raftName'], ['sensor', 'sce.ccdName']]
+        sqlDataId = []
+        for key, sqlName in sceNames:
+            if dataIdRegex.has_key(key):
+                sqlDataId.append(self._sqlLikeEqual(sqlName, dataIdRegex[key]))
+        sqlDataId = " and ".join(sqlDataId)
 
-        for dataIdEntry in dataIdList:
-            visit, raft, sensor = dataIdEntry['visit'], dataIdEntry['raft'], dataIdEntry['sensor']
-            dataIdEntryStr = self._dataIdToString(dataIdEntry, defineFully=True) # E.g. visit862826551-snap0-raft30-sensor20
+        romTable = self.romTable
+        if re.search('%s', romTable):
+            romTable = self.romTable % (self.refStr['src'][0])
+        
+        self.verifyDataIdKeys(dataIdRegex.keys(), raiseOnFailure=True)
+        self.printStartLoad("Loading DatasetMatches for: " + dataIdStr + "...")
+
+        # The corners of our sensors come from our own database, and the htmId20 ranges
+        # covering them are worked out here, so the query needs no session state.
+        sql  = 'SELECT sce.%s, ' % (self.sceId) \
+            + '   sce.corner1Ra, sce.corner1Decl, sce.corner2Ra, sce.corner2Decl, ' \
+            + '   sce.corner3Ra, sce.corner3Decl, sce.corner4Ra, sce.corner4Decl ' \
+            + 'FROM '+self.sceTable+' AS sce %s' % ("WHERE "+sqlDataId if sqlDataId else "")
+        corners = self.dbInterface.execute(sql)
+        sceIds = numpy.array([row[0] for row in corners], dtype=numpy.int64)
+        corners = numpy.array([row[1:] for row in corners], dtype=numpy.float64).reshape(-1, 8)
+        # a sensor without its corners has no poly to match in either
+        haveCorners = numpy.isfinite(corners).all(axis=1)
+        sceIds, corners = sceIds[haveCorners], corners[haveCorners]
+        if len(sceIds) == 0:
+            self.printStopLoad()
+            return vmDicts
+        
+        poly, htmMin, htmMax = htm.polygonRanges(corners[:,0::2], corners[:,1::2])
+        regionRows = ["SELECT %d AS ownId, %d AS htmMin, %d AS htmMax" % (sceIds[poly[0]], htmMin[0], htmMax[0])]
+        for i in range(1, len(poly)):
+            regionRows.append("SELECT %d, %d, %d" % (sceIds[poly[i]], htmMin[i], htmMax[i]))
+
+        # Now the sources for all our sensors at once.  Each row is tagged with the sensor
+        # it's in, and the visit it's from.
+        setMethods = ["set"+x for x in qaDataUtils.getSourceSetAccessors()]
+        selectList = ["s."+x for x in qaDataUtils.getSourceSetDbNames()]
+        selectStr = ", ".join(selectList)
+        sql  = 'SELECT own.visit, own.raftName, own.ccdName, ' \
+            + ' sce.visit, sce.raftName, sce.ccdName, sce.filterName, ' \
+            + ' sce.fluxMag0, sce.fluxMag0Sigma,'                               \
+            + '   CASE WHEN sce.filterId = 0 THEN sro.uMag' \
+            + '        WHEN sce.filterId = 1 THEN sro.gMag' \
+            + '        WHEN sce.filterId = 2 THEN sro.rMag' \
+            + '        WHEN sce.filterId = 3 THEN sro.iMag' \
+            + '        WHEN sce.filterId = 4 THEN sro.zMag' \
+            + '        WHEN sce.filterId = 5 THEN sro.yMag' \
+            + '   END as mag,'                              \
+            + ' sro.ra, sro.decl, sro.isStar, sro.refObjectId,' \
+            + selectStr \
+            + ' FROM (%s) AS reg' % (" UNION ALL ".join(regionRows)) \
+            + ' INNER JOIN %s AS own ON (own.%s = reg.ownId)' % (self.sceTable, self.sceId) \
+            + ' INNER JOIN %s.%s AS s USE INDEX FOR JOIN(IDX_htmId20)' % (matchDatabase, self.sTable) \
+            + '   ON (s.htmId20 BETWEEN reg.htmMin AND reg.htmMax)' \
+            + ' INNER JOIN %s.%s AS sce' % (matchDatabase, self.sceTable) \
+            + '   ON (s.%s = sce.%s) AND (sce.visit IN (%s))' % (self.sceId, self.sceId,
+                                                                ", ".join([str(v) for v in visitsToLoad])) \
+            + ' INNER JOIN %s.%s AS rsm ON (s.%s = rsm.%s)' % (matchDatabase, romTable, self.sId, self.sId) \
+            + ' INNER JOIN %s.RefObject AS sro ON (sro.refObjectId = rsm.refObjectId)' % (matchDatabase) \
+            + ' WHERE scisql_s2PtInCPoly(s.ra, s.decl, own.poly) = 1'
 
-            haveAllKeys = True
-            sqlDataId = []
-            for keyNames in [['visit', 'sce.visit'], ['raft', 'sce.raftName'], ['sensor', 'sce.ccdName']]:
-                key, sqlName = keyNames
-                if dataIdEntry.has_key(key):
-                    sqlDataId.append(self._sqlLikeEqual(sqlName, dataIdEntry[key]))
-                else:
-                    haveAllKeys = False
-            sqlDataId = " and ".join(sqlDataId)
+        results = self.dbInterface.execute(sql)
 
-            # Poly comes from our own database
-            sql1  = 'SELECT poly FROM '+self.sceTable+' as sce ' \
-                 + 'WHERE %s ' % (sqlDataId) \
-                 + 'INTO @poly;'
+        self.printMidLoad("Found %d matches..." % (len(results)))
 
-            sql2  = 'CALL scisql.scisql_s2CPolyRegion(@poly, 20);'
-        
-            # Selection of source matches from the comparison database
-            self.verifyDataIdKeys(dataIdRegex.keys(), raiseOnFailure=True)
-            setMethods = ["set"+x for x in qaDataUtils.getSourceSetAccessors()]
-            selectList = ["s."+x for x in qaDataUtils.getSourceSetDbNames()]
-            selectStr = ", ".join(selectList)
-            sql3  = 'SELECT sce.visit, sce.raftName, sce.ccdName, sce.filterName, ' \
-                + ' sce.fluxMag0, sce.fluxMag0Sigma,'                               \
-                + '   CASE WHEN sce.filterId = 0 THEN sro.uMag' \
-                + '        WHEN sce.filterId = 1 THEN sro.gMag' \
-                + '        WHEN sce.filterId = 2 THEN sro.rMag' \
-                + '        WHEN sce.filterId = 3 THEN sro.iMag' \
-                + '        WHEN sce.filterId = 4 THEN sro.zMag' \
-                + '        WHEN sce.filterId = 5 THEN sro.yMag' \
-                + '   END as mag,'                              \
-                + ' sro.ra, sro.decl, sro.isStar, sro.refObjectId,' \
-                + selectStr \
-                + ' FROM %s.'+self.sTable+' AS s USE INDEX FOR JOIN(IDX_htmId20)' % (matchDatabase) \
-                + ' INNER JOIN %s.'+self.sceTable+' AS sce ' % (matchDatabase) \
-                + ' ON (s.'+self.sceId+' = sce.'+self.sceId+') AND (sce.visit = %s)' % (matchVisit) \
-                + '   INNER JOIN %s.'+self.romTable+' AS rsm ON (s.'+self.sId+' = rsm.'+self.sId+')' % (matchDatabase) \
-                + '   INNER JOIN %s.RefObject AS sro ON (sro.refObjectId = rsm.refObjectId)'  % (matchDatabase) \
-                + '   INNER JOIN scisql.Region AS reg ON (s.htmId20 BETWEEN reg.htmMin AND reg.htmMax) ' \
-                + 'WHERE scisql_s2PtInCPoly(s.ra, s.decl, @poly) = 1;'
-
-            #if not re.search("\%", sql1) and haveAllKeys:
-            #    dataIdCopy = copy.copy(dataIdEntry)
-            #    dataIdCopy['snap'] = "0"
-            #    key = self._dataIdToString(dataIdCopy)
-            #    if self.visitMatchCache.has_key(key):
-            #        vmDict[key] = self.visitMatchCache[key]
-            #        continue
+        nIds = len(sceNames)
+        calibSources = []
+        calibMag0 = []
+        for row in results:
+            dataIdTmp = {}
+            for i in range(nIds):
+                dataIdTmp[sceNames[i][0]] = row[i]
+            key = self._dataIdToKey(dataIdTmp)
             
-            self.printStartLoad("Loading DatasetMatches for: " + dataIdEntryStr + "...")
-            self.dbInterface.execute(sql1)
-            self.dbInterface.execute(sql2)
-            results = self.dbInterface.execute(sql3)
-
-            self.printMidLoad("Found %d matches..." % (len(results)))
-
-            for row in results:
-                s = pqaSource.Source()
-                qaDataUtils.setSourceBlobsNone(s)
-                sref = pqaSource.RefSource()
-                qaDataUtils.setSourceBlobsNone(sref)
-
-                nValues = 11
-                mvisit, mraft, mccd, mfilt, fmag0, fmag0Err, mag, ra, dec, isStar, refObjId = row[:nValues]
-                filt = afwImage.Filter(mfilt, True)
-
-                sref.setId(refObjId)
-                sref.setRa(ra)
-                sref.setDec(dec)
-                flux = 10**(-mag/2.5)
-                sref.setPsfFlux(flux)
-                sref.setApFlux(flux)
-                sref.setModelFlux(flux)
-                sref.setInstFlux(flux)
-
-                i = 0
-                for value in row[nValues:]:
-                    method = getattr(s, setMethods[i])
-                    if value is not None:
-                        method(value)
-                    i += 1
-           
-                for sss in [s, sref]:
-                    if isStar == 1:
-                        sss.setFlagForDetection(sss.getFlagForDetection() | pqaSource.STAR)
-                    else:
-                        sss.setFlagForDetection(sss.getFlagForDetection() & ~pqaSource.STAR)
-        
-                # fluxes
-                s.setPsfFlux(s.getPsfFlux()/fmag0)
-                s.setApFlux(s.getApFlux()/fmag0)
-                s.setModelFlux(s.getModelFlux()/fmag0)
-                s.setInstFlux(s.getInstFlux()/fmag0)
-    
-                # flux errors
-                psfFluxErr  = qaDataUtils.calibFluxError(s.getPsfFlux(),   s.getPsfFluxErr(),   fmag0, fmag0Err)
-                s.setPsfFluxErr(psfFluxErr)
-    
-                apFluxErr   = qaDataUtils.calibFluxError(s.getApFlux(),    s.getApFluxErr(),    fmag0, fmag0Err)
-                s.setApFluxErr(apFluxErr)
-    
-                modFluxErr  = qaDataUtils.calibFluxError(s.getModelFlux(), s.getModelFluxErr(), fmag0, fmag0Err)
-                s.setModelFluxErr(modFluxErr)
-    
-                instFluxErr = qaDataUtils.calibFluxError(s.getInstFlux(),  s.getInstFluxErr(),  fmag0, fmag0Err)
-                s.setInstFluxErr(instFluxErr)
-    
-                vm = vmDict[dataIdEntryStr]
-                vm.append( [sref, s, filt] )
-    
-            self.printStopLoad()
+            s = pqaSource.Source()
+            qaDataUtils.setSourceBlobsNone(s)
+            sref = pqaSource.RefSource()
+            qaDataUtils.setSourceBlobsNone(sref)
+
+            nValues = nIds + 11
+            mvisit, mraft, mccd, mfilt, fmag0, fmag0Err, mag, ra, dec, isStar, refObjId = row[nIds:nValues]
+            filt = afwImage.Filter(mfilt, True)
+
+            sref.setId(refObjId)
+            sref.setRa(ra)
+            sref.setDec(dec)
+            flux = 10**(-mag/2.5)
+            sref.setPsfFlux(flux)
+            sref.setApFlux(flux)
+            sref.setModelFlux(flux)
+            sref.setInstFlux(flux)
+
+            i = 0
+            for value in row[nValues:]:
+                method = getattr(s, setMethods[i])
+                if value is not None:
+                    method(value)
+                i += 1
+
+            for sss in [s, sref]:
+                if isStar == 1:
+                    sss.setFlagForDetection(sss.getFlagForDetection() | pqaSource.STAR)
+                else:
+                    sss.setFlagForDetection(sss.getFlagForDetection() & ~pqaSource.STAR)
+
+            calibSources.append(s)
+            calibMag0.append((fmag0, fmag0Err))
+
+            vmDict = vmDicts[visitLookup[str(mvisit)]]
+            if not vmDict.has_key(key):
+                vmDict[key] = []
+            vmDict[key].append( [sref, s, filt] )
+
+        # calibrate the sources a column at a time, each with the fluxMag0 of its own exposure
+        if len(calibSources) > 0:
+            fmag0, fmag0Err = numpy.array(calibMag0, dtype=numpy.float64).transpose()
+            for name in ('Psf', 'Ap', 'Model', 'Inst'):
+                flux = numpy.array([getattr(s, 'get'+name+'Flux')() for s in calibSources])/fmag0
+                fluxErr = numpy.array([getattr(s, 'get'+name+'FluxErr')() for s in calibSources])
+                fluxErr = qaDataUtils.calibFluxErrorArray(flux, fluxErr, fmag0, fmag0Err)
+                for s, f, df in zip(calibSources, flux, fluxErr):
+                    getattr(s, 'set'+name+'Flux')(f)
+                    getattr(s, 'set'+name+'FluxErr')(df)
+
+        self.printStopLoad()
     
         # cache it
         if not self.visitMatchQueryCache.has_key(matchDatabase):
             self.visitMatchQueryCache[matchDatabase] = {}
             self.visitMatchCache[matchDatabase] = {}
 
-        if not self.visitMatchQueryCache[matchDatabase].has_key(matchVisit):
-            self.visitMatchQueryCache[matchDatabase][matchVisit] = {}
-            self.visitMatchCache[matchDatabase][matchVisit] = {}
+        for matchVisit in visitsToLoad:
+            if not self.visitMatchQueryCache[matchDatabase].has_key(matchVisit):
+                self.visitMatchQueryCache[matchDatabase][matchVisit] = {}
+                self.visitMatchCache[matchDatabase][matchVisit] = self.cacheManager.makeCache("visitMatch")
 
-        self.visitMatchQueryCache[matchDatabase][matchVisit][dataIdStr] = True
-        for k, ss in vmDict.items():
-            self.visitMatchCache[matchDatabase][matchVisit][k] = ss
+            self.visitMatchQueryCache[matchDatabase][matchVisit][dataIdStr] = True
+            for k, ss in vmDicts[matchVisit].items():
+                self.visitMatchCache[matchDatabase][matchVisit][k] = ss
         
-        return vmDict
+        return vmDicts
 
 
     def getRefObjectSetBySensor(self, dataIdRegex):
@@ -853,23 +780,18 @@ class DbQaData(QaData):
         dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)
         if self.refObjectQueryCache.has_key(dataIdStr):
             # get only the ones that match the request
-            sroDict = {}
-            for key, sro in self.refObjectCache.items():
-                if re.search(dataIdStr, key):
-                    sroDict[key] = sro
-            return sroDict
+            return self._getMatchingEntries(self.refObjectCache, dataIdRegex)
 
 
         # get a list of matching dataIds 
         dataIdList = self.getDataIdsFromRegex(dataIdRegex)
             
 
-        # Load each of the dataIds
+        # find the dataIds we don't already have
         sroDict = {}
+        loadList = []
         for dataIdEntry in dataIdList:
 
-            dataIdEntryStr = self._dataIdToString(dataIdEntry, defineFully=True)
-            
             haveAllKeys = True
             sqlDataId = []
             for keyNames in sceNames:
@@ -887,35 +809,30 @@ class DbQaData(QaData):
             if not re.search("\%", sqlDataId) and haveAllKeys:
                 dataIdCopy = copy.copy(dataIdEntry)
 
-                key = self._dataIdToString(dataIdCopy, defineFully=True)
+                key = self._dataIdToKey(dataIdCopy)
                 if self.refObjectCache.has_key(key):
                     sroDict[key] = self.refObjectCache[key]
                     continue
 
+            loadList.append([dataIdEntry, sqlDataId])
+
+        # usePoly is currently hardwired to use scisql polygon search function, but migration to 
+        # qserv database will require use of a different function.  The code inside the else
+        # statement below is an example of the qserv implementation.  Once we migrate to 
+        # qserv, will remove or disable the usePoly block
+        usePoly = True
+        if usePoly:
+            rowsByKey = self._getRefObjectRowsByVisit(loadList, sceNames, sroFieldStr)
+
+        # Load each of the dataIds
+        for dataIdEntry, sqlDataId in loadList:
+
+            dataIdEntryStr = self._dataIdToString(dataIdEntry, defineFully=True)
+            
             self.printStartLoad("Loading RefObjects for: " + dataIdEntryStr + "...")
 
-            # usePoly is currently hardwired to use scisql polygon search function, but migration to 
-            # qserv database will require use of a different function.  The code inside the else
-            # statement below is an example of the qserv implementation.  Once we migrate to 
-            # qserv, will remove or disable the usePoly block
-            usePoly = True
             if usePoly:
-                sql  = 'SELECT scisql_s2CPolyToBin(' \
-                    + '   sce.corner1Ra, sce.corner1Decl, ' \
-                    + '   sce.corner2Ra, sce.corner2Decl, ' \
-                    + '   sce.corner3Ra, sce.corner3Decl, ' \
-                    + '   sce.corner4Ra, sce.corner4Decl) ' \
-                    + 'FROM '+self.sceTable+' as sce ' \
-                    + 'WHERE %s ' % (sqlDataId) \
-                    + 'INTO @poly; '
-                self.dbInterface.execute(sql)
-
-                sql2 = 'SELECT %s ' % (sroFieldStr) \
-                    + 'FROM ' \
-                    + '    RefObject AS sro ' \
-                    + 'WHERE ' \
-                    + '    (scisql_s2PtInCPoly(sro.ra, sro.decl, @poly) = 1) '
-                results = self.dbInterface.execute(sql2)
+                results = rowsByKey.get(self._dataIdToKey(dataIdEntry), [])
 
             else:
                 sql  = 'SELECT ' \
@@ -946,27 +863,30 @@ class DbQaData(QaData):
             #ccdName = self.cameraInfo.ccdKeyToName(sensor)
             bbox = self.cameraInfo.getBbox(raftName, ccdName)
             
-            for row in results:
-                sroStuff = list(row[:])
-                if not self.haveYmag:
-                    sroStuff.append(0.0) # dummy yMag
-
-                # ignore things near the edge
-                # ... they wouldn't be detected, and we should know about them
-                ra, dec = sroStuff[2], sroStuff[3]
-                x, y = wcs.skyToPixel(afwCoord.Coord(afwGeom.PointD(ra, dec)))
-                if qaDataUtils.atEdge(bbox, x, y):
-                   continue
-
-                
-                dataIdTmp = dataIdEntry #{'visit':str(visit), 'raft':raft, 'sensor':sensor, 'snap':'0'}
-                key = self._dataIdToString(dataIdTmp, defineFully=True)
-                self.dataIdLookup[key] = dataIdTmp
-
+            nRow = len(results)
+            columns = zip(*results) if nRow > 0 else [()]*len(sroFields)
+            ids    = numpy.array(columns[0], dtype=numpy.int64)
+            isStar = self._dbColumnToArray(columns[1])
+            ra     = self._dbColumnToArray(columns[2])
+            dec    = self._dbColumnToArray(columns[3])
+            mag    = numpy.zeros((simRefObj.SimRefObjectSet.nMag, nRow), dtype=numpy.float32)
+            for i in range(len(columns) - 4):
+                mag[i] = self._dbColumnToArray(columns[4 + i])  # no yMag leaves a dummy 0.0
+
+            # ignore things near the edge
+            # ... they wouldn't be detected, and we should know about them
+            x = numpy.empty(nRow)
+            y = numpy.empty(nRow)
+            for i in xrange(nRow):
+                x[i], y[i] = wcs.skyToPixel(afwCoord.Coord(afwGeom.PointD(ra[i], dec[i])))
+            keep = ~qaDataUtils.atEdge(bbox, x, y)
+
+            if keep.any():
+                key = self._dataIdToKey(dataIdEntry)
+                self.dataIdLookup[key] = dataIdEntry
                 if not sroDict.has_key(key):
                     sroDict[key] = simRefObj.SimRefObjectSet()
-                sros = sroDict[key]
-                sros.push_back(simRefObj.SimRefObject(*sroStuff))
+                sroDict[key].extend(ids[keep], isStar[keep], ra[keep], dec[keep], mag[:,keep])
 
             self.refObjectQueryCache[dataIdStr] = True
             
@@ -981,6 +901,60 @@ class DbQaData(QaData):
 
 
 
+    def _getRefObjectRowsByVisit(self, loadList, sceNames, sroFieldStr):
+        """Get the RefObject rows inside each sensor's polygon, with one query for many sensors.
+
+        The sensors are grouped by visit (at most refObjectBatchSize in a query).  Each query
+        joins RefObject to the sensors' polygons, and tags each row with the sensor's dataId,
+        so the rows can be split up here.  Returns a dict of row lists keyed by sensor key.
+        
+        @param loadList    List of [dataId, sql where clause for it] for the sensors to load
+        @param sceNames    List of [dataId name, sce column name] for the dataId columns
+        @param sroFieldStr The RefObject columns to get
+        """
+
+        visitNames = [name for name, discrim in self.dataInfo if discrim > 0]
+        batches = {}
+        for dataIdEntry, sqlDataId in loadList:
+            visit = tuple([dataIdEntry.get(name) for name in visitNames])
+            if not batches.has_key(visit) or len(batches[visit][-1]) >= self.refObjectBatchSize:
+                batches.setdefault(visit, []).append([])
+            batches[visit][-1].append(sqlDataId)
+
+        nIds = len(sceNames)
+        idColumns = ", ".join(zip(*sceNames)[1])
+        rowsByKey = {}
+        for visit in sorted(batches.keys()):
+            for sqlDataIds in batches[visit]:
+                self.printStartLoad("Loading RefObjects for %d sensors..." % (len(sqlDataIds)))
+                
+                sql = 'SELECT %s, %s ' % (idColumns, sroFieldStr) \
+                    + 'FROM ' \
+                    + '    (SELECT %s, ' % (idColumns.replace('sce.', '')) \
+                    + '        scisql_s2CPolyToBin(' \
+                    + '          corner1Ra, corner1Decl, corner2Ra, corner2Decl, ' \
+                    + '          corner3Ra, corner3Decl, corner4Ra, corner4Decl) AS poly ' \
+                    + '     FROM '+self.sceTable+' AS sce ' \
+                    + '     WHERE %s) AS sce ' % (" or ".join(["(%s)" % (w) for w in sqlDataIds])) \
+                    + '  INNER JOIN RefObject AS sro ' \
+                    + '    ON (scisql_s2PtInCPoly(sro.ra, sro.decl, sce.poly) = 1)'
+                results = self.dbInterface.execute(sql)
+                self.printMidLoad("found %d..." % (len(results)))
+
+                for row in results:
+                    dataIdTmp = {}
+                    for i in range(nIds):
+                        dataIdTmp[sceNames[i][0]] = row[i]
+                    key = self._dataIdToKey(dataIdTmp)
+                    if not rowsByKey.has_key(key):
+                        rowsByKey[key] = []
+                    rowsByKey[key].append(row[nIds:])
+                    
+                self.printStopLoad()
+
+        return rowsByKey
+
+
     def getVisits(self, dataIdRegex):
         """ Return explicit visits matching for a dataIdRegex.
 
@@ -1076,7 +1050,7 @@ class DbQaData(QaData):
                 # handle lsst/hsc different naming conventions
                 ccd = dataIdRegex[self.cameraInfo.dataIdTranslationMap['sensor']]
 
-            key = self._dataIdToString(thisDataId, defineFully=True)
+            key = self._dataIdToKey(thisDataId)
             dataIdDict[key] = thisDataId
 
 
@@ -1129,7 +1103,7 @@ class DbQaData(QaData):
         if not re.search("\%", sql) and haveAllKeys:
             dataIdCopy = copy.copy(dataIdRegex)
             dataIdCopy['snap'] = "0"
-            key = self._dataIdToString(dataIdCopy, defineFully=True)
+            key = self._dataIdToKey(dataIdCopy)
             if self.calexpQueryCache.has_key(key):
                 return
 
@@ -1158,7 +1132,7 @@ class DbQaData(QaData):
                 
             #visit, raft, sensor = rowDict['visit'], rowDict['raftName'], rowDict['ccdName']
             #dataIdTmp = {'visit':visit, 'raft':raft, 'sensor':sensor, 'snap':'0'}
-            key = self._dataIdToString(dataIdTmp, defineFully=True)
+            key = self._dataIdToKey(dataIdTmp)
             self.dataIdLookup[key] = dataIdTmp
             
             #print rowDict
@@ -1203,12 +1177,7 @@ class DbQaData(QaData):
 
         # get the datasets corresponding to the request
         self.loadCalexp(dataIdRegex)
-        dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)
-        entryDict = {}
-        for dataKey in cache.keys():
-            if re.search(dataIdStr, dataKey):
-                entryDict[dataKey] = cache[dataKey]
-        return entryDict
+        return self._getMatchingEntries(cache, dataIdRegex)
 
 
 
@@ -0,0 +1,173 @@
+"""Hierarchical Triangular Mesh (HTM) ids and coverings, as used for the htmId20 columns.
+
+The sphere is split into 8 root triangles (S0-S3 with ids 8-11, N0-N3 with ids 12-15),
+and each triangle into 4 children, with ids 4*id + (0, 1, 2, 3), down to the level needed.
+The roots and the subdivision are the same as scisql's, so the ranges found here can be
+used against its htmId20 columns.
+"""
+
+import numpy
+
+# the vertices of the root triangles
+_rootVectors = numpy.array([
+    [ 0.0,  0.0,  1.0],
+    [ 1.0,  0.0,  0.0],
+    [ 0.0,  1.0,  0.0],
+    [-1.0,  0.0,  0.0],
+    [ 0.0, -1.0,  0.0],
+    [ 0.0,  0.0, -1.0],
+    ])
+_rootVertices = _rootVectors[numpy.array([
+    [1, 5, 2],  # S0
+    [2, 5, 3],  # S1
+    [3, 5, 4],  # S2
+    [4, 5, 1],  # S3
+    [1, 0, 4],  # N0
+    [4, 0, 3],  # N1
+    [3, 0, 2],  # N2
+    [2, 0, 1],  # N3
+    ])]
+_rootIds = numpy.arange(8, 16, dtype=numpy.int64)
+
+
+def radecToVector(ra, decl):
+    """Get unit vectors for positions in degrees, as an array with x, y, z along the last axis."""
+    ra = numpy.radians(numpy.asarray(ra, dtype=numpy.float64))
+    decl = numpy.radians(numpy.asarray(decl, dtype=numpy.float64))
+    cosDecl = numpy.cos(decl)
+    return numpy.concatenate([(cosDecl*numpy.cos(ra))[...,numpy.newaxis],
+                              (cosDecl*numpy.sin(ra))[...,numpy.newaxis],
+                              numpy.sin(decl)[...,numpy.newaxis]], axis=-1)
+
+
+def _normalize(v):
+    return v/numpy.sqrt((v*v).sum(axis=-1))[...,numpy.newaxis]
+
+
+def _dot(a, b):
+    return (a*b).sum(axis=-1)
+
+
+def _children(v0, v1, v2):
+    """The vertices of the 4 children of each triangle, in child order."""
+    w0 = _normalize(v1 + v2)
+    w1 = _normalize(v0 + v2)
+    w2 = _normalize(v0 + v1)
+    return [(v0, w2, w1), (v1, w0, w2), (v2, w1, w0), (w0, w1, w2)]
+
+
+def _inTriangle(v0, v1, v2, p):
+    return (_dot(numpy.cross(v0, v1), p) >= 0.0) & (_dot(numpy.cross(v1, v2), p) >= 0.0) & \
+           (_dot(numpy.cross(v2, v0), p) >= 0.0)
+
+
+def htmIds(ra, decl, level=20):
+    """Get the HTM id at level of each position.
+
+    @param ra     Array of ra (degrees)
+    @param decl   Array of declination (degrees)
+    @param level  HTM level (20 for htmId20)
+    """
+    p = radecToVector(numpy.atleast_1d(ra), numpy.atleast_1d(decl))
+    n = len(p)
+
+    ids = numpy.zeros(n, dtype=numpy.int64)
+    v0, v1, v2 = [numpy.zeros((n, 3)) for i in range(3)]
+    found = numpy.zeros(n, dtype=bool)
+    for i in range(8):
+        r0, r1, r2 = [numpy.tile(v, (n, 1)) for v in _rootVertices[i]]
+        use = ~found & _inTriangle(r0, r1, r2, p)
+        ids[use] = _rootIds[i]
+        v0[use], v1[use], v2[use] = r0[use], r1[use], r2[use]
+        found |= use
+
+    for l in range(level):
+        children = _children(v0, v1, v2)
+        child = numpy.zeros(n, dtype=numpy.int64) + 3
+        for k in (2, 1, 0):
+            child[_inTriangle(children[k][0], children[k][1], children[k][2], p)] = k
+        ids = 4*ids + child
+        for k in range(4):
+            use = child == k
+            v0[use], v1[use], v2[use] = children[k][0][use], children[k][1][use], children[k][2][use]
+    return ids
+
+
+def polygonRanges(ra, decl, level=20, maxLevel=11, padArcsec=1.0):
+    """Find ranges of HTM ids at level which cover each of several convex polygons.
+
+    Triangles are subdivided down to maxLevel: those inside a polygon are taken whole, those
+    clear of it are dropped, and those on its edge at maxLevel are taken whole.  The ranges
+    therefore include everything in the polygon, plus some of the area around it.  All the
+    polygons are done together, a level at a time.
+
+    @param ra        Array (nPoly x nVertex) of the polygons' vertex ra (degrees), in order around each
+    @param decl      Array (nPoly x nVertex) of the vertex declinations (degrees)
+    @param level     HTM level of the ids (20 for htmId20)
+    @param maxLevel  Deepest level to subdivide to (a level 11 triangle is ~0.05 degree across)
+    @param padArcsec Grow the polygons by this much, to allow for rounding
+    @return poly, htmMin, htmMax -- the polygon number of each range, and its first and last ids,
+            sorted by polygon then id, with touching ranges merged
+    """
+    vertices = radecToVector(numpy.atleast_2d(ra), numpy.atleast_2d(decl))
+    nPoly = len(vertices)
+    maxLevel = min(maxLevel, level)
+    sinPad = numpy.sin(numpy.radians(padArcsec/3600.0))
+
+    # the inward normals of the polygons' edges, whichever way round the vertices go
+    normals = _normalize(numpy.cross(vertices, numpy.roll(vertices, -1, axis=1)))
+    center = _normalize(vertices.sum(axis=1))
+    flip = _dot(normals, center[:,numpy.newaxis,:]).sum(axis=1) < 0.0
+    normals[flip] *= -1.0
+
+    # start with every root triangle for every polygon
+    poly = numpy.repeat(numpy.arange(nPoly), 8)
+    ids = numpy.tile(_rootIds, nPoly)
+    v0, v1, v2 = [numpy.tile(_rootVertices[:,k,:], (nPoly, 1)) for k in range(3)]
+
+    outPoly, outMin, outMax = [], [], []
+    for l in range(maxLevel + 1):
+        if len(ids) == 0:
+            break
+        n = normals[poly]                              # (nTri, nEdge, 3)
+
+        # each triangle's bounding circle
+        c = _normalize(v0 + v1 + v2)
+        cosR = numpy.minimum(numpy.minimum(_dot(c, v0), _dot(c, v1)), _dot(c, v2))
+        sinR = numpy.where(cosR > 0.0, numpy.sqrt(numpy.maximum(1.0 - cosR**2, 0.0)), 1.0)
+        # clear of the polygon if its circle is wholly outside one edge
+        outside = ((cosR > 0.0)[:,numpy.newaxis] &
+                   (_dot(n, c[:,numpy.newaxis,:]) < -(sinR[:,numpy.newaxis] + sinPad))).any(axis=1)
+        # inside if all its corners are inside (the polygon is convex)
+        inside = numpy.ones(len(ids), dtype=bool)
+        for v in (v0, v1, v2):
+            inside &= (_dot(n, v[:,numpy.newaxis,:]) >= 0.0).all(axis=1)
+
+        take = inside | (~outside & (l == maxLevel))
+        shift = 2*(level - l)
+        outPoly.append(poly[take])
+        outMin.append(ids[take] << shift)
+        outMax.append(((ids[take] + 1) << shift) - 1)
+
+        split = ~outside & ~inside
+        poly = numpy.repeat(poly[split], 4)
+        ids = numpy.repeat(4*ids[split], 4) + numpy.tile(numpy.arange(4), split.sum())
+        children = _children(v0[split], v1[split], v2[split])
+        v0, v1, v2 = [numpy.concatenate([ch[k][:,numpy.newaxis,:] for ch in children], axis=1).reshape(-1, 3)
+                      for k in range(3)]
+
+    if len(outPoly) == 0:
+        empty = numpy.array([], dtype=numpy.int64)
+        return empty, empty, empty
+    poly = numpy.concatenate(outPoly)
+    htmMin = numpy.concatenate(outMin)
+    htmMax = numpy.concatenate(outMax)
+
+    # merge ranges which touch
+    order = numpy.lexsort((htmMin, poly))
+    poly, htmMin, htmMax = poly[order], htmMin[order], htmMax[order]
+    start = numpy.ones(len(poly), dtype=bool)
+    start[1:] = (poly[1:] != poly[:-1]) | (htmMin[1:] > htmMax[:-1] + 1)
+    first = numpy.nonzero(start)[0]
+    last = numpy.append(first[1:], len(poly)) - 1
+    return poly[first], htmMin[first], htmMax[last]
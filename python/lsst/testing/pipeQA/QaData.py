@@ -1,6 +1,30 @@
 import sys, os, re, copy, time
 import numpy
 
+import source as pqaSource
+import QaDataUtils as qaDataUtils
+import simRefObject as simRefObj
+from CacheManager import CacheManager, LruCache
+
+
+class DataIdKey(str):
+    """The cache key for one explicit dataId, eg. 'visit855-snap0-raft22-sensor11'.
+
+    It is the string the caches have always been keyed by, so it prints, sorts and compares
+    as one, but it also carries the dataId values (as strings, in dataIdNames order), so
+    nothing needs to parse or regex it.  Get them from QaData._dataIdToKey(), which interns
+    them and indexes them for _matchingDataIdKeys().
+    """
+
+    def __new__(cls, string, values=()):
+        self = str.__new__(cls, string)
+        self.values = values
+        return self
+
+    def __reduce__(self):
+        return (DataIdKey, (str(self), self.values))
+
+
 #######################################################################
 #
 #
@@ -12,11 +36,12 @@ class QaData(object):
     #######################################################################
     #
     #######################################################################
-    def __init__(self, label, rerun, cameraInfo):
+    def __init__(self, label, rerun, cameraInfo, cacheMaxBytes=None):
         """
         @param label The name of this data set
         @param rerun The rerun to retrieve
         @param cameraInfo A cameraInfo object containing specs on the camera
+        @param cacheMaxBytes Memory budget for the cached data (None for no limit)
         """
         
         self.label = label
@@ -32,6 +57,7 @@ class QaData(object):
             self.dataIdDiscrim.append(dataIdDiscrim)
 
 
+        self.cacheMaxBytes = cacheMaxBytes
         self.initCache()
 
         self.loadDepth = 0
@@ -102,30 +128,39 @@ class QaData(object):
         # they may contain regexes ... we won't know if our cached sourceSets have
         #   all the entries that match unless we redo the query
         #   But, if we've already done the identical query, we know we have everything
+        #   (see _forgetQueries() for what happens when cached data are evicted)
         self.queryCache = {}
         self.columnQueryCache = {}
 
+        # the data are kept within a memory budget, least recently used go first
+        self.cacheManager = CacheManager(self.cacheMaxBytes, self._forgetQueries)
+        makeCache = self.cacheManager.makeCache
+        
         # cache source sets to avoid reloading the same thing
-        self.sourceSetCache = {}
-        self.sourceSetColumnCache = {}
+        self.sourceSetCache = makeCache("sourceSet")
+        self.sourceSetColumnCache = makeCache("sourceSetColumn")
+        self.photometryCache = makeCache("photometry")
 
         self.matchQueryCache = {}
-        self.matchListCache = {}
+        self.matchListCache = makeCache("matchList")
 
         self.refObjectQueryCache = {}
-        self.refObjectCache = {}
+        self.refObjectCache = makeCache("refObject")
 
         self.visitMatchQueryCache = {}
         self.visitMatchCache = {}
 
         # cache calexp info, but not the MaskedImage ... it's too big.
         self.calexpQueryCache = {}
-        self.calexpCache = {}
-        self.wcsCache = {}
-        self.detectorCache = {}
-        self.raftDetectorCache = {}
-        self.filterCache = {}
-        self.calibCache = {}
+        self.calexpCache = makeCache("calexp")
+        self.wcsCache = makeCache("wcs")
+        self.detectorCache = makeCache("detector")
+        self.raftDetectorCache = makeCache("raftDetector")
+        self.filterCache = makeCache("filter")
+        self.calibCache = makeCache("calib")
+        # loadCalexp() fills these together, so they go together
+        self.cacheManager.link([self.calexpCache, self.wcsCache, self.detectorCache,
+                                self.raftDetectorCache, self.filterCache, self.calibCache])
         self.sqlCache = {"match": {}, "src": {}}
         
         self.performCache = {}
@@ -133,11 +168,17 @@ class QaData(object):
         # store the explicit dataId (ie. no regexes) for each key used in a cache
         self.dataIdLookup = {}
 
+        # the DataIdKey for each tuple of dataId values, and the same keys indexed by each
+        # dataId name in turn (eg. visit -> snap -> raft -> sensor), see _matchingDataIdKeys()
+        self.dataIdKeys = {}
+        self.dataIdIndex = {}
+
         self.cacheList = {
             "query"          : self.queryCache,  
             "columnQuery"    : self.columnQueryCache,
             "sourceSet"      : self.sourceSetCache,
             "sourceSetColumn"  : self.sourceSetColumnCache,
+            "photometry"     : self.photometryCache,
             "matchQuery"     : self.matchQueryCache,
             "matchList"      : self.matchListCache,
             "refObjectQuery" : self.refObjectQueryCache,
@@ -151,6 +192,8 @@ class QaData(object):
             "filter"         : self.filterCache, 
             "calib"          : self.calibCache,  
             "dataIdLookup"   : self.dataIdLookup,
+            "dataIdKeys"     : self.dataIdKeys,
+            "dataIdIndex"    : self.dataIdIndex,
             "sql"            : self.sqlCache,
             }
 
@@ -184,6 +227,97 @@ class QaData(object):
                     return self.performCache[dataIdStr][test][label]
         return None
 
+    # the caches recording which dataId regexes have been loaded
+    _queryCacheNames = ("queryCache", "columnQueryCache", "matchQueryCache",
+                        "refObjectQueryCache", "visitMatchQueryCache", "calexpQueryCache")
+    
+    def pinDataId(self, dataIdRegex):
+        """Keep the cached data for dataIdRegex (eg. the dataId being tested) from being evicted.
+
+        Only one dataId is pinned at a time; anything pinned before may now be evicted.
+
+        @param dataIdRegex dataId dict of regular expressions for the data to keep
+        """
+        patterns = []
+        for pattern in self._dataIdKeyPatterns(dataIdRegex):
+            if pattern == ".*":
+                patterns.append(None)
+            else:
+                patterns.append(re.compile("(?:%s)$" % (pattern)))
+        dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)
+        
+        def isPinned(key):
+            if isinstance(key, DataIdKey):
+                for pattern, value in zip(patterns, key.values):
+                    if (pattern is not None) and not pattern.match(value):
+                        return False
+                return True
+            # eg. photometryCache is keyed by the requested dataId string
+            return str(key).startswith(dataIdStr)
+        self.cacheManager.pin(isPinned)
+
+    def _forgetQueries(self, evictedKeys):
+        """Forget that we've run the queries which loaded evicted data, so they're run again.
+
+        @param evictedKeys The keys of the entries evicted from the caches
+        """
+        evictedKeys = [key for key in evictedKeys if isinstance(key, DataIdKey)]
+        if len(evictedKeys) == 0:
+            return
+        
+        def forget(cache):
+            for queryKey in cache.keys():
+                if isinstance(cache[queryKey], dict):
+                    forget(cache[queryKey])
+                    continue
+                try:
+                    regex = re.compile(str(queryKey))
+                except re.error, e:
+                    del cache[queryKey]
+                    continue
+                for key in evictedKeys:
+                    if regex.search(key):
+                        del cache[queryKey]
+                        break
+
+        for name in self._queryCacheNames:
+            forget(getattr(self, name))
+
+    def adoptCache(self, other):
+        """Take the data cached by another QaData for the same dataset (eg. data it prefetched).
+
+        Entries already cached here are kept.  other is left with empty caches.
+
+        @param other The QaData to take the cached data from
+        """
+        # the data before the queries which loaded them, in case some are evicted on the way
+        names = [name for name in other.__dict__.keys()
+                 if (name.endswith("Cache") or name == "dataIdLookup") and name != "performCache"]
+        names.sort(key=lambda name: name in self._queryCacheNames)
+        for name in names:
+            cache = getattr(other, name)
+            if isinstance(cache, dict):
+                self._adoptEntries(getattr(self, name), cache)
+        other.initCache()
+
+    def _adoptEntries(self, cache, otherCache):
+        """Copy the entries of otherCache missing from cache, descending into nested caches.
+
+        DataIdKeys are swapped for our own, so they're in our dataIdIndex.
+        """
+        for key, value in dict.items(otherCache):
+            if isinstance(key, DataIdKey):
+                key = self._internDataIdKey(key.values)
+            if isinstance(value, LruCache) or type(value) == dict:
+                if not cache.has_key(key):
+                    if isinstance(value, LruCache):
+                        cache[key] = self.cacheManager.makeCache(value.name)
+                    else:
+                        cache[key] = {}
+                self._adoptEntries(cache[key], value)
+            elif not cache.has_key(key):
+                cache[key] = value
+
     def clearCache(self):
         """Reset all internal cache attributes."""
         for cache in self.cacheList.values():
@@ -256,17 +390,17 @@ class QaData(object):
         ssDict = self.getSourceSetBySensor(dataIdRegex)
         ssTDict = {}
         for k, ss in ssDict.items():
-            if not self.sourceSetColumnCache.has_key(k):
-                self.sourceSetColumnCache[k] = {}
+            columns = self.sourceSetColumnCache.get(k, {})
             ssTDict[k] = {}
             for accessor in accessors:
-                tmp = numpy.array([])
-                for s in ss:
-                    method = getattr(s, "get"+accessor)
-                    value = method()
-                    tmp = numpy.append(tmp, value)
-                self.sourceSetColumnCache[k][accessor] = tmp
+                if hasattr(ss, 'getColumn'):
+                    tmp = ss.getColumn(accessor)
+                else:
+                    tmp = numpy.array([getattr(s, "get"+accessor)() for s in ss])
+                columns[accessor] = tmp
                 ssTDict[k][accessor] = tmp
+            # (re)set it once filled, so it's counted at its full size
+            self.sourceSetColumnCache[k] = columns
 
         #self.transposeQueryCache[dataIdStr+'-'+accessor] = True
         
@@ -275,6 +409,136 @@ class QaData(object):
 
 
 
+    # source columns holding the flux and flux error of each magnitude type.
+    # "cat" is the reference object's flux, which has no error.
+    photometryFluxColumns = {
+        "psf"  : ("PsfFlux",   "PsfFluxErr"),
+        "ap"   : ("ApFlux",    "ApFluxErr"),
+        "mod"  : ("ModelFlux", "ModelFluxErr"),
+        "inst" : ("InstFlux",  "InstFluxErr"),
+        }
+
+    def getPhotometryBySensor(self, dataIdRegex, useMatches=False):
+        """Get magnitudes of every type, with errors and flag/star columns, for each sensor.
+
+        The result is computed once per dataId and cached, so every photometric comparison
+        of the same data shares it.  Each sensor's entry is a dict of equal-length arrays:
+        'psf', 'ap', 'mod', 'inst' (and 'cat' for matches) magnitudes, NaN where the flux is not
+        positive and finite, with their errors in eg. 'psfErr'; 'flagged' (interpolated or
+        saturated center, or edge; interpolation is ignored for coadds); 'star' (1 for
+        non-extended sources); and 'XAstrom', 'YAstrom'.  The arrays are shared, don't modify them.
+        
+        @param dataIdRegex dataId dict of regular expressions for data to be retrieved
+        @param useMatches  Use the 'matched' sources from getMatchListBySensor() (needed for 'cat'),
+                           rather than getSourceSetBySensor()
+        """
+
+        dataIdStr = self._dataIdToString(dataIdRegex, defineFully=True)
+        cacheKey = dataIdStr + ("-match" if useMatches else "-src")
+
+        if not self.photometryCache.has_key(cacheKey):
+            photDict = {}
+            if useMatches:
+                matchListDict = self.getMatchListBySensor(dataIdRegex, useRef='src')
+                for k, matchDict in matchListDict.items():
+                    matchList = matchDict['matched']
+                    columns = {}
+                    names = ["FlagPixInterpCen", "FlagPixSaturCen", "FlagPixEdge", "Extendedness",
+                             "XAstrom", "YAstrom"]
+                    for fluxNames in self.photometryFluxColumns.values():
+                        names += fluxNames
+                    for name in names:
+                        columns[name] = matchList.getColumn(name)
+                    photDict[k] = self._makePhotometry(columns, matchList.getRefColumn('PsfFlux'))
+            else:
+                ssDict = self.getSourceSetBySensor(dataIdRegex)
+                for k, ss in ssDict.items():
+                    photDict[k] = self._makePhotometry(ss.columns)
+            self.photometryCache[cacheKey] = photDict
+
+        return copy.copy(self.photometryCache[cacheKey])
+
+
+    def _makePhotometry(self, columns, refFlux=None):
+        """Compute the getPhotometryBySensor() entry for one sensor.
+
+        @param columns  Dict of source column arrays, keyed by accessor name
+        @param refFlux  Array of matched reference fluxes, or None if there are no matches
+        """
+
+        fluxes = {}
+        for mType, fluxNames in self.photometryFluxColumns.items():
+            fluxName, errName = fluxNames
+            fluxes[mType] = columns[fluxName], columns[errName]
+        if refFlux is not None:
+            fluxes["cat"] = refFlux, numpy.zeros(len(refFlux))
+
+        phot = {}
+        for mType, fluxAndErr in fluxes.items():
+            flux, fluxErr = fluxAndErr
+            mag    = numpy.empty(len(flux))
+            magErr = numpy.empty(len(flux))
+            mag.fill(numpy.NaN)
+            magErr.fill(numpy.NaN)
+            with numpy.errstate(invalid='ignore', over='ignore'):
+                w = numpy.where((flux > 0.0) & numpy.isfinite(flux))[0]
+                mag[w]    = -2.5*numpy.log10(flux[w])
+                magErr[w] = 2.5 / numpy.log(10.0) * fluxErr[w] / flux[w]
+            phot[mType] = mag
+            phot[mType+"Err"] = magErr
+
+        # NaN flags count as set, as they do for 'if flag'
+        with numpy.errstate(invalid='ignore'):
+            flagged = (columns["FlagPixSaturCen"] != 0) | (columns["FlagPixEdge"] != 0)
+            # coadds have excessive area covered by InterpCen flags
+            if self.cameraInfo.name != 'coadd':
+                flagged |= (columns["FlagPixInterpCen"] != 0)
+            phot["flagged"] = flagged
+            phot["star"] = numpy.where(columns["Extendedness"] != 0, 0, 1)
+        phot["XAstrom"] = columns["XAstrom"]
+        phot["YAstrom"] = columns["YAstrom"]
+        return phot
+
+
+    def _classifyMatchList(self, sources, refObjects, matchList, multiplicity=None):
+        """Find the orphan, undetected, matched and blended entries for one sensor.
+
+        Returns a dict with the index arrays from qaDataUtils.classifyMatches() as 'index',
+        the sources ('orphan') and reference objects ('undetected') which they pick out,
+        and the 'matched' and 'blended' parts of matchList, as MatchLists.
+        
+        @param sources      The sensor's sources
+        @param refObjects   The sensor's reference objects (a SimRefObjectSet, whose 'undetected'
+                            are then a SimRefObjectSet too)
+        @param matchList    The sensor's matches, a source.MatchList
+        @param multiplicity Array of the number of matches to each match's source, if known
+        """
+        if isinstance(sources, pqaSource.ColumnCatalog):
+            srcIds = sources.getColumn('Id')
+        else:
+            srcIds = [so.getId() for so in sources]
+        if isinstance(refObjects, simRefObj.SimRefObjectSet):
+            refIds = refObjects.getIds()
+        else:
+            refIds = [ro.getId() for ro in refObjects]
+
+        index = qaDataUtils.classifyMatches(srcIds, refIds, matchList.getColumn('Id'),
+                                            matchList.getRefColumn('Id'), multiplicity)
+        types = {}
+        types['index']      = index
+        if isinstance(sources, pqaSource.ColumnCatalog):
+            types['orphan'] = sources.select(index['orphan'])
+        else:
+            types['orphan'] = [sources[i] for i in index['orphan'].tolist()]
+        if isinstance(refObjects, simRefObj.SimRefObjectSet):
+            types['undetected'] = refObjects[index['undetected']]
+        else:
+            types['undetected'] = [refObjects[i] for i in index['undetected'].tolist()]
+        types['matched']    = matchList.select(index['matched'])
+        types['blended']    = matchList.select(index['blended'])
+        return types
+
+
     def getWcsBySensor(self, dataIdRegex):
         """Get a dict of Wcs objects with sensor ids as keys.
         
@@ -355,17 +619,105 @@ class QaData(object):
     #
     #######################################################################
     def _dataTupleToString(self, dataTuple):
-        """Represent a dataTuple as a string.
+        """Represent a dataTuple as a string (the DataIdKey used in the caches).
 
         @param dataTuple The dataTupe to be converted.
         """
         
-        s = []
-        for i in xrange(len(self.dataIdNames)):
-            name = self.dataIdNames[i]
-            value = re.sub("[,]", "", str(dataTuple[i]))
-            s.append(name + value)
-        return "-".join(s)
+        return self._internDataIdKey(tuple([self._dataIdValue(v) for v in dataTuple]))
+
+    def _dataIdValue(self, value):
+        """The string form of one dataId value used in keys, eg. raft '2,2' -> '22'."""
+        return re.sub("[,]", "", str(value))
+
+    def _internDataIdKey(self, values):
+        """Get the one DataIdKey for a tuple of dataId value strings, indexing it if it's new.
+
+        @param values Tuple of _dataIdValue() strings, one for each of self.dataIdNames
+        """
+        key = self.dataIdKeys.get(values)
+        if key is None:
+            key = DataIdKey("-".join([name + value for name, value in zip(self.dataIdNames, values)]),
+                            values)
+            self.dataIdKeys[values] = key
+            node = self.dataIdIndex
+            for value in values[:-1]:
+                if not node.has_key(value):
+                    node[value] = {}
+                node = node[value]
+            node[values[-1]] = key
+        return key
+
+    def _dataIdToKey(self, dataId):
+        """Get the DataIdKey for an explicit dataId dict (ie. no regexes).
+
+        A missing snap is taken to be snap 0, as _dataIdToString(defineFully=True) does.
+        
+        @param dataId The dataId to be converted
+        """
+        values = []
+        for dataIdName in self.dataIdNames:
+            if dataId.has_key(dataIdName):
+                values.append(self._dataIdValue(dataId[dataIdName]))
+            elif dataIdName == 'snap':
+                values.append("0")
+            else:
+                # not a full dataId, there's nothing to index it by
+                return self._dataIdToString(dataId, defineFully=True)
+        return self._internDataIdKey(tuple(values))
+
+    # characters which make a dataId value a regex rather than a literal value
+    _dataIdRegexChars = re.compile("[.*?+^$|()\\[\\]{}\\\\%]")
+    
+    def _matchingDataIdKeys(self, dataIdRegex, defineFully=True):
+        """Get the DataIdKeys made so far which match a dataId of regular expressions.
+
+        Each value in dataIdRegex has to match a whole value (SQL '%' is taken as '.*').
+        The index is walked one dataId name at a time, looking literal values up directly,
+        so this costs about the number of matches rather than the number of keys.
+        
+        @param dataIdRegex dataId dict of regular expressions
+        @param defineFully Take a missing snap to be snap 0 (as _dataIdToString does), not any snap
+        """
+        nodes = [self.dataIdIndex]
+        for pattern in self._dataIdKeyPatterns(dataIdRegex, defineFully):
+            if pattern == ".*":
+                nodes = [child for node in nodes for child in node.itervalues()]
+            elif not self._dataIdRegexChars.search(pattern):
+                nodes = [node[pattern] for node in nodes if node.has_key(pattern)]
+            else:
+                regex = re.compile("(?:%s)$" % (pattern))
+                nodes = [child for node in nodes for value, child in node.iteritems() if regex.match(value)]
+        return nodes
+
+    def _dataIdKeyPatterns(self, dataIdRegex, defineFully=True):
+        """Get the regex each value of a DataIdKey must match to match dataIdRegex, in dataIdNames order.
+
+        @param dataIdRegex dataId dict of regular expressions
+        @param defineFully Take a missing snap to be snap 0, not any snap
+        """
+        patterns = []
+        for dataIdName in self.dataIdNames:
+            if dataIdRegex.has_key(dataIdName):
+                patterns.append(re.sub("%", ".*", self._dataIdValue(dataIdRegex[dataIdName])))
+            elif defineFully and dataIdName == 'snap':
+                patterns.append("0")
+            else:
+                patterns.append(".*")
+        return patterns
+
+    def _getMatchingEntries(self, cache, dataIdRegex, defineFully=True):
+        """Get the entries of a cache keyed by DataIdKeys which match a dataId of regular expressions.
+
+        @param cache       The cache dictionary to look in
+        @param dataIdRegex dataId dict of regular expressions
+        @param defineFully See _matchingDataIdKeys()
+        """
+        entryDict = {}
+        for key in self._matchingDataIdKeys(dataIdRegex, defineFully):
+            if cache.has_key(key):
+                entryDict[key] = cache[key]
+        return entryDict
 
     #######################################################################
     # utility to convert a data tuple to a dictionary using dataId keys
@@ -416,7 +768,7 @@ class QaData(object):
         for i in xrange(len(self.dataIdNames)):
             dataIdName = self.dataIdNames[i]
             if dataId.has_key(dataIdName):
-                s.append( dataIdName + re.sub("[,]", "", str(dataId[dataIdName])))
+                s.append( dataIdName + self._dataIdValue(dataId[dataIdName]))
             elif defineFully:
                 if dataIdName == 'snap':
                     s.append(dataIdName + "0")
@@ -458,6 +810,8 @@ class QaData(object):
     def getSourceSetBySensor(self, dataIdRegex):
         """Get a dict of all Sources matching dataId, with sensor name as dict keys.
 
+        Each value is a source.ColumnCatalog.
+
         @param dataIdRegex dataId dict of regular expressions for data to be retrieved
         """
         raise NotImplementedError, "Must define getSourceSetBySensor in derived QaData class."
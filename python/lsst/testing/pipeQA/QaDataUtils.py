@@ -457,19 +457,109 @@ def calibFluxError(f, df, f0, df0):
     else:
         return numpy.NaN
 
+def calibFluxErrorArray(f, df, f0, df0):
+    """Array version of calibFluxError; entries which calibFluxError would set to NaN are NaN here too.
+
+    @param f   Array of fluxes
+    @param df  Array of flux errors
+    @param f0  fluxMag0 for the exposure, or an array with the fluxMag0 of each flux
+    @param df0 fluxMag0Sigma for the exposure, or an array with one per flux
+    """
+    f  = numpy.asarray(f, dtype=numpy.float64)
+    df = numpy.asarray(df, dtype=numpy.float64)
+    f0, df0 = numpy.broadcast_arrays(numpy.asarray(f0, dtype=numpy.float64),
+                                     numpy.asarray(df0, dtype=numpy.float64), f)[0:2]
+
+    err = numpy.empty(f.shape, dtype=numpy.float64)
+    err.fill(numpy.NaN)
+
+    # NaN and inf fluxes fail here, just as they do in calibFluxError
+    with numpy.errstate(invalid='ignore'):
+        good = (f > 0.0) & numpy.isfinite(f) & (f0 > 0.0)
+    fg  = f[good]
+    f0g = f0[good]
+    with numpy.errstate(over='ignore'):
+        err[good] = (df[good]/fg + df0[good]/f0g)*fg/f0g
+    return err
+
+def calibrateFluxes(f, df, f0, df0):
+    """Calibrate a flux column and its errors with the exposure's fluxMag0.
+
+    Returns the calibrated fluxes and flux errors as a pair of arrays.
+    
+    @param f   Array of uncalibrated fluxes
+    @param df  Array of uncalibrated flux errors
+    @param f0  fluxMag0 for the exposure
+    @param df0 fluxMag0Sigma for the exposure
+    """
+    f = numpy.asarray(f, dtype=numpy.float64)
+    return f/f0, calibFluxErrorArray(f, df, f0, df0)
+
 def atEdge(bbox, x, y):
+    """Are positions within the border of the bbox?  x and y may be scalars or arrays.
 
+    @param bbox  x0, y0, x1, y1 of the image
+    @param x     Column position(s)
+    @param y     Row position(s)
+    """
     borderWidth = 18
     x0, y0, x1, y1 = bbox
     imgWidth  = x1 - x0
     imgHeight = y1 - y0
-    
-    if x < borderWidth or imgWidth - x < borderWidth:
-        return True
-    if y < borderWidth or imgHeight - y < borderWidth:
-        return True
-    
-    return False
 
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+    return (x < borderWidth) | (imgWidth - x < borderWidth) | \
+           (y < borderWidth) | (imgHeight - y < borderWidth)
 
 
+
+
+
+def classifyMatches(srcIds, refIds, matchSrcIds, matchRefIds, multiplicity=None):
+    """Sort sources and reference objects into orphans, undetected, matched and blended.
+
+    Returns a dict of index arrays: 'orphan' (into srcIds) for sources with no match,
+    'undetected' (into refIds) for reference objects with no match, and 'matched' and
+    'blended' (into the match list) for sources with one match, or more than one.
+    Matched and blended sources come in srcIds order, each with its last match.
+    
+    @param srcIds       Array of source ids
+    @param refIds       Array of reference object ids
+    @param matchSrcIds  Array of the source id of each match
+    @param matchRefIds  Array of the reference object id of each match
+    @param multiplicity Array of the number of matches to each match's source, if known
+                        (the value from a source's last match is used), otherwise it's counted
+    """
+    srcIds      = numpy.asarray(srcIds, dtype=numpy.int64)
+    refIds      = numpy.asarray(refIds, dtype=numpy.int64)
+    matchSrcIds = numpy.asarray(matchSrcIds, dtype=numpy.int64)
+    matchRefIds = numpy.asarray(matchRefIds, dtype=numpy.int64)
+
+    types = {}
+    types['undetected'] = numpy.where(~numpy.in1d(refIds, matchRefIds))[0]
+    types['orphan']     = numpy.where(~numpy.in1d(srcIds, matchSrcIds))[0]
+
+    if len(matchSrcIds) == 0:
+        types['matched'] = numpy.array([], dtype=int)
+        types['blended'] = numpy.array([], dtype=int)
+        return types
+
+    # the distinct matched source ids, with the last match and number of matches for each
+    order     = numpy.argsort(matchSrcIds, kind='mergesort')
+    sortedIds = matchSrcIds[order]
+    last      = numpy.append(numpy.where(sortedIds[1:] != sortedIds[:-1])[0], len(sortedIds) - 1)
+    uniqueIds = sortedIds[last]
+    lastMatch = order[last]
+    if multiplicity is None:
+        counts = numpy.diff(numpy.append(-1, last))
+    else:
+        counts = numpy.asarray(multiplicity, dtype=numpy.float64)[lastMatch]
+
+    pos = numpy.minimum(numpy.searchsorted(uniqueIds, srcIds), len(uniqueIds) - 1)
+    found = uniqueIds[pos] == srcIds
+    matchIndex = lastMatch[pos[found]]
+    single = counts[pos[found]] == 1
+    types['matched'] = matchIndex[single]
+    types['blended'] = matchIndex[~single]
+    return types
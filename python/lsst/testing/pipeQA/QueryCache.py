@@ -0,0 +1,201 @@
+import os, re
+import thread
+import hashlib
+import cPickle
+import numpy
+
+
+def normalizeSql(sql):
+    """Collapse whitespace and drop any trailing ';' so trivially different SQL gives the same key."""
+    sql = re.sub("\s+", " ", sql).strip()
+    return re.sub("\s*;$", "", sql)
+
+
+def toColumn(values):
+    """Make a numpy array of a column of query results; non-numeric columns become object arrays."""
+    try:
+        column = numpy.array(values)
+        if column.ndim == 1 and column.dtype.kind in 'biuf':
+            return column
+    except Exception, e:
+        pass
+    column = numpy.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+class QueryCache(object):
+    """Query results kept on disk between runs, keyed by the database name and normalized SQL.
+
+    Each result is stored as a binary cPickle of one numpy array per column (numeric columns
+    are stored packed, anything else as an object array), in one directory per database.
+    When the total size goes over maxBytes, the least recently used results are removed.
+    Files are written under a temporary name and renamed, so several processes can share
+    a cache.
+
+    The total size is counted once from the directory, and then kept up to date as results
+    are stored.  Results stored by other processes sharing the cache are only counted when
+    the directory is next scanned, after rescanInterval stores or when we go over maxBytes.
+    """
+
+    def __init__(self, directory, maxBytes=1024**3, rescanInterval=100):
+        """
+        @param directory      Where to keep the cached results
+        @param maxBytes       Largest total size of the cached results
+        @param rescanInterval Number of stores between scans of the directory
+        """
+        self.directory      = directory
+        self.maxBytes       = maxBytes
+        self.rescanInterval = rescanInterval
+        self.totalBytes     = None  # unknown until the directory is scanned
+        self.nPutSinceScan  = 0
+
+    def _path(self, database, sql, context):
+        key = hashlib.sha1(database + "\n" + normalizeSql(sql) + "\n" + "\n".join(context)).hexdigest()
+        return os.path.join(self.directory, database, key + ".pickle")
+
+    def get(self, database, sql, context=()):
+        """Get the cached rows for sql, or None if they aren't cached.
+
+        @param database The database the query ran on
+        @param sql      The query
+        @param context  Normalized session statements (eg. setting @poly) the result depends on
+        """
+        cached = self.getColumns(database, sql, context)
+        if cached is None:
+            return None
+        nRow, columns = cached
+        if len(columns) == 0:
+            return tuple([() for i in range(nRow)])
+        return tuple(zip(*[column.tolist() for column in columns]))
+
+    def getColumns(self, database, sql, context=()):
+        """Get the cached result of sql as the number of rows and a list of column arrays,
+        or None if it isn't cached.
+
+        @param database The database the query ran on
+        @param sql      The query
+        @param context  Normalized session statements the result depends on
+        """
+        path = self._path(database, sql, context)
+        try:
+            fp = open(path, 'rb')
+            try:
+                nRow, columns = cPickle.load(fp)
+            finally:
+                fp.close()
+            # mark it as recently used
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError), e:
+            return None
+        return nRow, columns
+
+    def put(self, database, sql, context, rows):
+        """Store the rows returned by sql.
+
+        @param database The database the query ran on
+        @param sql      The query
+        @param context  Normalized session statements the result depends on
+        @param rows     The rows returned, as a sequence of tuples
+        """
+        columns = [toColumn(values) for values in zip(*rows)]
+        self.putColumns(database, sql, context, len(rows), columns)
+
+    def putColumns(self, database, sql, context, nRow, columns):
+        """Store the result of sql, given as columns (eg. gathered a batch at a time from a stream).
+
+        @param database The database the query ran on
+        @param sql      The query
+        @param context  Normalized session statements the result depends on
+        @param nRow     The number of rows returned
+        @param columns  List of numpy arrays, one per column
+        """
+        path = self._path(database, sql, context)
+        dirName = os.path.dirname(path)
+        if not os.path.exists(dirName):
+            try:
+                os.makedirs(dirName)
+            except OSError, e:
+                if not os.path.isdir(dirName):
+                    raise
+
+        tmpPath = "%s.%d.%d.tmp" % (path, os.getpid(), thread.get_ident())
+        fp = open(tmpPath, 'wb')
+        try:
+            cPickle.dump((nRow, columns), fp, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        size = os.path.getsize(tmpPath)
+        try:
+            oldSize = os.path.getsize(path)
+        except OSError, e:
+            oldSize = 0
+        os.rename(tmpPath, path)
+
+        self.nPutSinceScan += 1
+        if self.totalBytes is not None:
+            self.totalBytes += size - oldSize
+        if self.totalBytes is None or self.totalBytes > self.maxBytes or \
+                self.nPutSinceScan >= self.rescanInterval:
+            self._evict()
+
+    def _evict(self):
+        """Count the cached results, and remove the least recently used if we're over maxBytes.
+
+        Results are removed until we're 10% under maxBytes, so that a full cache isn't
+        scanned again on the next store.
+        """
+        entries = []
+        total = 0
+        for dirPath, dirNames, fileNames in os.walk(self.directory):
+            for fileName in fileNames:
+                if not fileName.endswith(".pickle"):
+                    continue
+                path = os.path.join(dirPath, fileName)
+                try:
+                    stat = os.stat(path)
+                except OSError, e:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        if total > self.maxBytes:
+            lowBytes = 0.9*self.maxBytes
+        else:
+            lowBytes = self.maxBytes
+        while total > lowBytes and len(entries) > 0:
+            mtime, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError, e:
+                pass  # another process got it first
+            total -= size
+
+        self.totalBytes    = total
+        self.nPutSinceScan = 0
+
+    def invalidate(self, database=None):
+        """Remove the cached results for a database, or for all databases.
+
+        @param database The database to forget, or None for all of them.
+        """
+        if database is None:
+            databases = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        else:
+            databases = [database]
+
+        for database in databases:
+            dirName = os.path.join(self.directory, database)
+            if not os.path.isdir(dirName):
+                continue
+            for fileName in os.listdir(dirName):
+                try:
+                    os.remove(os.path.join(dirName, fileName))
+                except OSError, e:
+                    pass
+            try:
+                os.rmdir(dirName)
+            except OSError, e:
+                pass
+        self.totalBytes = None
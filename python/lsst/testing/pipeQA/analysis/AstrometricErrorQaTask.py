@@ -15,6 +15,7 @@ import lsst.testing.pipeQA.TestCode as testCode
 import lsst.testing.pipeQA.figures.QaFigureUtils as qaFigUtil
 import RaftCcdData as raftCcdData
 import QaAnalysisUtils as qaAnaUtil
+import GroupStatistics as groupStats
 
 import lsst.testing.pipeQA.source as pqaSource
 import QaPlotUtils as qaPlotUtil
@@ -96,29 +97,23 @@ class AstrometricErrorQaTask(QaAnalysisTask):
             filter = self.filter[key].getName()
 
             matchList = self.matchListDictSrc[key]['matched']
-            for m in matchList:
-                sref, s, dist = m
-                ra, dec, raRef, decRef = \
-                    [numpy.radians(x) for x in [s.getD(raKey), s.getD(decKey), \
-                                                    sref.getD(refRaKey), sref.getD(refDecKey)]]
-                
-                dDec = decRef - dec
-                dRa  = (raRef - ra)*abs(numpy.cos(decRef))
-                
-                intcen = s.getD(self.sCatDummy.FlagPixInterpCenKey)
-                satcen = s.getD(self.sCatDummy.FlagPixSaturCenKey)
-                edge   = s.getD(self.sCatDummy.FlagPixEdgeKey)
-
-                if data.cameraInfo.name == 'coadd':
-                    flagit = (satcen or edge) # coadds have excessive area covered by InterpCen flags
-                else:
-                    flagit = (intcen or satcen or edge)
-
-                if not (flagit):
-                    self.dRa.append(raft, ccd, dRa)
-                    self.dDec.append(raft, ccd, dDec)
-                    self.x.append(raft, ccd, s.getD(xKey))
-                    self.y.append(raft, ccd, s.getD(yKey))
+
+            dRa, dDec = qaAnaUtil.skyOffsets(matchList.getColumn(raKey), matchList.getColumn(decKey),
+                                             matchList.getRefColumn(refRaKey),
+                                             matchList.getRefColumn(refDecKey))
+
+            # NaN flags count as set, as they do for 'if flag'
+            flagit = (matchList.getColumn(self.sCatDummy.FlagPixSaturCenKey) != 0) | \
+                (matchList.getColumn(self.sCatDummy.FlagPixEdgeKey) != 0)
+            # coadds have excessive area covered by InterpCen flags
+            if data.cameraInfo.name != 'coadd':
+                flagit |= (matchList.getColumn(self.sCatDummy.FlagPixInterpCenKey) != 0)
+
+            good = ~flagit
+            self.dRa.extend(raft, ccd, dRa[good])
+            self.dDec.extend(raft, ccd, dDec[good])
+            self.x.extend(raft, ccd, matchList.getColumn(xKey)[good])
+            self.y.extend(raft, ccd, matchList.getColumn(yKey)[good])
                     
                     
         testSet = self.getTestSet(data, dataId)
@@ -127,33 +122,33 @@ class AstrometricErrorQaTask(QaAnalysisTask):
         self.medErrArcsec = raftCcdData.RaftCcdData(self.detector)
         self.medThetaRad  = raftCcdData.RaftCcdData(self.detector)
 
-        for raft,  ccd in self.dRa.raftCcdKeys():
-            dRa  = self.dRa.get(raft, ccd).copy()
-            dDec = self.dDec.get(raft, ccd).copy()
+        # medians of all ccds at once: first the offsets, then the scatter about them
+        keys, dRa, offsets = self.dRa.concatenate()
+        keys, dDec, offsets = self.dDec.concatenate()
+        group = groupStats.groupIds(offsets)
 
-            if len(dRa) > 0:
-                dRaMed = numpy.median(dRa)
-                dDecMed = numpy.median(dDec)
-            else:
-                dRaMed = 0.0
-                dDecMed = 0.0
+        dRaStats = groupStats.groupStatistics(dRa, offsets)
+        count = dRaStats["n"]
+        dRaMeds = numpy.where(count > 0, dRaStats["median"], 0.0)
+        dDecMeds = numpy.where(count > 0, groupStats.groupStatistics(dDec, offsets)["median"], 0.0)
+
+        dRa = dRa - dRaMeds[group]
+        dDec = dDec - dDecMeds[group]
+        rmsErrStats = groupStats.groupStatistics(numpy.sqrt(dRa**2 + dDec**2), offsets)
+        rmsThetaStats = groupStats.groupStatistics(numpy.arctan2(dDec, dRa), offsets)
+
+        for i, (raft, ccd) in enumerate(keys):
+            dRaMed = dRaMeds[i]
+            dDecMed = dDecMeds[i]
 
             sysErr = numpy.sqrt(dRaMed**2 + dDecMed**2)*afwGeom.radians
             sysErrArcsec = sysErr.asArcseconds()
             sysThetaRad  = numpy.arctan2(dDecMed, dRaMed)
             
-            dRa  -= dRaMed
-            dDec -= dDecMed
-
-            rmsErr = numpy.sqrt(dRa**2 + dDec**2)
-            rmsThetaRad  = numpy.arctan2(dDec, dRa)
-
-            if len(rmsErr) > 0:
-                stat  = afwMath.makeStatistics(rmsErr, afwMath.NPOINT | afwMath.MEDIAN)
-                medRmsErr = stat.getValue(afwMath.MEDIAN)
-                stat  = afwMath.makeStatistics(rmsThetaRad, afwMath.NPOINT | afwMath.MEDIAN)
-                medRmsThetaRad = stat.getValue(afwMath.MEDIAN)
-                n = stat.getValue(afwMath.NPOINT)
+            if count[i] > 0:
+                medRmsErr = float(rmsErrStats["median"][i])
+                medRmsThetaRad = rmsThetaStats["median"][i]
+                n = rmsThetaStats["n"][i]
             else:
                 medRmsErr = -1.0
                 medRmsThetaRad = 0.0
@@ -0,0 +1,193 @@
+"""Photometric depth from completeness histograms, for all ccds at once.
+
+The completeness in each magnitude bin is found/(found + undetected), and the depth is the
+magnitude where it drops to 0.5.  It comes either from a fit of the model
+0.5 - arctan(A*mag + B)/pi (so depth = -B/A), or from where the binned curve crosses 0.5.
+Each ccd is one row of the stacked (nCcd x nBin) histograms.
+"""
+
+import numpy
+
+
+def stackedHistograms(arrays, bins):
+    """Histogram each of a list of arrays with the same bins, as numpy.histogram() does.
+
+    @param arrays  List of arrays of values (eg. magnitudes), one per ccd
+    @param bins    Bin edges, in increasing order
+    @return array of shape (len(arrays), len(bins)-1) with the counts
+    """
+    bins = numpy.asarray(bins, dtype=numpy.float64)
+    nBin = len(bins) - 1
+    nGroup = len(arrays)
+    if nGroup == 0:
+        return numpy.zeros((0, nBin), dtype=int)
+
+    counts = numpy.array([len(a) for a in arrays], dtype=int)
+    group = numpy.repeat(numpy.arange(nGroup), counts)
+    values = numpy.concatenate([numpy.asarray(a, dtype=numpy.float64).ravel() for a in arrays])
+
+    # NaNs sort past the last edge, so they aren't counted
+    idx = numpy.searchsorted(bins, values, side='right') - 1
+    # the last bin includes its upper edge
+    idx[values == bins[-1]] = nBin - 1
+    ok = (idx >= 0) & (idx < nBin)
+    hist = numpy.bincount(group[ok]*nBin + idx[ok], minlength=nGroup*nBin)
+    return hist.reshape(nGroup, nBin)
+
+
+def crossingMags(found, total, bins, level=0.5):
+    """Find where the binned completeness of each row drops through level.
+
+    Bins with no objects are skipped, and a bin of zero completeness is added after each
+    row's last bin.  The crossing is the faintest one, interpolated linearly between bin
+    centers; rows without a crossing get 0.0.
+
+    @param found  Stacked histograms of detected objects
+    @param total  Stacked histograms of all (detected + undetected) objects
+    @param bins   Bin edges used for the histograms
+    @param level  Completeness to find
+    """
+    found = numpy.asarray(found, dtype=numpy.float64)
+    total = numpy.asarray(total, dtype=numpy.float64)
+    nGroup, nBin = total.shape
+    centers = 0.5*(bins[1:] + bins[:-1])
+    binsize = bins[1] - bins[0]
+
+    valid = total != 0
+    nValid = valid.sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        y = numpy.where(valid, found/total, 0.0)
+
+    # append the zero completeness point after each row's last bin
+    last = nBin - 1 - numpy.argmax(valid[:,::-1], axis=1)
+    x2 = numpy.empty((nGroup, nBin + 1))
+    x2[:,0:nBin] = centers
+    x2[:,nBin] = centers[last] + binsize
+    y2 = numpy.zeros((nGroup, nBin + 1))
+    y2[:,0:nBin] = y
+    valid2 = numpy.zeros((nGroup, nBin + 1), dtype=bool)
+    valid2[:,0:nBin] = valid
+    valid2[:,nBin] = nValid > 0
+
+    # the valid points of all rows in one list, with each point's position k in its row
+    X = x2[valid2]
+    Y = y2[valid2]
+    row = numpy.nonzero(valid2)[0]
+    n2 = valid2.sum(axis=1)
+    k = numpy.arange(len(X)) - (numpy.cumsum(n2) - n2)[row]
+
+    cross = numpy.zeros(len(X), dtype=bool)
+    cross[1:] = (k[1:] >= 2) & (Y[1:] <= level) & (Y[:-1] > level)
+    j = numpy.nonzero(cross)[0]
+
+    depth = numpy.zeros(nGroup)
+    if len(j) > 0:
+        # keep the last (faintest) crossing of each row
+        j = j[numpy.append(row[j][1:] != row[j][:-1], True)]
+        depth[row[j]] = (level - Y[j-1])/(Y[j] - Y[j-1])*(X[j] - X[j-1]) + X[j-1]
+    return depth
+
+
+def _arctanModel(A, B, x):
+    return 0.5 - numpy.arctan(A[:,numpy.newaxis]*x + B[:,numpy.newaxis])/numpy.pi
+
+
+def fitArctan(found, total, bins, A0, B0, nIter=30):
+    """Fit completeness = 0.5 - arctan(A*mag + B)/pi to every row of the histograms at once.
+
+    Bins with detections are weighted by their Poisson error sqrt(found)/total.  All rows
+    take damped Gauss-Newton (Levenberg-Marquardt) steps together; a row only accepts a
+    step which lowers its chi^2.
+
+    @param found  Stacked histograms of detected objects
+    @param total  Stacked histograms of all (detected + undetected) objects
+    @param bins   Bin edges used for the histograms
+    @param A0     Array of starting A values, one per row
+    @param B0     Array of starting B values, one per row
+    @param nIter  Number of iterations
+    @return A, B, ok -- the fit parameters, and whether each row's fit is usable
+    """
+    found = numpy.asarray(found, dtype=numpy.float64)
+    total = numpy.asarray(total, dtype=numpy.float64)
+    x = 0.5*(bins[1:] + bins[:-1])
+
+    use = (total > 0) & (found > 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        y = numpy.where(use, found/total, 0.0)
+        w = numpy.where(use, total**2/found, 0.0)
+
+    def chi2(A, B):
+        return (w*(_arctanModel(A, B, x) - y)**2).sum(axis=1)
+
+    A = numpy.array(A0, dtype=numpy.float64)
+    B = numpy.array(B0, dtype=numpy.float64)
+    lam = numpy.zeros(len(A)) + 1.0e-3
+    with numpy.errstate(all='ignore'):
+        c2 = chi2(A, B)
+        for i in range(nIter):
+            t = A[:,numpy.newaxis]*x + B[:,numpy.newaxis]
+            r = y - (0.5 - numpy.arctan(t)/numpy.pi)
+            # derivatives of the model wrt B and A
+            JB = -1.0/(numpy.pi*(1.0 + t**2))
+            JA = JB*x
+
+            Haa = (w*JA*JA).sum(axis=1)*(1.0 + lam)
+            Hbb = (w*JB*JB).sum(axis=1)*(1.0 + lam)
+            Hab = (w*JA*JB).sum(axis=1)
+            ga = (w*JA*r).sum(axis=1)
+            gb = (w*JB*r).sum(axis=1)
+            det = Haa*Hbb - Hab**2
+            dA = (Hbb*ga - Hab*gb)/det
+            dB = (Haa*gb - Hab*ga)/det
+
+            c2new = chi2(A + dA, B + dB)
+            better = numpy.isfinite(c2new) & (c2new < c2)
+            A[better] += dA[better]
+            B[better] += dB[better]
+            c2[better] = c2new[better]
+            lam = numpy.where(better, 0.1*lam, 10.0*lam)
+
+        depth = -B/A
+
+    # need more points than parameters, a falling curve, and a depth inside the data
+    nUse = use.sum(axis=1)
+    xMin = numpy.where(use, x, numpy.inf).min(axis=1)
+    xMax = numpy.where(use, x, -numpy.inf).max(axis=1)
+    with numpy.errstate(invalid='ignore'):
+        ok = (nUse > 2) & numpy.isfinite(A) & numpy.isfinite(B) & (A > 0) & \
+             (depth >= xMin) & (depth <= xMax + (bins[1] - bins[0]))
+    return A, B, ok
+
+
+def limitingMags(found, total, bins, fit=True):
+    """Get the photometric depth of every row of the stacked histograms.
+
+    With fit set, the depth is -B/A from fitArctan() (started from the crossing), falling
+    back to crossingMags() for rows where the fit isn't usable.
+
+    @param found  Stacked histograms of detected objects
+    @param total  Stacked histograms of all (detected + undetected) objects
+    @param bins   Bin edges used for the histograms
+    @param fit    Fit the arctan model, rather than only interpolating the crossing
+    @return depth, A, B -- A and B are 0.0 for rows without a usable fit
+    """
+    bins = numpy.asarray(bins, dtype=numpy.float64)
+    depth = crossingMags(found, total, bins)
+    A = numpy.zeros(len(depth))
+    B = numpy.zeros(len(depth))
+    if not fit or len(depth) == 0:
+        return depth, A, B
+
+    # start at the crossing, or the middle of the magnitudes seen if there isn't one
+    centers = 0.5*(bins[1:] + bins[:-1])
+    nTotal = numpy.asarray(total, dtype=numpy.float64).sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        meanMag = (numpy.asarray(total)*centers).sum(axis=1)/nTotal
+    start = numpy.where(depth > 0, depth, numpy.where(nTotal > 0, meanMag, centers.mean()))
+    A0 = numpy.zeros(len(depth)) + 2.0
+    fitA, fitB, ok = fitArctan(found, total, bins, A0, -A0*start)
+
+    A[ok] = fitA[ok]
+    B[ok] = fitB[ok]
+    depth[ok] = -B[ok]/A[ok]
+    return depth, A, B
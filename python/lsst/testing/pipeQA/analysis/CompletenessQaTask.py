@@ -10,6 +10,7 @@ import lsst.testing.pipeQA.TestCode as testCode
 import lsst.testing.pipeQA.figures as qaFig
 import lsst.testing.pipeQA.figures.QaFigureUtils as qaFigUtils
 import RaftCcdData as raftCcdData
+import CompletenessFit as completenessFit
 
 import lsst.testing.pipeQA.source as pqaSource
 
@@ -19,13 +20,6 @@ import matplotlib.ticker as ticker
 from matplotlib.font_manager import FontProperties
 import matplotlib.patches as patches
 
-# Until we can make it more robust
-hasMinuit = False
-try:
-    import minuit2
-except:
-    hasMinuit = False
-    
 
 class CompletenessQaConfig(pexConfig.Config):
     cameras        = pexConfig.ListField(dtype=str,
@@ -33,6 +27,10 @@ class CompletenessQaConfig(pexConfig.Config):
                                          default=("lsstSim", "cfht", "sdss", "coadd"))
     completeMinMag = pexConfig.Field(dtype=float, doc="Minimum photometric depth", default = 20.0)
     completeMaxMag = pexConfig.Field(dtype=float, doc="Maximum reasonable photometric depth", default = 25.0)
+    fitDepth       = pexConfig.Field(dtype=bool,
+                                     doc="Fit an arctan model to the completeness (else use its 50% crossing, " +
+                                     "as the published depths have always done)",
+                                     default = False)
 
     
 class CompletenessQaTask(QaAnalysisTask):
@@ -74,89 +72,25 @@ class CompletenessQaTask(QaAnalysisTask):
         del self.blendedGalaxy
         del self.undetectedGalaxy
         del self.depth
-        if hasMinuit:
-            del self.fit
         del self.faintest
 
-    def limitingMag(self, raftId, ccdId):
-        if hasMinuit:
-            try:
-                return self.limitingMagMinuit(raftId, ccdId)
-            except:
-                pass
-
-        matchedStar     = num.array(self.matchedStar.get(raftId, ccdId))
-        blendedStar     = num.array(self.blendedStar.get(raftId, ccdId))
-        undetectedStar  = num.array(self.undetectedStar.get(raftId, ccdId))
-
-        allStars        = num.concatenate((matchedStar, blendedStar, undetectedStar))
-        foundStars      = num.concatenate((matchedStar, blendedStar))
-        histAll         = num.histogram(allStars, bins=self.bins)
-        histFound       = num.histogram(foundStars, bins=self.bins)
-
-        magbins = 0.5 * (histAll[1][1:] + histAll[1][:-1])
-        w       = num.where(histAll[0] != 0)
-        x       = magbins[w]
-        n       = 1.0 * histFound[0][w]
-        d       = 1.0 * histAll[0][w]
-        y       = n / d
-
-        binsize = self.bins[1] - self.bins[0]
-        x = num.append(x, x[-1] + binsize)
-        y = num.append(y, 0.0)
-
-        for i in num.arange(len(y) - 1, 1, -1):
-            if y[i] <= 0.5 and y[i-1] > 0.5:
-                return (0.5 - y[i-1]) / (y[i] - y[i-1]) * (x[i] - x[i-1]) + x[i-1]
-        return 0.0
-        
-    def limitingMagMinuit(self, raftId, ccdId):
-        # Model is of the form:
-        # 0.5 + -1.0 / num.pi * num.arctan(A * x + B)
-        
-        import minuit2
-        matchStarList   = self.matchStarSrc.get(raftId, ccdId)
-        unmatchStarList = self.unmatchCatStar.get(raftId, ccdId)
-        
-        histStarSrc     = num.histogram(matchStarList, bins = self.bins)
-        maxSrcIdx       = num.argsort(histStarSrc[0])[-1]
-        histUnmatchStar = num.histogram(unmatchStarList, bins = self.bins)
-
-        magbins   = 0.5 * (histStarSrc[1][1:] + histStarSrc[1][:-1])
-        histRatio = num.zeros(len(histStarSrc[0]))
-
-        w     = num.where((histStarSrc[0] + histUnmatchStar[0]) != 0)
-        x     = magbins[w]
-
-        # approximate
-        d     = 1.0 * histStarSrc[0][w]
-        u     = 1.0 * histUnmatchStar[0][w]
-        dd    = num.sqrt(d)
-        n     = d + u
-        y     = d / n
-        dy    = dd / n
-
-        idx = num.where(dy != 0)
-        x   = x[idx]
-        y   = y[idx]
-        dy  = dy[idx]
-              
-        def fcn(A, B):
-            model  = 0.5 + -1.0 / num.pi * num.arctan(A * x + B)
-            chi    = (model - y) / dy
-            return num.sum(chi**2)
-        
-        m = minuit2.Minuit2(fcn)
-        m.values['A'] = 1
-        m.values['B'] = -10
-        m.migrad()
-
-        mx = num.arange(min(x), max(x), 0.1)
-        my = 0.5 + -1.0 / num.pi * num.arctan(m.values['A'] * mx + m.values['B'])
-        mindx = num.argsort((num.abs(my-0.5)))[0]
+    def limitingMags(self, raftCcdKeys):
+        """Get the photometric depth of each raft,ccd in raftCcdKeys, fitting them all together.
 
-        self.fit.set(raftId, ccdId, [m.values['A'], m.values['B']])
-        return mx[mindx]
+        @param raftCcdKeys List of [raft, ccd]
+        @return array of depths (0.0 where the star completeness never crosses 0.5)
+        """
+        foundStars = []
+        allStars   = []
+        for raftId, ccdId in raftCcdKeys:
+            found = num.concatenate((self.matchedStar.get(raftId, ccdId), self.blendedStar.get(raftId, ccdId)))
+            foundStars.append(found)
+            allStars.append(num.concatenate((found, self.undetectedStar.get(raftId, ccdId))))
+
+        histFound = completenessFit.stackedHistograms(foundStars, self.bins)
+        histAll   = completenessFit.stackedHistograms(allStars, self.bins)
+        depths = completenessFit.limitingMags(histFound, histAll, self.bins, fit=self.config.fitDepth)[0]
+        return depths
 
     def test(self, data, dataId, fluxType = "psf"):
 
@@ -177,10 +111,6 @@ class CompletenessQaTask(QaAnalysisTask):
         self.undetectedGalaxy = raftCcdData.RaftCcdVector(self.detector)
         self.depth            = raftCcdData.RaftCcdData(self.detector)
 
-        if hasMinuit:
-            self.fit = raftCcdData.RaftCcdData(self.detector, initValue=[0.0, 0.0]) 
-
-
 
         sCatDummy = pqaSource.Catalog().catalog
         sCatSchema = sCatDummy.getSchema()
@@ -196,6 +126,7 @@ class CompletenessQaTask(QaAnalysisTask):
         refPsfKey = srefCatSchema.find('PsfFlux').key
 
         self.faintest = 0.0
+        matchedCcds = []
         for key in self.detector.keys():
             raftId     = self.detector[key].getParent().getId().getName()
             ccdId      = self.detector[key].getId().getName()
@@ -240,19 +171,14 @@ class CompletenessQaTask(QaAnalysisTask):
                     galvec.set(raftId, ccdId, num.array(galaxies))
     
                 # Non-detections
-                undetectedStars = []
-                undetectedGalaxies = []
-
-                for nondet in self.matchListDictSrc[key]['undetected']:
-                    mag = nondet.getMag(filterName)
-                    if mag > self.faintest:
-                        self.faintest = mag
-                    if nondet.getIsStar():
-                        undetectedStars.append(mag)
-                    else:
-                        undetectedGalaxies.append(mag)
-                self.undetectedStar.set(raftId, ccdId, num.array(undetectedStars))
-                self.undetectedGalaxy.set(raftId, ccdId, num.array(undetectedGalaxies))
+                undetected = self.matchListDictSrc[key]['undetected']
+                mags = undetected.mags(filterName)
+                isStar = undetected.isStar != 0
+                notNan = mags[~num.isnan(mags)]
+                if len(notNan) > 0 and notNan.max() > self.faintest:
+                    self.faintest = notNan.max()
+                self.undetectedStar.set(raftId, ccdId, mags[isStar])
+                self.undetectedGalaxy.set(raftId, ccdId, mags[~isStar])
                     
                 # Orphans
                 orphans = []
@@ -268,16 +194,19 @@ class CompletenessQaTask(QaAnalysisTask):
                             self.faintest = orphmag
                 self.orphan.set(raftId, ccdId, num.array(orphans))
 
-                ############ Calculate limiting mag
-                
-                maxDepth = self.limitingMag(raftId, ccdId)
-                self.depth.set(raftId, ccdId, maxDepth)
-                
-                areaLabel = data.cameraInfo.getDetectorName(raftId, ccdId)
-                label = "photometric depth "
-                comment = "magnitude where star completeness drops below 0.5"
-                test = testCode.Test(label, maxDepth, self.limits, comment, areaLabel=areaLabel)
-                testSet.addTest(test)
+                matchedCcds.append([raftId, ccdId])
+
+        ############ Calculate limiting mags, for all ccds together
+
+        depths = self.limitingMags(matchedCcds)
+        for (raftId, ccdId), maxDepth in zip(matchedCcds, depths):
+            self.depth.set(raftId, ccdId, maxDepth)
+
+            areaLabel = data.cameraInfo.getDetectorName(raftId, ccdId)
+            label = "photometric depth "
+            comment = "magnitude where star completeness drops below 0.5"
+            test = testCode.Test(label, maxDepth, self.limits, comment, areaLabel=areaLabel)
+            testSet.addTest(test)
                 
     def plot(self, data, dataId, showUndefined = False):
         
@@ -95,6 +95,13 @@ def plot(data):
             yline = (i+1)*ywid/ny
             ax.axhline(yline, color="k")
 
+        # shade the sectors without matches (counted in the test, older data may not have them)
+        countsMat = data.get('countsMat')
+        if countsMat is not None:
+            for i, j in zip(*numpy.where(countsMat == 0)):
+                ax.axvspan(i*xwid/nx, (i+1)*xwid/nx, j*1.0/ny, (j+1)*1.0/ny,
+                           facecolor='r', alpha=0.1, linewidth=0)
+
         # add map areas to allow mouseover tooltip showing pixel coords
         dx, dy = 20, 20  # on a 4kx4k ccd, < +/-20 pixels is tough to hit with a mouse
         #for i in range(len(x)):
@@ -27,6 +27,10 @@ class EmptySectorQaConfig(pexConfig.Config):
     maxMissing = pexConfig.Field(dtype = int, doc = "Maximum number of missing CCDs", default = 1)
     nx         = pexConfig.Field(dtype = int, doc = "Mesh size in x", default = 4)
     ny         = pexConfig.Field(dtype = int, doc = "Mesh size in y", default = 4)
+    extraGrids = pexConfig.ListField(dtype = str,
+                                     doc = "Other meshes to count empty sectors in, eg. '8x8' "+
+                                     "(reported, but not tested against maxMissing)",
+                                     default = ())
 
 
     
@@ -39,6 +43,10 @@ class EmptySectorQaTask(QaAnalysisTask):
         self.limits = [0, self.config.maxMissing]
         self.nx = self.config.nx
         self.ny = self.config.ny
+        self.grids = [(self.nx, self.ny)]
+        for grid in self.config.extraGrids:
+            nx, ny = map(int, grid.lower().split("x"))
+            self.grids.append((nx, ny))
 
         self.sCatDummy = pqaSource.Catalog()
         self.srefCatDummy = pqaSource.RefCatalog()
@@ -66,6 +74,8 @@ class EmptySectorQaTask(QaAnalysisTask):
 
         del self.emptySectors
         del self.emptySectorsMat
+        del self.counts
+        del self.countsMat
         
     def test(self, data, dataId):
 
@@ -96,15 +106,17 @@ class EmptySectorQaTask(QaAnalysisTask):
             self.size.set(raft, ccd, size)
             filter = self.filter[key].getName()
             
-            for s in ss:
-                self.x.append(raft, ccd, s.getD(xKey))
-                self.y.append(raft, ccd, s.getD(yKey))
+            if hasattr(ss, 'getColumn'):
+                self.x.extend(raft, ccd, ss.getColumn(xKey))
+                self.y.extend(raft, ccd, ss.getColumn(yKey))
+            else:
+                self.x.extend(raft, ccd, [s.getD(xKey) for s in ss])
+                self.y.extend(raft, ccd, [s.getD(yKey) for s in ss])
                 
             if self.matchListDictSrc.has_key(key):
-                for m in self.matchListDictSrc[key]['matched']:
-                    sref, s, dist = m
-                    self.xmat.append(raft, ccd, s.getD(xKey))
-                    self.ymat.append(raft, ccd, s.getD(yKey))
+                matched = self.matchListDictSrc[key]['matched']
+                self.xmat.extend(raft, ccd, matched.getColumn(xKey))
+                self.ymat.extend(raft, ccd, matched.getColumn(yKey))
 
                     
         # create a testset
@@ -118,6 +130,9 @@ class EmptySectorQaTask(QaAnalysisTask):
         # analyse each sensor and put the values in a raftccd container
         self.emptySectors    = raftCcdData.RaftCcdData(self.detector, initValue=self.nx*self.ny)
         self.emptySectorsMat = raftCcdData.RaftCcdData(self.detector, initValue=self.nx*self.ny)
+        # the counts in each sector of each grid, for the plots
+        self.counts          = raftCcdData.RaftCcdData(self.detector, initValue=None)
+        self.countsMat       = raftCcdData.RaftCcdData(self.detector, initValue=None)
 
         countBase = "countShelf"
         nShelf = testSet.unshelve(countBase)
@@ -132,18 +147,13 @@ class EmptySectorQaTask(QaAnalysisTask):
                 xlo, ylo, xhi, yhi = x.min(), y.min(), x.max(), y.max()
                 xwid, ywid = xhi-xlo, yhi-ylo
                 
-            def countEmptySectors(x, y):
-                counts = numpy.zeros([self.nx, self.ny])
-                for i in range(len(x)):
-                    xi, yi = int(self.nx*x[i]/xwid), int(self.ny*y[i]/ywid)
-                    if xi >= 0 and xi < self.nx and yi >= 0 and yi < self.ny:
-                        counts[xi,yi] += 1
-                whereEmpty = numpy.where(counts.flatten() == 0)[0]
-                nEmpty = len(whereEmpty)
-                return nEmpty
-
-            nEmpty = countEmptySectors(x - xlo, y - ylo)
-            nEmptyMat = countEmptySectors(xmat - xlo, ymat - ylo)
+            counts    = qaAnaUtil.sectorCounts(x - xlo, y - ylo, xwid, ywid, self.grids)
+            countsMat = qaAnaUtil.sectorCounts(xmat - xlo, ymat - ylo, xwid, ywid, self.grids)
+            self.counts.set(raft, ccd, counts)
+            self.countsMat.set(raft, ccd, countsMat)
+
+            nEmpty = int((counts[0] == 0).sum())
+            nEmptyMat = int((countsMat[0] == 0).sum())
             self.emptySectors.set(raft, ccd, nEmpty)
             self.emptySectorsMat.set(raft, ccd, nEmptyMat)
             
@@ -157,6 +167,18 @@ class EmptySectorQaTask(QaAnalysisTask):
             test = testCode.Test(label+" (matched)", nEmptyMat, self.limits, comment, areaLabel=areaLabel)
             testSet.addTest(test)
 
+            # the other grids are just reported
+            for i in range(1, len(self.grids)):
+                nx, ny = self.grids[i]
+                gridLabel = "%s %dx%d" % (label, nx, ny)
+                comment = "%dx%d (nstar=%d)" % (nx, ny, len(x))
+                test = testCode.Test(gridLabel, int((counts[i] == 0).sum()), [0, None], comment,
+                                     areaLabel=areaLabel)
+                testSet.addTest(test)
+                test = testCode.Test(gridLabel+" (matched)", int((countsMat[i] == 0).sum()), [0, None],
+                                     comment, areaLabel=areaLabel)
+                testSet.addTest(test)
+
             nShelf[ccd] = len(x)
 
         testSet.shelve(countBase, nShelf)
@@ -275,7 +297,8 @@ class EmptySectorQaTask(QaAnalysisTask):
                         'limits' : [0, xwid, 0, ywid],
                         'summary' : False, 'alllimits' : [xlo, xhi, ylo, yhi],
                         'bbox' : [xxlo, xxhi, yylo, yyhi],
-                        'nxn' : [self.nx, self.ny]}
+                        'nxn' : [self.nx, self.ny],
+                        'countsMat' : self.countsMat.get(raft, ccd)[0]}
             
             self.log.log(self.log.INFO, "plotting %s" % (ccd))
             import EmptySectorQaAnalysisPlot as plotModule
@@ -0,0 +1,139 @@
+"""Summary statistics for many groups of values (eg. one group per ccd) in a single call.
+
+The groups are held as one concatenated value array plus offsets, so group i is
+values[offsets[i]:offsets[i+1]].  As with afwMath.makeStatistics, NaNs are ignored.
+"""
+
+import numpy
+
+# convert an interquartile range to a gaussian sigma (same value as afwMath)
+IQ_TO_STDEV = 0.741301109252801
+
+
+def concatenateGroups(arrays):
+    """Join a list of arrays into one array and the offsets of each group within it.
+
+    @param arrays  List of arrays (one per group, may be empty)
+    @return values, offsets -- group i is values[offsets[i]:offsets[i+1]]
+    """
+    counts = numpy.array([len(a) for a in arrays], dtype=int)
+    offsets = numpy.zeros(len(arrays) + 1, dtype=int)
+    offsets[1:] = numpy.cumsum(counts)
+    if len(arrays) > 0:
+        values = numpy.concatenate([numpy.asarray(a, dtype=numpy.float64).ravel() for a in arrays])
+    else:
+        values = numpy.array([], dtype=numpy.float64)
+    return values, offsets
+
+
+def groupIds(offsets):
+    """Get the group number of each value from the group offsets.
+
+    @param offsets  Group offsets as returned by concatenateGroups()
+    """
+    offsets = numpy.asarray(offsets, dtype=int)
+    return numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets))
+
+
+def groupQuantiles(values, offsets, fractions):
+    """Get quantiles of each group, interpolated linearly as numpy.percentile does.
+
+    All the groups are sorted together, by group then value, and the quantiles of every
+    group are then picked out of the sorted values at once.
+
+    @param values    Concatenated values, which must not contain NaNs
+    @param offsets   Group offsets as returned by concatenateGroups()
+    @param fractions Quantiles to compute, eg. (0.25, 0.5, 0.75)
+    @return array of shape (len(fractions), nGroup), NaN for empty groups
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    offsets = numpy.asarray(offsets, dtype=int)
+    fractions = numpy.asarray(fractions, dtype=numpy.float64)
+    nGroup = len(offsets) - 1
+    result = numpy.empty((len(fractions), nGroup))
+    result.fill(numpy.NaN)
+
+    n = numpy.diff(offsets)
+    have = numpy.nonzero(n > 0)[0]
+    if len(have) == 0:
+        return result
+
+    # the groups stay where they are, each sorted in place
+    sortedValues = values[numpy.lexsort((values, groupIds(offsets)))]
+
+    nHave = n[have]
+    pos = fractions[:,numpy.newaxis]*(nHave - 1)
+    lo = numpy.floor(pos).astype(int)
+    hi = numpy.minimum(lo + 1, nHave - 1)
+    vLo = sortedValues[offsets[have] + lo]
+    vHi = sortedValues[offsets[have] + hi]
+    result[:,have] = vLo + (pos - lo)*(vHi - vLo)
+    return result
+
+
+def groupStatistics(values, offsets, nSigmaClip=3.0, nIter=3):
+    """Compute summary statistics for every group at once.
+
+    The clipped mean and stdev follow afwMath: the first pass keeps values within
+    nSigmaClip*IQ_TO_STDEV*IQR of the median, and each further pass keeps values within
+    nSigmaClip*stdev of the previous clipped mean.
+
+    @param values     Concatenated values for all groups
+    @param offsets    Group offsets as returned by concatenateGroups()
+    @param nSigmaClip Clipping threshold in sigma
+    @param nIter      Number of clipping passes
+    @return dict of arrays with one entry per group: n, mean, stdev, median, iqr, sigmaIqr,
+            nClip, meanClip, stdevClip.  Statistics of empty groups are NaN.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    offsets = numpy.asarray(offsets, dtype=int)
+    nGroup = len(offsets) - 1
+
+    good = numpy.isfinite(values)
+    v = values[good]
+    g = groupIds(offsets)[good]
+
+    n = numpy.bincount(g, minlength=nGroup)
+    goodOffsets = numpy.zeros(nGroup + 1, dtype=int)
+    goodOffsets[1:] = numpy.cumsum(n)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean = numpy.bincount(g, v, minlength=nGroup)/n
+        stdev = numpy.sqrt(numpy.bincount(g, (v - mean[g])**2, minlength=nGroup)/(n - 1))
+        # (an empty group would get sqrt(0/-1) = -0)
+        stdev[n == 0] = numpy.NaN
+
+        q25, median, q75 = groupQuantiles(v, goodOffsets, (0.25, 0.5, 0.75))
+        iqr = q75 - q25
+
+        center = median.copy()
+        hwidth = nSigmaClip*IQ_TO_STDEV*iqr
+        nClip = numpy.zeros(nGroup, dtype=int)
+        stdevClip = numpy.empty(nGroup)
+        stdevClip.fill(numpy.NaN)
+        for i in range(nIter):
+            use = numpy.abs(v - center[g]) <= hwidth[g]
+            gUse, vUse = g[use], v[use]
+            nUse = numpy.bincount(gUse, minlength=nGroup)
+            meanUse = numpy.bincount(gUse, vUse, minlength=nGroup)/nUse
+            varUse = numpy.bincount(gUse, (vUse - meanUse[gUse])**2, minlength=nGroup)/(nUse - 1)
+
+            update = nUse > 0
+            center[update] = meanUse[update]
+            nClip[update] = nUse[update]
+            stdevClip[update] = numpy.sqrt(varUse[update])
+            # a single value has no variance, so keep the previous width for it
+            update &= (nUse > 1)
+            hwidth[update] = nSigmaClip*stdevClip[update]
+
+    return {
+        "n"         : n,
+        "mean"      : mean,
+        "stdev"     : stdev,
+        "median"    : median,
+        "iqr"       : iqr,
+        "sigmaIqr"  : IQ_TO_STDEV*iqr,
+        "nClip"     : nClip,
+        "meanClip"  : center,
+        "stdevClip" : stdevClip,
+        }
@@ -102,7 +102,7 @@ class PerformanceQaTask(QaAnalysisTask):
             self.testRuntime.set(raft, ccd, testRuntime)
 
             plotRuntime = data.getPerformance(dataId, 'total', 'plot-runtime')
-            # if running with plot() forked, plot times are not defined.
+            # no plot() has finished yet
             if plotRuntime is None:
                 plotRuntime = 0.0
             self.plotRuntime.set(raft, ccd, plotRuntime)
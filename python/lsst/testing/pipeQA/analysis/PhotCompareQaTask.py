@@ -13,6 +13,7 @@ import lsst.testing.pipeQA.TestCode as testCode
 import lsst.testing.pipeQA.figures.QaFigureUtils as qaFigUtils
 import RaftCcdData as raftCcdData
 import QaAnalysisUtils as qaAnaUtil
+import GroupStatistics as groupStats
 import QaPlotUtils as qaPlotUtil
 
 import lsst.testing.pipeQA.source as pqaSource
@@ -130,41 +131,26 @@ class PhotCompareQaTask(QaAnalysisTask):
          The per-CCD derr figure compares the error bars v. magnitude with the empirical RMS.
         """
 
-    def _getFlux(self, mType, s, sref):
+    def _extendPhotometry(self, raft, ccd, phot):
+        """Append the usable magnitudes of one ccd from its QaData.getPhotometryBySensor() entry.
 
-        # if the source isn't valid, return NaN
-        if not hasattr(s, 'getId') or not hasattr(sref, 'getId'):
-            return numpy.NaN
-            
-        
-        if mType=="psf":
-            return s.getD(self.sCatDummy.PsfFluxKey)
-        elif mType=="ap":
-            return s.getD(self.sCatDummy.ApFluxKey)
-        elif mType=="mod":
-            return s.getD(self.sCatDummy.ModelFluxKey)
-        elif mType=="cat":
-            return sref.getD(self.srefCatDummy.PsfFluxKey)
-        elif mType=="inst":
-            return s.getD(self.sCatDummy.InstFluxKey)
-
-    def _getFluxErr(self, mType, s, sref):
-
-        # if the source isn't valid, return NaN
-        if not hasattr(s, 'getId') or not hasattr(sref, 'getId'):
-            return numpy.NaN
-            
-        
-        if mType=="psf":
-            return s.getD(self.sCatDummy.PsfFluxErrKey)
-        elif mType=="ap":
-            return s.getD(self.sCatDummy.ApFluxErrKey)
-        elif mType=="mod":
-            return s.getD(self.sCatDummy.ModelFluxErrKey)
-        elif mType=="cat":
-            return 0.0
-        elif mType=="inst":
-            return s.getD(self.sCatDummy.InstFluxErrKey)
+        @param raft     The raft name
+        @param ccd      The ccd name
+        @param phot     Dict of magnitude, error, flag and position arrays
+        """
+        m1, dm1 = phot[self.magType1], phot[self.magType1+"Err"]
+        m2, dm2 = phot[self.magType2], phot[self.magType2+"Err"]
+
+        w = numpy.where(numpy.isfinite(m1) & numpy.isfinite(m2) & ~phot["flagged"])[0]
+        with numpy.errstate(invalid='ignore', over='ignore'):
+            derr = numpy.sqrt(dm1[w]**2 + dm2[w]**2)
+
+        self.derr.extend(raft, ccd, derr)
+        self.diff.extend(raft, ccd, m1[w] - m2[w])
+        self.mag.extend(raft, ccd, m1[w])
+        self.x.extend(raft, ccd, phot["XAstrom"][w])
+        self.y.extend(raft, ccd, phot["YAstrom"][w])
+        self.star.extend(raft, ccd, phot["star"][w])
 
     def free(self):
         del self.x
@@ -173,10 +159,6 @@ class PhotCompareQaTask(QaAnalysisTask):
         del self.diff
         del self.filter
         del self.detector
-        if self.matchListDictSrc is not None:
-            del self.matchListDictSrc
-        if self.ssDict is not None:
-            del self.ssDict
         del self.means
         del self.medians
         del self.stds
@@ -199,96 +181,16 @@ class PhotCompareQaTask(QaAnalysisTask):
 
         filter = None
 
-        self.matchListDictSrc = None
-        self.ssDict = None
-
+        # magnitudes are computed once per dataId by the QaData and shared by all comparisons.
         # if we're asked to compare catalog fluxes ... we need a matchlist
-        if  self.magType1=="cat" or self.magType2=="cat":
-            self.matchListDictSrc = data.getMatchListBySensor(dataId, useRef='src')
-            for key in self.matchListDictSrc.keys():
-                raft = self.detector[key].getParent().getId().getName()
-                ccd  = self.detector[key].getId().getName()
-                filter = self.filter[key].getName()
-
-                matchList = self.matchListDictSrc[key]['matched']
-                #qaAnaUtil.isStar(matchList)
-
-                for m in matchList:
-                    sref, s, dist = m
-                    
-                    f1  = self._getFlux(self.magType1, s, sref)
-                    f2  = self._getFlux(self.magType2, s, sref)
-                    df1 = self._getFluxErr(self.magType1, s, sref)
-                    df2 = self._getFluxErr(self.magType2, s, sref)
-
-                    #badFlags = pqaSource.INTERP_CENTER | pqaSource.SATUR_CENTER | pqaSource.EDGE
-                    intcen = s.getD(self.sCatDummy.FlagPixInterpCenKey)
-                    satcen = s.getD(self.sCatDummy.FlagPixSaturCenKey)
-                    edge   = s.getD(self.sCatDummy.FlagPixEdgeKey)
-                    
-                    if data.cameraInfo.name == 'coadd':
-                        flagit = (satcen or edge) # coadds have excessive area covered by InterpCen flags
-                    else:
-                        flagit = (intcen or satcen or edge)
-
-                    if (f1 > 0.0 and f2 > 0.0  and not flagit):
-                        m1  = -2.5*numpy.log10(f1)
-                        m2  = -2.5*numpy.log10(f2)
-                        dm1 = 2.5 / numpy.log(10.0) * df1 / f1
-                        dm2 = 2.5 / numpy.log(10.0) * df2 / f2
-                        
-                        star = 0 if s.getD(self.sCatDummy.ExtendednessKey) else 1
-                        
-                        if numpy.isfinite(m1) and numpy.isfinite(m2):
-                            self.derr.append(raft, ccd, numpy.sqrt(dm1**2 + dm2**2))
-                            self.diff.append(raft, ccd, m1 - m2)
-                            self.mag.append(raft, ccd, m1)
-                            self.x.append(raft, ccd, s.getD(self.sCatDummy.XAstromKey))
-                            self.y.append(raft, ccd, s.getD(self.sCatDummy.YAstromKey))
-                            self.star.append(raft, ccd, star)
-
-        # if we're not asked for catalog fluxes, we can just use a sourceSet
-        else:
-            self.ssDict        = data.getSourceSetBySensor(dataId)
-            for key, ss in self.ssDict.items():
-                raft = self.detector[key].getParent().getId().getName()
-                ccd  = self.detector[key].getId().getName()
-                
-                filter = self.filter[key].getName()
-
-                #qaAnaUtil.isStar(ss)  # sets the 'STAR' flag
-                for s in ss:
-                    f1 = self._getFlux(self.magType1, s, s)
-                    f2 = self._getFlux(self.magType2, s, s)
-                    df1 = self._getFluxErr(self.magType1, s, s)
-                    df2 = self._getFluxErr(self.magType2, s, s)
-                    intcen = s.getD(self.sCatDummy.FlagPixInterpCenKey)
-                    satcen = s.getD(self.sCatDummy.FlagPixSaturCenKey)
-                    edge   = s.getD(self.sCatDummy.FlagPixEdgeKey)
-                    
-                    if data.cameraInfo.name == 'coadd':
-                        flagit = (satcen or edge) # coadds have excessive area covered by InterpCen flags
-                    else:
-                        flagit = (intcen or satcen or edge)
-
-                    if ((f1 > 0.0 and f2 > 0.0) and not flagit):
-
-                        m1 = -2.5*numpy.log10(f1) #self.calib[key].getMagnitude(f1)
-                        m2 = -2.5*numpy.log10(f2) #self.calib[key].getMagnitude(f2)
-                        dm1 = 2.5 / numpy.log(10.0) * df1 / f1
-                        dm2 = 2.5 / numpy.log(10.0) * df2 / f2
-
-                        star = 0 if s.getD(self.sCatDummy.ExtendednessKey) else 1
-                        
-                        #if star:
-                        #    print "isStar: ", star
-                        if numpy.isfinite(m1) and numpy.isfinite(m2):
-                            self.derr.append(raft, ccd, numpy.sqrt(dm1**2 + dm2**2))
-                            self.diff.append(raft, ccd, m1 - m2)
-                            self.mag.append(raft, ccd, m1)
-                            self.x.append(raft, ccd, s.getD(self.sCatDummy.XAstromKey))
-                            self.y.append(raft, ccd, s.getD(self.sCatDummy.YAstromKey))
-                            self.star.append(raft, ccd, star)
+        useMatches = self.magType1=="cat" or self.magType2=="cat"
+        photDict = data.getPhotometryBySensor(dataId, useMatches=useMatches)
+        for key, phot in photDict.items():
+            raft = self.detector[key].getParent().getId().getName()
+            ccd  = self.detector[key].getId().getName()
+            filter = self.filter[key].getName()
+
+            self._extendPhotometry(raft, ccd, phot)
 
         testSet = self.getTestSet(data, dataId, label=self.magType1+"-"+self.magType2)
 
@@ -303,26 +205,29 @@ class PhotCompareQaTask(QaAnalysisTask):
         self.trend = raftCcdData.RaftCcdData(self.detector, initValue=[0.0, 0.0])
         
         self.dmagMax = 0.4
-        allMags = numpy.array([])
-        allDiffs = numpy.array([])
 
-        for raft,  ccd in self.mag.raftCcdKeys():
-            dmag0 = self.diff.get(raft, ccd)
-            mag0 = self.mag.get(raft, ccd)
-            derr0 = self.derr.get(raft, ccd)
-            star = self.star.get(raft, ccd)
+        # summary statistics and trendlines of the bright stars (and galaxies) for all ccds at once
+        keys, mags, offsets = self.mag.concatenate()
+        keys, diffs, offsets = self.diff.concatenate()
+        keys, derrs, offsets = self.derr.concatenate()
+        keys, stars, offsets = self.star.concatenate()
+        group = groupStats.groupIds(offsets)
+        nCcd = len(keys)
+
+        isBrightStar = (mags > 10) & (mags < self.magCut) & (stars > 0)
+        isBrightGxy = (mags > 10) & (mags < self.magCut) & (stars == 0) & (numpy.abs(diffs) < 1.0)
+        nStar = numpy.bincount(group[isBrightStar], minlength=nCcd)
+        nGxy = numpy.bincount(group[isBrightGxy], minlength=nCcd)
 
-            wGxy = numpy.where((mag0 > 10) & (mag0 < self.magCut) &
-                               (star == 0) & (numpy.abs(dmag0) < 1.0))[0]
-            w = numpy.where((mag0 > 10) & (mag0 < self.magCut) & (star > 0))[0]
+        dmagStats = groupStats.groupStatistics(numpy.where(isBrightStar, diffs, numpy.NaN), offsets)
+        derrStats = groupStats.groupStatistics(numpy.where(isBrightStar, derrs, numpy.NaN), offsets)
+        starFits = qaAnaUtil.groupRobustLineFit(mags[isBrightStar], diffs[isBrightStar],
+                                                group[isBrightStar], nCcd)
+        gxyFits = qaAnaUtil.groupRobustLineFit(mags[isBrightGxy], diffs[isBrightGxy],
+                                               group[isBrightGxy], nCcd)
 
-            mag = mag0[w]
-            dmag = dmag0[w]
-            derr = derr0[w]  
+        for i, (raft, ccd) in enumerate(keys):
 
-            allMags = numpy.append(allMags, mag)
-            allDiffs = numpy.append(allDiffs, dmag)
-             
             # already using NaN for 'no-data' for this ccd
             #  (because we can't test for 'None' in a numpy masked_array)
             # unfortunately, these failures will have to do
@@ -333,23 +238,21 @@ class PhotCompareQaTask(QaAnalysisTask):
             n = 0
             lineFit = [[99.0, 0.0, 0.0, 0.0]]*3
             lineCoeffs = [[99.0, 0.0]]*3
-            if len(dmag) > 0:
-                stat = afwMath.makeStatistics(dmag, afwMath.NPOINT | afwMath.MEANCLIP |
-                                              afwMath.STDEVCLIP | afwMath.MEDIAN)
-                mean = stat.getValue(afwMath.MEANCLIP)
-                median = stat.getValue(afwMath.MEDIAN)
-                std = stat.getValue(afwMath.STDEVCLIP)
-                n = stat.getValue(afwMath.NPOINT)
+            if nStar[i] > 0:
+                mean = dmagStats["meanClip"][i]
+                median = dmagStats["median"][i]
+                std = dmagStats["stdevClip"][i]
+                n = dmagStats["n"][i]
 
-                derrmed = afwMath.makeStatistics(derr, afwMath.MEDIAN).getValue(afwMath.MEDIAN)
+                derrmed = derrStats["median"][i]
 
                 # get trendlines for stars/galaxies
                 # for alldata, use trendline for stars
-                if len(dmag) > 1:
-                    lineFit[0] = qaAnaUtil.robustPolyFit(mag, dmag, 1)
+                if nStar[i] > 1:
+                    lineFit[0] = tuple(starFits[i])
                     lineCoeffs[0] = lineFit[0][0], lineFit[0][2]
-                if len(wGxy) > 1:
-                    lineFit[1] = qaAnaUtil.robustPolyFit(mag0[wGxy], dmag0[wGxy], 1)
+                if nGxy[i] > 1:
+                    lineFit[1] = tuple(gxyFits[i])
                     lineCoeffs[1] = lineFit[1][0], lineFit[1][2]
                 lineFit[2] = lineFit[0]
                 lineCoeffs[2] = lineCoeffs[0]
@@ -360,35 +263,37 @@ class PhotCompareQaTask(QaAnalysisTask):
             self.means.set(raft, ccd, mean)
             areaLabel = data.cameraInfo.getDetectorName(raft, ccd)
             label = "mean "+tag # +" " + areaLabel
-            comment = "mean "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, len(dmag),n)
+            comment = "mean "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, nStar[i],n)
             testSet.addTest( testCode.Test(label, mean, self.deltaLimits, comment, areaLabel=areaLabel))
 
             self.medians.set(raft, ccd, median)
             label = "median "+tag #+" "+areaLabel
-            comment = "median "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, len(dmag), n)
+            comment = "median "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, nStar[i], n)
             testSet.addTest( testCode.Test(label, median, self.deltaLimits, comment, areaLabel=areaLabel))
 
             self.stds.set(raft, ccd, std)
             label = "stdev "+tag #+" " + areaLabel
-            comment = "stdev of "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, len(dmag), n)
+            comment = "stdev of "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, nStar[i], n)
             testSet.addTest( testCode.Test(label, std, self.rmsLimits, comment, areaLabel=areaLabel))
 
             self.derrs.set(raft, ccd, derrmed)
             label = "derr "+tag 
-            comment = "add phot err in quad for "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, len(dmag), n)
+            comment = "add phot err in quad for "+dtag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, nStar[i], n)
             testSet.addTest( testCode.Test(label, derrmed, self.derrLimits, comment, areaLabel=areaLabel))
 
             self.trend.set(raft, ccd, lineFit)
             label = "slope "+tag #+" " + areaLabel
             slopeLimits = self.slopeLimits[0]*lineFit[0][1], self.slopeLimits[1]*lineFit[0][1]
             comment = "slope of "+dtag+" (mag lt %.1f, nstar/clip=%d/%d) limits=(%.1f,%.1f)sigma" % \
-                      (self.magCut, len(dmag), n, self.slopeLimits[0], self.slopeLimits[1])
+                      (self.magCut, nStar[i], n, self.slopeLimits[0], self.slopeLimits[1])
             testSet.addTest( testCode.Test(label, lineCoeffs[0][0], slopeLimits, comment,
                                            areaLabel=areaLabel))
 
 
         # do a test of all CCDs for the slope ... suffering small number problems
         #  on indiv ccds and could miss a problem
+        allMags = mags[isBrightStar]
+        allDiffs = diffs[isBrightStar]
         
         lineFit = [99.0, 0.0, 0.0, 0.0]
         lineCoeffs = [99.0, 0.0]
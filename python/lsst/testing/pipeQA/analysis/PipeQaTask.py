@@ -4,6 +4,9 @@ import copy
 import datetime
 import argparse
 import traceback
+import threading
+import multiprocessing
+import StringIO
 import numpy
 
 import lsst.pex.config         as pexConfig
@@ -85,6 +88,199 @@ class PipeQaConfig(pexConfig.Config):
             }
         )
 
+    loadThreads = pexConfig.Field(dtype = int,
+                                  doc = "Threads used to read per-sensor butler data (1 reads serially)",
+                                  default = 1)
+    queryCacheDir = pexConfig.Field(dtype = str,
+                                    doc = "Directory to keep database query results in for later runs "+
+                                    "(None to disable; clear it with bin/clearQueryCache.py)",
+                                    default = None, optional = True)
+    queryCacheSizeMb = pexConfig.Field(dtype = int,
+                                       doc = "Largest total size of the query results in queryCacheDir (Mb)",
+                                       default = 1024)
+    cacheSizeMb = pexConfig.Field(dtype = int,
+                                  doc = "Memory budget for data cached between dataIds (Mb); the least "+
+                                  "recently used data beyond it are dropped",
+                                  default = 2048)
+    prefetch = pexConfig.Field(dtype = bool,
+                               doc = "Load the next dataId's data in a background thread while the tasks "+
+                               "run (uses a second QaData, eg. a second database connection, which "+
+                               "shares cacheSizeMb); ignored with --jobs or --forkFigure",
+                               default = False)
+
+
+
+# --jobs processes are forked from the parent with this set, so nothing in it needs to pickle.
+_jobContext = None
+
+class _TestSetRecorder(object):
+    """Stand-in for a shared TestSet in a --jobs process.  The parent replays the calls."""
+    def __init__(self):
+        self.calls = []
+    def addTest(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+class _PlotQueue(object):
+    """Run plot() methods in forked processes, in the background.
+
+    Each fork holds a copy-on-write image of the parent, so at most maxJobs run at
+    once.  A task's figures are made in order, as its summary figures build on what
+    the previous dataId's plot() left in the cache.  A task's plot() and its next test()
+    both write to the task's TestSets, so wait() for the plot before running the test.
+    """
+
+    def __init__(self, maxJobs, exceptExit):
+        """
+        @param maxJobs    Most plot processes to run at once
+        @param exceptExit Raise if a plot process fails
+        """
+        self.maxJobs = max(1, maxJobs)
+        self.exceptExit = exceptExit
+        self.jobs = []  # [pid, test, pipe, onDone], oldest first
+
+    def _wait(self, job):
+        pid, test, pipe, onDone = job
+        self.jobs.remove(job)
+        pid, status = os.waitpid(pid, 0)
+
+        # the process sends back how long it took
+        fp = os.fdopen(pipe, 'r')
+        try:
+            elapsed = fp.read()
+        finally:
+            fp.close()
+        if onDone is not None and len(elapsed) > 0:
+            onDone(float(elapsed))
+        
+        if status != 0 and self.exceptExit:
+            raise RuntimeError("Figure process for %s failed (status %d)" % (test, status))
+        
+    def add(self, test, onDone, func, *args):
+        """Call func(*args) in a new process, once there's room.
+
+        @param test   The name of the task being plotted
+        @param onDone Function to call with the time func() took (in s) when it's finished, or None
+        """
+        self.wait(test)
+        while len(self.jobs) >= self.maxJobs:
+            self._wait(self.jobs[0])
+
+        sys.stdout.flush() # clear the buffer before the fork
+        pipeIn, pipeOut = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(pipeIn)
+            t0 = time.time()
+            try:
+                func(*args)
+            except:
+                traceback.print_exc()
+                os._exit(1)
+            os.write(pipeOut, "%.6f" % (time.time() - t0))
+            os._exit(os.EX_OK)
+        os.close(pipeOut)
+        self.jobs.append([pid, test, pipeIn, onDone])
+
+    def wait(self, test):
+        """Wait for the figures of a task to be finished.
+
+        @param test The name of the task
+        """
+        for job in [j for j in self.jobs if j[1] == test]:
+            self._wait(job)
+
+    def join(self):
+        """Wait for all plot processes to finish."""
+        while len(self.jobs) > 0:
+            self._wait(self.jobs[0])
+
+
+class _Prefetcher(object):
+    """Load the data for the next dataId in a background thread, while the tasks run on this one.
+
+    The data are loaded by a QaData of their own (with its own database connection or butler),
+    and handed to the QaData the tasks use when they get to that dataId.  If loading fails,
+    nothing is handed over, and the tasks load the data (and report the failure) themselves.
+    """
+
+    def __init__(self, makeData, log):
+        """
+        @param makeData Function returning a new QaData, for the same dataset as the tasks use
+        @param log      Log to report failures to
+        """
+        self.makeData = makeData
+        self.log      = log
+        self.data     = None
+        self.thread   = None
+        self.dataId   = None
+        self.loaded   = False
+
+    def _load(self, data, dataId):
+        try:
+            data.loadCalexp(dataId)
+            data.getSourceSetBySensor(dataId)
+            data.getRefObjectSetBySensor(dataId)
+            data.getMatchListBySensor(dataId)
+            self.loaded = True
+        except Exception, e:
+            self.log.log(self.log.WARN, "Prefetching data for %s failed (it'll be loaded when needed): %s" %
+                         (str(dataId), str(e)))
+
+    def start(self, dataId, breakBy=None):
+        """Start loading the data for dataId.
+
+        @param dataId  The dataId (regexes) the tasks will run on next
+        @param breakBy If not None, dataId is a whole visit, to be broken down by 'visit', 'raft'
+                       or 'ccd' (as runVisit() does), and the first part is loaded
+        """
+        self.join()
+        if self.data is None:
+            self.data = self.makeData()
+        if breakBy is not None:
+            # our own QaData breaks it down, as the tasks look at the last one broken down
+            dataIdList = self.data.breakDataId(dataId, breakBy)
+            if len(dataIdList) == 0:
+                return
+            dataId = dataIdList[0]
+        self.dataId = copy.copy(dataId)
+        self.loaded = False
+        self.thread = threading.Thread(target=self._load, args=(self.data, self.dataId))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def join(self):
+        """Wait for the data being loaded."""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def take(self, data, dataId):
+        """Hand the data prefetched for dataId to data, waiting for them if need be.
+
+        @param data   The QaData the tasks use
+        @param dataId The dataId (regexes) the tasks are about to run on
+        """
+        if self.dataId is None:
+            return
+        self.join()
+        if self.loaded and dataId == self.dataId:
+            data.adoptCache(self.data)
+        else:
+            self.data.clearCache()
+        self.dataId = None
+
+            
+def _initVisitJob():
+    _jobContext['data'] = _jobContext['makeData']()
+
+def _runVisitJob(visit):
+    testset = _TestSetRecorder()
+    progset = _TestSetRecorder()
+    useFp = StringIO.StringIO()
+    c = _jobContext
+    c['task'].runVisit(c['data'], visit, c['dataId'], c['taskList'], testset, progset, useFp,
+                       **c['runKwargs'])
+    return visit, testset.calls, progset.calls, useFp.getvalue()
 
     
 class PipeQaTask(pipeBase.Task):
@@ -111,11 +307,16 @@ class PipeQaTask(pipeBase.Task):
         parser.add_argument("-e", "--exceptExit", default=False, action='store_true',
                             help="Don't capture exceptions, fail and exit (default=%(default)s)")
         parser.add_argument("-f", "--forkFigure", default=False, action='store_true',
-                            help="Make figures in separate process (default=%(default)s)")
+                            help="Make figures in background processes (default=%(default)s)")
+        parser.add_argument("--plotJobs", default=2, type=int,
+                            help="Most figure processes to run at once with --forkFigure (default=%(default)s)")
         parser.add_argument("-F", "--useForced", default=False, action='store_true',
                             help="Use forced photometry (default=%default)")        
         parser.add_argument("-g", "--group", default=None,
                             help="Specify sub-group of visits 'groupSize:whichGroup' (default=%(default)s)")
+        parser.add_argument("-j", "--jobs", default=1, type=int,
+                            help="Number of processes to run visits in; each process runs whole visits, " +
+                            "even with --breakBy raft or ccd (default=%(default)s)")
         parser.add_argument("-k", "--keep", default=False, action="store_true",
                             help="Keep existing outputs (default=%(default)s)")
         parser.add_argument("-r", "--raft", default=".*",
@@ -221,6 +422,156 @@ class PipeQaTask(pipeBase.Task):
 
                 
             
+    def runVisit(self, data, visit, dataId, taskList, testset, progset, useFp,
+                 breakBy, testRegex, exceptExit, plotQueue, prefetcher=None, nextVisit=None):
+        """Run all tasks in taskList on one visit, broken down by raft or ccd if requested.
+
+        @param data       The QaData to get data from
+        @param visit      The visit to run
+        @param dataId     The dataId (regexes) requested, its visit is replaced by the visit to run
+        @param taskList   The QaAnalysisTasks to run
+        @param testset    TestSet for QA exceptions
+        @param progset    TestSet for progress reports
+        @param useFp      File to write the runtime performance to
+        @param breakBy    'visit', 'raft', or 'ccd'
+        @param testRegex  Regex specifying which tasks to run
+        @param exceptExit Don't capture exceptions
+        @param plotQueue  A _PlotQueue to make figures in the background, or None to make them here
+        @param prefetcher A _Prefetcher to load the next dataId's data in the background, or None
+        @param nextVisit  The visit which will be run after this one (for the prefetcher), or None
+        """
+
+        visit_t0 = time.time()
+
+        dataIdVisit = copy.copy(dataId)
+        dataIdVisit['visit'] = visit
+
+        # now break up the run into eg. rafts or ccds
+        #  ... if we only run one raft or ccd at a time, we use less memory
+        brokenDownDataIdList = data.breakDataId(dataIdVisit, breakBy)
+
+        for iDataId, thisDataId in enumerate(brokenDownDataIdList):
+
+            # keep this dataId's data while we test it, anything else may go if we need the memory
+            data.pinDataId(thisDataId)
+
+            if prefetcher is not None:
+                prefetcher.take(data, thisDataId)
+                if iDataId + 1 < len(brokenDownDataIdList):
+                    prefetcher.start(brokenDownDataIdList[iDataId + 1])
+                elif nextVisit is not None:
+                    dataIdNextVisit = copy.copy(dataId)
+                    dataIdNextVisit['visit'] = nextVisit
+                    prefetcher.start(dataIdNextVisit, breakBy=breakBy)
+            
+            for task in taskList:
+
+                test_t0 = time.time()
+                test = str(task)
+                if not re.search(testRegex, test) and not re.search('performance', test):
+                    continue
+
+                date = datetime.datetime.now().strftime("%a %Y-%m-%d %H:%M:%S")
+                self.log.log(self.log.INFO, "Running " + test + "  visit:" + str(visit) + "  ("+date+")")
+                sys.stdout.flush() # clear the buffer before the fork
+
+
+                if plotQueue is not None:
+                    # the task's previous plot() is still writing to its TestSets, and the
+                    # performance task reports the plot runtimes so far
+                    if re.search('performance', test):
+                        plotQueue.join()
+                    else:
+                        plotQueue.wait(test)
+
+                # try the test() method
+                t0 = time.time()
+                self.runSubtask(task.test, data, thisDataId, visit, test, testset, exceptExit)
+                data.cachePerformance(thisDataId, test, "test-runtime", time.time() - t0)
+
+                t0 = time.time()
+                if plotQueue is not None:
+                    # try the plot() method, in a background process.  Its runtime is recorded
+                    # when it's done; "plot-queue" is the fork (and any wait for a free job slot).
+                    def onDone(elapsed, dataId=thisDataId, test=test):
+                        data.cachePerformance(dataId, test, "plot-runtime", elapsed)
+                    plotQueue.add(test, onDone, self.runSubtask, task.plot, data, thisDataId, visit, test,
+                                  testset, exceptExit)
+                    data.cachePerformance(thisDataId, test, "plot-queue", time.time() - t0)
+                        
+                else:
+                    # try the plot() method
+                    self.runSubtask(task.plot, data, thisDataId, visit, test, testset, exceptExit)
+                    data.cachePerformance(thisDataId, test, "plot-runtime", time.time() - t0)
+                
+                # try the free() method
+                self.runSubtask(task.free, data, thisDataId, visit, test, testset, exceptExit)
+
+
+                memory = self._getMemUsageThisPid()
+                test_tf = time.time()
+                tstamp = time.mktime(datetime.datetime.now().timetuple())
+                idstamp = ""
+                for k,v in thisDataId.items():
+                    idstamp += k[0]+str(v)
+                useFp.write("%-12.1f %-24s %-32s %9.2fs %7d %7.2f\n" %
+                            (tstamp, idstamp, test, test_tf-test_t0, memory, memory/1024.0))
+                useFp.flush()
+
+            raftName = ""
+            if thisDataId.has_key('raft'):
+                raftName = thisDataId['raft']+"-"
+            ccdName = ""
+            if thisDataId.has_key("ccd"):
+                ccdName = thisDataId[data.ccdConvention]
+                
+            progset.addTest(visit, 0, [1, 1], "Processing. Done %s%s." % (raftName,ccdName))
+
+        # the visit isn't done until its figures are
+        if plotQueue is not None:
+            plotQueue.join()
+
+        # the data are kept within the cache budget while the visit's rafts/ccds are tested,
+        # but the records of queries run, runtimes, etc. aren't, so start afresh for the next
+        data.clearCache()
+        progset.addTest(visit, 1, [1, 1], "Done processing.")
+
+
+    def runVisitJobs(self, makeData, visits, dataId, taskList, testset, progset, useFp, jobs, runKwargs):
+        """Run runVisit() for each visit in a pool of processes.
+
+        Each process makes its own QaData.  The shared testset, progset and useFp are only
+        written here, from what the processes send back as they finish each visit.  A whole
+        visit is the unit of work, as a visit's own TestSets accumulate over its rafts/ccds,
+        so --breakBy raft/ccd doesn't give more parallelism than there are visits.
+
+        @param makeData  Function returning a new QaData
+        @param visits    The visits to run
+        @param jobs      The number of processes
+        @param runKwargs Keyword arguments for runVisit()
+        (others as for runVisit())
+        """
+        global _jobContext
+        _jobContext = dict(task=self, makeData=makeData, dataId=dataId, taskList=taskList,
+                           runKwargs=runKwargs)
+        pool = multiprocessing.Pool(max(1, min(jobs, len(visits))), initializer=_initVisitJob)
+        try:
+            for visit, testCalls, progCalls, performance in pool.imap_unordered(_runVisitJob, visits):
+                for args, kwargs in testCalls:
+                    testset.addTest(*args, **kwargs)
+                for args, kwargs in progCalls:
+                    progset.addTest(*args, **kwargs)
+                useFp.write(performance)
+                useFp.flush()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _jobContext = None
+
+            
     @pipeBase.timeMethod
     def parseAndRun(self, args):
         self.log.log(self.log.INFO, "PipeQA Start")
@@ -250,6 +601,8 @@ class PipeQaTask(pipeBase.Task):
         groupInfo    = parsedCmd.group
         delaySummary = parsedCmd.delaySummary
         forkFigure   = parsedCmd.forkFigure
+        plotJobs     = parsedCmd.plotJobs
+        jobs         = parsedCmd.jobs
         wwwCache     = not parsedCmd.noWwwCache
         useForced    = parsedCmd.useForced
         coaddTable   = parsedCmd.coaddTable
@@ -274,6 +627,19 @@ class PipeQaTask(pipeBase.Task):
                          "I'll set it for you.")
             keep = True
 
+        prefetch = self.config.prefetch and jobs == 1
+        if prefetch and forkFigure:
+            # forking while the prefetch thread holds a lock (eg. in the database client) would
+            # leave the figure process stuck on it
+            self.log.log(self.log.WARN, "You've specified forkFigure (-f), which can't run alongside "+
+                         "the prefetch thread.  I'll turn prefetch off for you.")
+            prefetch = False
+
+        if jobs > 1 and wwwCache:
+            self.log.log(self.log.WARN, ("You've specified jobs=%d, which can't share the www cache. "+
+                                         "I'll set noWwwCache for you.") % (jobs))
+            wwwCache = False
+
         if camera == "coadd" and skymapRep is None:
             self.log.fatal("Requries a skymap repository (-S repository) if running on coadd (-C coadd)")
             sys.exit()
@@ -290,17 +656,33 @@ class PipeQaTask(pipeBase.Task):
         if exceptExit:
             numpy.seterr(all="raise")
         
-        if (camera=='coadd'):
-            tract=visits.split('-')[0]
-            data = pipeQA.makeQaData(dataset, rerun=rerun, camera=camera,
-                                     shapeAlg = self.config.shapeAlgorithm,
-                                     useForced=useForced, coaddTable=coaddTable, 
-                                     skymapRep=skymapRep, tract=tract)
-        else:
-            data = pipeQA.makeQaData(dataset, rerun=rerun, camera=camera,
-                                     shapeAlg = self.config.shapeAlgorithm,
-                                     useForced=useForced, coaddTable=coaddTable, 
-                                     skymapRep=skymapRep)
+        # with prefetching there are two QaDatas (ours and the prefetcher's), which share the budget
+        cacheSizeMb = self.config.cacheSizeMb
+        if prefetch:
+            cacheSizeMb //= 2
+        
+        # each --jobs process makes its own QaData (and database connection) with this
+        def makeData():
+            if (camera=='coadd'):
+                tract=visits.split('-')[0]
+                return pipeQA.makeQaData(dataset, rerun=rerun, camera=camera,
+                                         shapeAlg = self.config.shapeAlgorithm,
+                                         loadThreads = self.config.loadThreads,
+                                         queryCacheDir = self.config.queryCacheDir,
+                                         queryCacheMaxBytes = self.config.queryCacheSizeMb*1024**2,
+                                         cacheMaxBytes = cacheSizeMb*1024**2,
+                                         useForced=useForced, coaddTable=coaddTable, 
+                                         skymapRep=skymapRep, tract=tract)
+            else:
+                return pipeQA.makeQaData(dataset, rerun=rerun, camera=camera,
+                                         shapeAlg = self.config.shapeAlgorithm,
+                                         loadThreads = self.config.loadThreads,
+                                         queryCacheDir = self.config.queryCacheDir,
+                                         queryCacheMaxBytes = self.config.queryCacheSizeMb*1024**2,
+                                         cacheMaxBytes = cacheSizeMb*1024**2,
+                                         useForced=useForced, coaddTable=coaddTable, 
+                                         skymapRep=skymapRep)
+        data = makeData()
 
         if data.cameraInfo.name == 'lsstSim' and  dataIdInput.has_key('ccd'):
             dataIdInput['sensor'] = dataIdInput['ccd']
@@ -421,76 +803,22 @@ class PipeQaTask(pipeBase.Task):
     
         testset = pipeQA.TestSet(group="", label="QA-failures"+groupTag, wwwCache=wwwCache)
 
-        for visit in visits:
-            visit_t0 = time.time()
-    
-            dataIdVisit = copy.copy(dataId)
-            dataIdVisit['visit'] = visit
-    
-            # now break up the run into eg. rafts or ccds
-            #  ... if we only run one raft or ccd at a time, we use less memory
-            brokenDownDataIdList = data.breakDataId(dataIdVisit, breakBy)
-
-            for thisDataId in brokenDownDataIdList:
-
-                for task in taskList:
-    
-                    test_t0 = time.time()
-                    test = str(task)
-                    if not re.search(testRegex, test) and not re.search('performance', test):
-                        continue
-    
-                    date = datetime.datetime.now().strftime("%a %Y-%m-%d %H:%M:%S")
-                    self.log.log(self.log.INFO, "Running " + test + "  visit:" + str(visit) + "  ("+date+")")
-                    sys.stdout.flush() # clear the buffer before the fork
-    
-    
-                    # try the test() method
-                    t0 = time.time()
-                    self.runSubtask(task.test, data, thisDataId, visit, test, testset, exceptExit)
-                    data.cachePerformance(thisDataId, test, "test-runtime", time.time() - t0)
-
-                    t0 = time.time()
-                    if forkFigure:
-                        pid = os.fork()
-                        if pid == 0:
-                            # try the plot() method
-                            self.runSubtask(task.plot, data, thisDataId, visit, test, testset, exceptExit)
-                            os._exit(os.EX_OK) # sys.exit(0)
-                        else:
-                            os.waitpid(pid, 0)
-                            
-                    else:
-                        # try the plot() method
-                        self.runSubtask(task.plot, data, thisDataId, visit, test, testset, exceptExit)
-                        
-                    data.cachePerformance(thisDataId, test, "plot-runtime", time.time() - t0)
-                    
-                    # try the free() method
-                    self.runSubtask(task.free, data, thisDataId, visit, test, testset, exceptExit)
-    
-    
-                    memory = self._getMemUsageThisPid()
-                    test_tf = time.time()
-                    tstamp = time.mktime(datetime.datetime.now().timetuple())
-                    idstamp = ""
-                    for k,v in thisDataId.items():
-                        idstamp += k[0]+str(v)
-                    useFp.write("%-12.1f %-24s %-32s %9.2fs %7d %7.2f\n" %
-                                (tstamp, idstamp, test, test_tf-test_t0, memory, memory/1024.0))
-                    useFp.flush()
-    
-                # we're now done this dataId ... can clear the cache            
-                data.clearCache()
-                raftName = ""
-                if thisDataId.has_key('raft'):
-                    raftName = thisDataId['raft']+"-"
-                ccdName = ""
-                if thisDataId.has_key("ccd"):
-                    ccdName = thisDataId[data.ccdConvention]
-                    
-                progset.addTest(visit, 0, [1, 1], "Processing. Done %s%s." % (raftName,ccdName))
-            progset.addTest(visit, 1, [1, 1], "Done processing.")
+        plotQueue = None
+        if forkFigure:
+            plotQueue = _PlotQueue(plotJobs, exceptExit)
+        runKwargs = dict(breakBy=breakBy, testRegex=testRegex, exceptExit=exceptExit, plotQueue=plotQueue)
+        if jobs > 1:
+            self.runVisitJobs(makeData, visits, dataId, taskList, testset, progset, useFp, jobs, runKwargs)
+        else:
+            prefetcher = None
+            if prefetch:
+                prefetcher = _Prefetcher(makeData, self.log)
+            for i, visit in enumerate(visits):
+                nextVisit = None
+                if i + 1 < len(visits):
+                    nextVisit = visits[i + 1]
+                self.runVisit(data, visit, dataId, taskList, testset, progset, useFp,
+                              prefetcher=prefetcher, nextVisit=nextVisit, **runKwargs)
     
         useFp.close()
 
@@ -12,6 +12,7 @@ import lsst.testing.pipeQA.figures as qaFig
 import lsst.testing.pipeQA.TestCode as testCode
 import RaftCcdData as raftCcdData
 import QaAnalysisUtils as qaAnaUtil
+import GroupStatistics as groupStats
 import QaPlotUtils as qaPlotUtil
 
 import lsst.testing.pipeQA.source as pqaSource
@@ -83,7 +84,6 @@ class PsfShapeQaTask(QaAnalysisTask):
 
         # compute values of interest
         filter = None
-        sigmaToFwhm = 2.0*numpy.sqrt(2.0*numpy.log(2.0))
 
         fwhmByKey = {}
         for key, ss in self.ssDict.items():
@@ -98,46 +98,34 @@ class PsfShapeQaTask(QaAnalysisTask):
 
             fwhmByKey[key] = 0.0
 
-            fwhmTmp = 0.0
-            for s in ss:
-                ixx = s.getD(self.sCatDummy.IxxKey)
-                iyy = s.getD(self.sCatDummy.IyyKey)
-                ixy = s.getD(self.sCatDummy.IxyKey)
-
-                tmp = 0.25*(ixx-iyy)**2 + ixy**2
-                if tmp < 0:
-                    continue
-
-                a2 = 0.5*(ixx+iyy) + numpy.sqrt(tmp)
-                b2 = 0.5*(ixx+iyy) - numpy.sqrt(tmp)
-
-                if a2 == 0 or b2/a2 < 0:
-                    continue
-                
-                ellip = 1.0 - numpy.sqrt(b2/a2)
-                theta = 0.5*numpy.arctan2(2.0*ixy, ixx-iyy)
-
-                # vectors have no direction, so default to pointing in +ve 'y'
-                # - failing to do this caused a stats bug when alignment is near pi/2
-                #   both +/- pi/2 arise but are essentially the same, ... and the mean is near zero
-                if theta < 0.0:
-                    theta += numpy.pi
-                    
-                #print ixx, iyy, ixy, a2, b2, ellip, theta
-                isStar = 0 if s.getD(self.sCatDummy.ExtendednessKey) else 1
-
-                flux = s.getD(self.sCatDummy.PsfFluxKey)
-                mag = 99.0
-                if flux > 0:
-                    mag = -2.5*numpy.log10(s.getD(self.sCatDummy.PsfFluxKey))
-                if numpy.isfinite(ellip) and numpy.isfinite(theta) and isStar and mag < 20:
-                    self.ellip.append(raft, ccd, ellip)
-                    self.theta.append(raft, ccd, theta)
-                    self.x.append(raft, ccd, s.getD(self.sCatDummy.XAstromKey))
-                    self.y.append(raft, ccd, s.getD(self.sCatDummy.YAstromKey))
-                    self.ra.append(raft, ccd, s.getD(self.sCatDummy.RaKey))
-                    self.dec.append(raft, ccd, s.getD(self.sCatDummy.DecKey))
-                    fwhmTmp += sigmaToFwhm*numpy.sqrt(0.5*(a2 + b2))
+            if hasattr(ss, 'getColumn'):
+                column = lambda key: ss.getColumn(key)
+            else:
+                column = lambda key: numpy.array([s.getD(key) for s in ss])
+
+            # theta is folded into [0, pi): vectors have no direction, so they point in +ve 'y'
+            # - failing to do this caused a stats bug when alignment is near pi/2
+            #   both +/- pi/2 arise but are essentially the same, ... and the mean is near zero
+            shape = qaAnaUtil.momentsToEllipse(column(self.sCatDummy.IxxKey),
+                                               column(self.sCatDummy.IyyKey),
+                                               column(self.sCatDummy.IxyKey))
+
+            # NaN extendedness counts as extended, as it does for 'if extendedness'
+            extendedness = column(self.sCatDummy.ExtendednessKey)
+            isStar = (extendedness == 0)
+
+            flux = column(self.sCatDummy.PsfFluxKey)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                mag = numpy.where(flux > 0, -2.5*numpy.log10(flux), 99.0)
+
+            keep = numpy.isfinite(shape['ellip']) & numpy.isfinite(shape['theta']) & isStar & (mag < 20)
+            self.ellip.extend(raft, ccd, shape['ellip'][keep])
+            self.theta.extend(raft, ccd, shape['theta'][keep])
+            self.x.extend(raft, ccd, column(self.sCatDummy.XAstromKey)[keep])
+            self.y.extend(raft, ccd, column(self.sCatDummy.YAstromKey)[keep])
+            self.ra.extend(raft, ccd, column(self.sCatDummy.RaKey)[keep])
+            self.dec.extend(raft, ccd, column(self.sCatDummy.DecKey)[keep])
+            fwhmTmp = shape['fwhm'][keep].sum()
 
             nFwhm = len(self.x.get(raft,ccd))
             if nFwhm:
@@ -152,16 +140,16 @@ class PsfShapeQaTask(QaAnalysisTask):
         # gets the stats for each sensor and put the values in the raftccd container
         self.ellipMedians = raftCcdData.RaftCcdData(self.detector)
         self.thetaMedians = raftCcdData.RaftCcdData(self.detector)
-        for raft, ccd in self.ellip.raftCcdKeys():
-            ellip = self.ellip.get(raft, ccd)
-            theta = self.theta.get(raft, ccd)
-
-            if len(ellip) > 0:
-                stat = afwMath.makeStatistics(ellip, afwMath.NPOINT | afwMath.MEDIAN)
-                ellipMed = stat.getValue(afwMath.MEDIAN)
-                stat = afwMath.makeStatistics(theta, afwMath.NPOINT | afwMath.MEDIAN)
-                thetaMed = stat.getValue(afwMath.MEDIAN)
-                n      = stat.getValue(afwMath.NPOINT)
+        keys, ellip, offsets = self.ellip.concatenate()
+        keys, theta, offsets = self.theta.concatenate()
+        ellipStats = groupStats.groupStatistics(ellip, offsets)
+        thetaStats = groupStats.groupStatistics(theta, offsets)
+        for i, (raft, ccd) in enumerate(keys):
+
+            if offsets[i+1] > offsets[i]:
+                ellipMed = ellipStats["median"][i]
+                thetaMed = thetaStats["median"][i]
+                n      = thetaStats["n"][i]
             else:
                 ellipMed = -1.0
                 thetaMed = 0.0
@@ -324,8 +312,7 @@ class PsfShapeQaTask(QaAnalysisTask):
             eLen = self.ellip.get(raft, ccd)
             
             t = self.theta.get(raft, ccd)
-            dx = eLen*numpy.cos(t)
-            dy = eLen*numpy.sin(t)
+            dx, dy = qaAnaUtil.ellipseVectors(eLen, t)
             x = self.x.get(raft, ccd)
             y = self.y.get(raft, ccd)
             #x = self.ra.get(raft, ccd)
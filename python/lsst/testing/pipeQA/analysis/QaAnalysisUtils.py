@@ -56,71 +56,304 @@ def lineFit(x, y, dy=None):
 
 
 def robustPolyFit(x, y, order, nbin=3, sigma=3.0, niter=1):
+    """Fit a line to the medians of y in nbin bins of x, optionally with sigma clipping of the bins.
 
-    xNew, yNew = copy.copy(x), copy.copy(y)
-    
-    # bin and take medians in each bin
+    Returns slope, slope error, intercept, intercept error.  This is groupRobustLineFit() with
+    all the points in one group.
+    """
+    fit = groupRobustLineFit(x, y, numpy.zeros(len(x), dtype=int), 1, nbin=nbin, sigma=sigma, niter=niter)
+    return tuple(fit[0])
+
+
+def groupLineFit(x, y, dy, group, nGroup):
+    """Weighted least squares lines for many groups of points at once (as lineFit() with errors).
+
+    The normal equations for all the groups are accumulated together with bincount, and groups
+    with fewer than 2 points get zeros, as from lineFit().  Returns arrays of length nGroup:
+    intercept, intercept error, slope, slope error.
+
+    @param x       Array of x values
+    @param y       Array of y values
+    @param dy      Array of errors in y
+    @param group   Array with the group number (0 to nGroup-1) of each point
+    @param nGroup  Number of groups
+    """
+    w = 1.0/dy**2
+    n   = numpy.bincount(group, minlength=nGroup)
+    S   = numpy.bincount(group, w, minlength=nGroup)
+    Sx  = numpy.bincount(group, w*x, minlength=nGroup)
+    Sy  = numpy.bincount(group, w*y, minlength=nGroup)
+    Sxx = numpy.bincount(group, w*x**2, minlength=nGroup)
+    Sxy = numpy.bincount(group, w*x*y, minlength=nGroup)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        Delta = S*Sxx - Sx**2
+        bb = (S*Sxy - Sx*Sy)/Delta
+        aa = (Sxx*Sy - Sx*Sxy)/Delta
+        rms_aa = numpy.sqrt(numpy.abs(Sxx/Delta))
+        rms_bb = numpy.sqrt(numpy.abs(S/Delta))
+
+    fit = n >= 2
+    return [numpy.where(fit, v, 0.0) for v in (aa, rms_aa, bb, rms_bb)]
+
+
+def _groupMedian(values, group, nGroup):
+    """Median of values in each group (NaN for empty groups), from one lexsort of all the values."""
+    order = numpy.lexsort((values, group))
+    sortedValues = values[order]
+    n = numpy.bincount(group, minlength=nGroup)
+    start = numpy.cumsum(n) - n
+    median = numpy.empty(nGroup)
+    median.fill(numpy.NaN)
+    has = n > 0
+    lo = start[has] + (n[has] - 1)//2
+    hi = start[has] + n[has]//2
+    median[has] = 0.5*(sortedValues[lo] + sortedValues[hi])
+    return median
+
+
+def groupRobustLineFit(x, y, group, nGroup, nbin=3, sigma=3.0, niter=1):
+    """Robust line fits (see robustPolyFit()) for many groups of points, eg. one per ccd, at once.
+
+    Each group's x range is split into nbin bins, and a line is fit to the bin medians
+    weighted by their errors.  With niter > 1, bins whose residual is sigma or more from the
+    median (then mean) residual of their group are dropped and the fit repeated.  All groups
+    are binned, fit and clipped together with array operations.
+
+    Returns an nGroup x 4 array with rows: slope, slope error, intercept, intercept error.
+    Groups with fewer than 2 bins get zeros.
+
+    @param x       Array of x values
+    @param y       Array of y values
+    @param group   Array with the group number (0 to nGroup-1) of each point
+    @param nGroup  Number of groups
+    @param nbin    Number of bins in x for each group
+    @param sigma   Clipping threshold
+    @param niter   Number of fit iterations
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    group = numpy.asarray(group, dtype=int)
+
+    result = numpy.zeros((nGroup, 4))
+    if len(x) == 0:
+        return result
+
+    # bin edges for each group
     epsilon = 1.0e-6
-    xmin, xmax = xNew.min() - epsilon, xNew.max() + epsilon
+    order = numpy.argsort(group, kind='mergesort')
+    n = numpy.bincount(group, minlength=nGroup)
+    has = n > 0
+    start = (numpy.cumsum(n) - n)[has]
+    xmin = numpy.zeros(nGroup)
+    xmax = numpy.zeros(nGroup)
+    xmin[has] = numpy.minimum.reduceat(x[order], start) - epsilon
+    xmax[has] = numpy.maximum.reduceat(x[order], start) + epsilon
+    step = (xmax - xmin)/nbin
 
-    step = (xmax-xmin)/(nbin)
-    xMeds, yMeds, yErrs = [], [], []
+    xlo = xmin[group]
+    xstep = step[group]
+    binId = numpy.empty(len(x), dtype=int)
+    binId.fill(-1)
     for i in range(nbin):
-        w = numpy.where( (xNew > xmin + i*step) & (xNew <= xmin + (i+1)*step) )
-        if len(xNew[w]) == 0:
-            continue
-        xMeds.append(numpy.median(xNew[w]))
-        yMeds.append(numpy.median(yNew[w]))
-        yErr = numpy.std(yNew[w])/numpy.sqrt(len(yNew[w]))
-        yErrs.append(yErr)
-        
-    # use these new coords to fit the line ... with sigma clipping if requested
-    xNew, yNew, dyNew = numpy.array(xMeds), numpy.array(yMeds), numpy.array(yErrs)
-
-    # if there's only one point in a bin, dy=0 ... use the average error instead
-    w0 = numpy.where(dyNew == 0)[0]
-    wnot0 = numpy.where(dyNew > 0)[0]
-    if len(w0) > 0:
-        if len(wnot0) > 0:
-            meanError = numpy.mean(dyNew[wnot0])
-        # if *all* bins have a single point, then all dy are zero
-        # take a blind guess and use stdev of all values we got
-        else:
-            meanError = numpy.std(yNew)
-
-        # last ... if we have errors of zero, use 1.0
-        # sounds silly, but if we fit a line to a difference value
-        # and it's the difference of identical values
-        # (eg. instFlux and modFlux are loaded with the same value)
-        # then the dy could be zero
-        if meanError == 0.0:
-            meanError = 1.0
-        dyNew[w0] = meanError
+        binId[(x > xlo + i*xstep) & (x <= xlo + (i+1)*xstep)] = i
+    inBin = binId >= 0
+    cell = group[inBin]*nbin + binId[inBin]
+    xIn, yIn = x[inBin], y[inBin]
 
-    
-    for i in range(niter):
+    # median and error of the median in each non-empty bin
+    nCell = numpy.bincount(cell, minlength=nGroup*nbin)
+    cells = numpy.where(nCell > 0)[0]
+    cellGroup = cells//nbin
+    nC = nCell[cells]
+    xMed = _groupMedian(xIn, cell, nGroup*nbin)[cells]
+    yMed = _groupMedian(yIn, cell, nGroup*nbin)[cells]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        yMean = numpy.bincount(cell, yIn, minlength=nGroup*nbin)/nCell
+    yStd = numpy.sqrt(numpy.bincount(cell, (yIn - yMean[cell])**2, minlength=nGroup*nbin)[cells]/nC)
+    dy = yStd/numpy.sqrt(nC)
 
-        #ret = numpy.polyfit(xNew, yNew, order)
-        #p = ret[0:2]
-        a, da, b, db, rab, x2 = lineFit(xNew, yNew, dyNew)
-        
-        residuals = yNew - numpy.polyval((a, b), xNew)
+    # if there's only one point in a bin, dy=0 ... use the average error of the group's other bins,
+    # or if *all* its bins have a single point, the stdev of its bin medians.  If that's zero too
+    # (eg. a difference of identical values), use 1.0
+    pos = dy > 0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        nPos = numpy.bincount(cellGroup[pos], minlength=nGroup)
+        meanPos = numpy.bincount(cellGroup[pos], dy[pos], minlength=nGroup)/nPos
+        nBins = numpy.bincount(cellGroup, minlength=nGroup)
+        medMean = numpy.bincount(cellGroup, yMed, minlength=nGroup)/nBins
+        medStd = numpy.sqrt(numpy.bincount(cellGroup, (yMed - medMean[cellGroup])**2, minlength=nGroup)/nBins)
+    meanError = numpy.where(nPos > 0, meanPos, medStd)
+    meanError[meanError == 0.0] = 1.0
+    dy = numpy.where(dy == 0, meanError[cellGroup], dy)
 
-        if i == 0:
-            mean = numpy.median(residuals)
-        else:
-            mean = numpy.mean(residuals)
-            
-        std = numpy.std(residuals)
+    keep = numpy.ones(len(cells), dtype=bool)
+    for i in range(niter):
+        a, da, b, db = groupLineFit(xMed[keep], yMed[keep], dy[keep], cellGroup[keep], nGroup)
 
         if niter > 1:
-            w = numpy.where( (numpy.abs(residuals - mean)/std) < sigma )
-            xNew = xNew[w]
-            yNew = yNew[w]
-            dyNew = dyNew[w]
-            
-    return b, db, a, da
+            residuals = yMed - (b[cellGroup]*xMed + a[cellGroup])
+            g = cellGroup[keep]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                nKeep = numpy.bincount(g, minlength=nGroup)
+                mean = numpy.bincount(g, residuals[keep], minlength=nGroup)/nKeep
+                std = numpy.sqrt(numpy.bincount(g, (residuals[keep] - mean[g])**2, minlength=nGroup)/nKeep)
+                if i == 0:
+                    mean = _groupMedian(residuals[keep], g, nGroup)
+                keep &= (numpy.abs(residuals - mean[cellGroup])/std[cellGroup]) < sigma
+
+    result[:,0] = b
+    result[:,1] = db
+    result[:,2] = a
+    result[:,3] = da
+    return result
+
+
+def sectorCounts(x, y, xwid, ywid, grids):
+    """Count the points in each sector of one or more grids laid over an xwid by ywid area.
+
+    A point goes in sector int(nx*x/xwid), int(ny*y/ywid), and points outside the grid
+    (or with non-finite positions) aren't counted.  Returns a list with an nx by ny array
+    of counts for each grid.
+
+    @param x      Array of x positions, from the corner of the area
+    @param y      Array of y positions, from the corner of the area
+    @param xwid   Width of the area
+    @param ywid   Height of the area
+    @param grids  List of (nx, ny) grid sizes, eg. [(4, 4), (8, 8)]
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+
+    countsList = []
+    for nx, ny in grids:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            xf = nx*x/xwid
+            yf = ny*y/ywid
+        # int() truncates towards zero, as does astype(), but only finite values convert
+        ok = numpy.isfinite(xf) & numpy.isfinite(yf)
+        ok[ok] = (xf[ok] > -1.0) & (xf[ok] < nx) & (yf[ok] > -1.0) & (yf[ok] < ny)
+        xi = xf[ok].astype(numpy.int64)
+        yi = yf[ok].astype(numpy.int64)
+        counts = numpy.bincount(xi*ny + yi, minlength=nx*ny)[0:nx*ny]
+        countsList.append(counts.reshape(nx, ny))
+    return countsList
+
+
+def momentsToEllipse(ixx, iyy, ixy):
+    """Get the shape of the ellipses described by arrays of second moments.
+
+    Returns a dict of arrays:
+      'ellip' 1 - b/a
+      'theta' position angle of the major axis (radians, folded into [0, pi) as a vector
+              pointing -y is the same as one pointing +y)
+      'a', 'b' semi-major and semi-minor axes (the square roots of the eigenvalues)
+      'fwhm'  FWHM of a round gaussian with the same mean variance (pixels)
+    Where the moments don't describe an ellipse, ellip (and maybe more) is NaN.
+
+    @param ixx  Array of xx moments
+    @param iyy  Array of yy moments
+    @param ixy  Array of xy moments
+    """
+    ixx = numpy.asarray(ixx, dtype=numpy.float64)
+    iyy = numpy.asarray(iyy, dtype=numpy.float64)
+    ixy = numpy.asarray(ixy, dtype=numpy.float64)
+    sigmaToFwhm = 2.0*numpy.sqrt(2.0*numpy.log(2.0))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        root = numpy.sqrt(0.25*(ixx - iyy)**2 + ixy**2)
+        a2 = 0.5*(ixx + iyy) + root
+        b2 = 0.5*(ixx + iyy) - root
+        ratio = numpy.where(a2 == 0, numpy.NaN, b2/a2)
+        ellip = 1.0 - numpy.sqrt(numpy.where(ratio < 0, numpy.NaN, ratio))
+
+        theta = 0.5*numpy.arctan2(2.0*ixy, ixx - iyy)
+        theta = numpy.where(theta < 0.0, theta + numpy.pi, theta)
+
+        shape = {
+            'ellip' : ellip,
+            'theta' : theta,
+            'a'     : numpy.sqrt(a2),
+            'b'     : numpy.sqrt(b2),
+            'fwhm'  : sigmaToFwhm*numpy.sqrt(0.5*(a2 + b2)),
+            }
+    return shape
+
+
+def ellipseVectors(ellip, theta):
+    """Get the x and y components of ellipticity vectors, eg. for a quiver plot.
+
+    @param ellip Array of ellipticities (the vector lengths)
+    @param theta Array of position angles (radians)
+    """
+    return ellip*numpy.cos(theta), ellip*numpy.sin(theta)
+
+
+def skyOffsets(ra1, dec1, ra2, dec2, degrees=True, withDistance=False):
+    """Get the offsets of positions 2 from positions 1 on the sky, for arrays of positions.
+
+    The offsets are in the tangent plane at each position 2, in the small-angle limit:
+    dRa = (ra2 - ra1)*|cos(dec2)| and dDec = dec2 - dec1, with ra2 - ra1 wrapped into
+    [-pi, pi).  Returns dRa, dDec (radians), and the great circle distance between the
+    positions (radians, from the haversine formula) if withDistance is set.
+
+    @param ra1           Array of ra's of the first positions
+    @param dec1          Array of dec's of the first positions
+    @param ra2           Array of ra's of the second positions
+    @param dec2          Array of dec's of the second positions
+    @param degrees       The positions are in degrees (otherwise radians)
+    @param withDistance  Also return the great circle distances
+    """
+    ra1, dec1, ra2, dec2 = [numpy.asarray(x, dtype=numpy.float64) for x in (ra1, dec1, ra2, dec2)]
+    if degrees:
+        ra1, dec1, ra2, dec2 = [numpy.radians(x) for x in (ra1, dec1, ra2, dec2)]
+
+    with numpy.errstate(invalid='ignore'):
+        dRaRaw = numpy.remainder(ra2 - ra1 + numpy.pi, 2.0*numpy.pi) - numpy.pi
+    dDec = dec2 - dec1
+    dRa  = dRaRaw*numpy.abs(numpy.cos(dec2))
+
+    if not withDistance:
+        return dRa, dDec
+
+    with numpy.errstate(invalid='ignore'):
+        h = numpy.sin(0.5*dDec)**2 + numpy.cos(dec1)*numpy.cos(dec2)*numpy.sin(0.5*dRaRaw)**2
+        distance = 2.0*numpy.arcsin(numpy.sqrt(numpy.clip(h, 0.0, 1.0)))
+    return dRa, dDec, distance
+
+
+def joinIds(ids1, ids2, unique=False):
+    """Find the pairs of entries in two id arrays which have the same id.
+
+    Returns index arrays i1, i2 with ids1[i1] == ids2[i2], ordered by i1 and then i2 (as
+    numpy.where(numpy.equal.outer(ids1, ids2)) gives them), found by sorting ids2 rather
+    than comparing every pair.  An id appearing n1 times in ids1 and n2 times in ids2
+    gives n1*n2 pairs, unless unique is set.
+
+    @param ids1    Array of ids
+    @param ids2    Array of ids
+    @param unique  Only pair up ids which appear exactly once in each array (1-to-1 matches)
+    """
+    ids1 = numpy.asarray(ids1)
+    ids2 = numpy.asarray(ids2)
+
+    # a stable sort keeps equal ids in order of their index in ids2
+    order2  = numpy.argsort(ids2, kind='mergesort')
+    sorted2 = ids2[order2]
+    lo = numpy.searchsorted(sorted2, ids1, side='left')
+    n2 = numpy.searchsorted(sorted2, ids1, side='right') - lo
+
+    if unique:
+        sorted1 = numpy.sort(ids1)
+        n1 = numpy.searchsorted(sorted1, ids1, side='right') - numpy.searchsorted(sorted1, ids1, side='left')
+        i1 = numpy.where((n1 == 1) & (n2 == 1))[0]
+        return i1, order2[lo[i1]]
 
+    i1 = numpy.repeat(numpy.arange(len(ids1)), n2)
+    # each id1's pairs run through its block of sorted2, from lo
+    offset = numpy.cumsum(n2) - n2
+    i2 = order2[numpy.arange(len(i1)) + numpy.repeat(lo - offset, n2)]
+    return i1, i2
 
 
 def dictToList(d, withDelete=False):
@@ -1,6 +1,6 @@
 import sys, os, re
 import numpy
-import lsst.afw.math as afwMath
+import GroupStatistics as groupStats
 
 class RaftCcdData(object):
 
@@ -73,6 +73,10 @@ class RaftCcdData(object):
 class RaftCcdVector(RaftCcdData):
 
     def __init__(self, detector):
+        # values appended to a ccd go into a buffer which doubles its capacity when full.
+        # self.data[raft][ccd] is updated to a view of the filled part before anything reads it.
+        self.buffers = {}
+        self.dirty   = set()
         RaftCcdData.__init__(self, detector, initValue=numpy.array([], dtype=numpy.float))
 
     def xxxlistKeysAndValues(self, methodName=None, nHighest=None, nLowest=None):
@@ -107,40 +111,127 @@ class RaftCcdVector(RaftCcdData):
     def listKeysAndValues(self, methodName=None, nHighest=None, nLowest=None, limits=None):
 
         methods = {
-            "median" : afwMath.MEDIAN,
-            "meanclip" : afwMath.MEANCLIP,
-            "stdevclip" : afwMath.STDEVCLIP,
-            "mean" : afwMath.MEAN,
-            "stdev" : afwMath.STDEV,
+            "median" : "median",
+            "meanclip" : "meanClip",
+            "stdevclip" : "stdevClip",
+            "mean" : "mean",
+            "stdev" : "stdev",
             }
-        
+
+        self.freeze()
+        keys = self.raftCcdKeys()
+        arrays = []
+        for raft, ccd in keys:
+            dtmp = self.data[raft][ccd]
+            if nHighest is not None:
+                dtmp = numpy.sort(dtmp)[-nHighest:]
+            if (nLowest is not None) and (nHighest is None):
+                dtmp = numpy.sort(dtmp)[0:nLowest]
+            arrays.append(dtmp)
+        values, offsets = groupStats.concatenateGroups(arrays)
+
+        if limits is not None:
+            # values outside the limits are ignored like NaNs
+            lo, hi = limits
+            with numpy.errstate(invalid='ignore'):
+                values = numpy.where( (values > lo) & (values < hi), values, numpy.NaN)
+
+        stats = groupStats.groupStatistics(values, offsets)
+        value = stats[methods[methodName]]
+        n = stats["n"]
         kvList = []
-        for raft in sorted(self.data.keys()):
-            for ccd in sorted(self.data[raft].keys()):
-                dtmp = self.data[raft][ccd].copy()
-                if nHighest is not None:
-                    dtmp.sort()
-                    dtmp = dtmp[-nHighest:]
-                if (nLowest is not None) and (nHighest is None):
-                    dtmp.sort()
-                    dtmp = dtmp[0:nLowest]
-                    
-                if limits is not None:
-                    lo, hi = limits
-                    w = numpy.where( (dtmp > lo) & (dtmp < hi) )
-                    dtmp = dtmp[w]
-                    
-                stat = afwMath.makeStatistics(dtmp, afwMath.NPOINT | methods[methodName])
-                value = stat.getValue(methods[methodName])
-                n = stat.getValue(afwMath.NPOINT)
-                kvList.append([raft, ccd, value, n])
-                
+        for i, (raft, ccd) in enumerate(keys):
+            kvList.append([raft, ccd, value[i], n[i]])
         return kvList
 
+
+    def concatenate(self):
+        """Join the values of all ccds into one array, in raftCcdKeys() order.
+
+        @return keys, values, offsets -- values for keys[i] are values[offsets[i]:offsets[i+1]]
+        """
+        self.freeze()
+        keys = self.raftCcdKeys()
+        values, offsets = groupStats.concatenateGroups([self.data[raft][ccd] for raft, ccd in keys])
+        return keys, values, offsets
+
+    def groupStatistics(self, **kwargs):
+        """Get summary statistics for every ccd in one call.
+
+        @param kwargs Passed on to GroupStatistics.groupStatistics(), eg. nSigmaClip
+        @return keys, stats -- stats[name][i] is the statistic for keys[i]
+        """
+        keys, values, offsets = self.concatenate()
+        return keys, groupStats.groupStatistics(values, offsets, **kwargs)
+
         
     def reset(self, initValue=numpy.array([])):
         RaftCcdData.reset(self, initValue)
 
+    def set(self, raft, ccd, value):
+        self.buffers.pop((raft, ccd), None)
+        self.dirty.discard((raft, ccd))
+        RaftCcdData.set(self, raft, ccd, value)
+
+    def get(self, raft, ccd, default=None):
+        self.freeze()
+        return RaftCcdData.get(self, raft, ccd, default)
+
+    def cacheValues(self, recache=False):
+        self.freeze()
+        RaftCcdData.cacheValues(self, recache)
+
+    def freeze(self):
+        """Point self.data at the values appended so far."""
+        for raft, ccd in self.dirty:
+            buf, n = self.buffers[(raft, ccd)][0:2]
+            view = buf[0:n]
+            self.buffers[(raft, ccd)][2] = view
+            self.data[raft][ccd] = view
+        self.dirty = set()
+
+    def _reserve(self, raft, ccd, values):
+        """Get the buffer entry for raft,ccd with room for values, in a dtype which can hold them.
+
+        The dtype follows numpy.append(), so eg. appending strings gives a string array.
+        """
+        key = (raft, ccd)
+        entry = self.buffers.get(key)
+        current = self.data[raft][ccd]
+        if (entry is None) or (entry[2] is not current):
+            # no buffer yet, or self.data was replaced since we last froze it
+            entry = [current, len(current), current]
+            self.buffers[key] = entry
+
+        buf, n = entry[0:2]
+        dtype = buf.dtype
+        if not (dtype.kind == 'f' and (isinstance(values, (float, int, long)) or
+                                      (isinstance(values, numpy.ndarray) and values.dtype.kind in 'biuf'))):
+            dtype = numpy.append(buf[0:0], values).dtype
+
+        nNew = numpy.size(values)
+        if n + nNew > len(buf) or dtype != buf.dtype or entry[2] is buf:
+            capacity = max(2*len(buf), n + nNew, 16)
+            newBuf = numpy.empty(capacity, dtype=dtype)
+            newBuf[0:n] = buf[0:n]
+            entry[0] = newBuf
+        self.dirty.add(key)
+        return entry
+
     def append(self, raft, ccd, value):
-        self.data[raft][ccd] = numpy.append(self.data[raft][ccd], value)
+        entry = self._reserve(raft, ccd, value)
+        entry[0][entry[1]] = value
+        entry[1] += 1
+
+    def extend(self, raft, ccd, values):
+        """Append all of values (an array or sequence) to raft,ccd in one step.
+
+        @param raft   The raft name
+        @param ccd    The ccd name
+        @param values Values to append, eg. a masked column from a catalog
+        """
+        values = numpy.asarray(values).ravel()
+        entry = self._reserve(raft, ccd, values)
+        entry[0][entry[1]:entry[1]+len(values)] = values
+        entry[1] += len(values)
 
@@ -12,6 +12,7 @@ import lsst.testing.pipeQA.figures.QaFigureUtils as qaFigUtils
 import RaftCcdData as raftCcdData
 import lsst.testing.pipeQA.source as pqaSource
 import QaAnalysisUtils as qaAnaUtil
+import GroupStatistics as groupStats
 import QaPlotUtils as qaPlotUtil
 
 
@@ -98,6 +99,7 @@ class VignettingQaTask(QaAnalysisTask):
         
         #badFlags = pqaSource.INTERP_CENTER | pqaSource.SATUR_CENTER | pqaSource.EDGE
 
+        matchedCcds = []
         for key in self.detector.keys():
 
             if self.detector[key] is None:
@@ -161,31 +163,37 @@ class VignettingQaTask(QaAnalysisTask):
                                 radiusp = num.sqrt(xmm**2 + ymm**2)
                             self.radius.append(raftId, ccdId, radiusp)
 
-                # Calculate stats
-                dmags = self.dmag.get(raftId, ccdId)
-                if len(dmags) > 0:
-                    med = num.median(dmags)
-                else:
-                    med = 0.0
-                    
-                std   = 0.0
-                if len(dmags) > 1:
-                    stat  = afwMath.makeStatistics(dmags, afwMath.IQRANGE)
-                    std   = 0.741 * stat.getValue(afwMath.IQRANGE)
-                self.medianOffset.set(raftId, ccdId, med)
-                self.rmsOffset.set(raftId, ccdId, std)
-                
-                areaLabel = data.cameraInfo.getDetectorName(raftId, ccdId)
+                matchedCcds.append((raftId, ccdId))
+
+        # Calculate stats for all ccds at once
+        keys, dmags, offsets = self.dmag.concatenate()
+        stats = groupStats.groupStatistics(dmags, offsets)
+        index = dict([((raftId, ccdId), i) for i, (raftId, ccdId) in enumerate(keys)])
+        for raftId, ccdId in matchedCcds:
+            i = index[(raftId, ccdId)]
+            nDmag = offsets[i+1] - offsets[i]
+            if nDmag > 0:
+                med = stats["median"][i]
+            else:
+                med = 0.0
+
+            std   = 0.0
+            if nDmag > 1:
+                std   = 0.741 * stats["iqr"][i]
+            self.medianOffset.set(raftId, ccdId, med)
+            self.rmsOffset.set(raftId, ccdId, std)
+
+            areaLabel = data.cameraInfo.getDetectorName(raftId, ccdId)
 
-                label = "median offset "
-                comment = "median offset from cat mag"
-                test = testCode.Test(label, med, self.medLimits, comment, areaLabel=areaLabel)
-                testSet.addTest(test)
+            label = "median offset "
+            comment = "median offset from cat mag"
+            test = testCode.Test(label, med, self.medLimits, comment, areaLabel=areaLabel)
+            testSet.addTest(test)
 
-                label = "stddev offset "
-                comment = "stddev of offset from cat mag"
-                test = testCode.Test(label, std, self.rmsLimits, comment, areaLabel=areaLabel)
-                testSet.addTest(test)
+            label = "stddev offset "
+            comment = "stddev of offset from cat mag"
+            test = testCode.Test(label, std, self.rmsLimits, comment, areaLabel=areaLabel)
+            testSet.addTest(test)
 
                 
     def plot(self, data, dataId, showUndefined = False):
@@ -12,6 +12,8 @@ import lsst.testing.pipeQA.figures  as qaFig
 import lsst.testing.pipeQA.TestCode as testCode
 import lsst.testing.pipeQA.figures.QaFigureUtils as qaFigUtils
 import RaftCcdData as raftCcdData
+import QaAnalysisUtils as qaAnaUtil
+import GroupStatistics as groupStats
 from .AstrometricErrorQaTask import AstrometricErrorQaTask, AstrometricErrorQaConfig
 
 import matplotlib.cm as cm
@@ -78,9 +80,9 @@ class VisitToVisitAstromQaTask(AstrometricErrorQaTask):
             visMatchList = self.visitMatches[key]
 
             # List of reference object ids
-            srcObjIds = num.array([x[0].getId() for x in srcMatchList])
+            srcObjIds = srcMatchList.getRefColumn('Id')
             visObjIds = num.array([x[0].getId() for x in visMatchList])
-            common    = list(set(srcObjIds) & set(visObjIds))
+            common    = num.intersect1d(srcObjIds, visObjIds)
 
             self.log.log(self.log.INFO, "%s : " % (key))
             if len(common) == 0:
@@ -90,28 +92,18 @@ class VisitToVisitAstromQaTask(AstrometricErrorQaTask):
                 visObjIds *= 2
                 isStar     = (num.array([x[0].getFlagForDetection() for x in visMatchList]) & measAlg.Flags.STAR) > 0
                 visObjIds += isStar
-                common     = list(set(srcObjIds) & set(visObjIds))
+                common     = num.intersect1d(srcObjIds, visObjIds)
             self.log.log(self.log.INFO, "  Found %d matches" % (len(common)))
                     
-            # Iterate over all object ids
-            for i in range(len(common)):
-                srcObjId  = common[i]
-                idxS = num.where(srcObjIds == srcObjId)[0]
-                idxV = num.where(visObjIds == srcObjId)[0] 
-
-                # only take 1-to-1 matches
-                if len(idxS) != 1 or len(idxV) != 1:
-                    continue
+            # only take 1-to-1 matches
+            idxS, idxV = qaAnaUtil.joinIds(srcObjIds, visObjIds, unique=True)
+            pairs = []
+            for iS, iV in zip(idxS, idxV):
+                sref1 = srcMatchList[iS][0]
+                srcv1 = srcMatchList[iS][1]
     
-                sref1 = srcMatchList[idxS[0]][0]
-                srcv1 = srcMatchList[idxS[0]][1]
-    
-                sref2 = visMatchList[idxV[0]][0]
-                srcv2 = visMatchList[idxV[0]][1]
-
-                #coord1 = afwCoord.Coord(afwGeom.Point2D(srcv1.getRa(), srcv1.getDec()))  # coords originally in degrees
-                #coord2 = afwCoord.Coord(afwGeom.Point2D(srcv2.getRa(), srcv2.getDec()))  # coords originally in degrees
-                #angle  = coord1.angularSeparation(coord2)
+                sref2 = visMatchList[iV][0]
+                srcv2 = visMatchList[iV][1]
 
                 # Measurment flags; note no star/gal separation yet
                 flags1 = srcv1.getFlagForDetection()
@@ -120,14 +112,17 @@ class VisitToVisitAstromQaTask(AstrometricErrorQaTask):
                 isStar = sref1.getFlagForDetection() & measAlg.Flags.STAR
 
                 if (not flags1 & badFlags) and (not flags2 & badFlags) and isStar:
-                    ra1, dec1, ra2, dec2 = [x * num.pi / 180.0 for x in (srcv1.getRa(), srcv1.getDec(), srcv2.getRa(), srcv2.getDec())]
-                    dRa  = (ra1 - ra2) * abs(num.cos(dec1))
-                    dDec = (dec1 - dec2)
-
-                    self.dRa.append(raft, ccd, dRa)
-                    self.dDec.append(raft, ccd, dDec)
-                    self.x.append(raft, ccd, srcv1.getXAstrom())
-                    self.y.append(raft, ccd, srcv1.getYAstrom())
+                    pairs.append((srcv1.getRa(), srcv1.getDec(), srcv2.getRa(), srcv2.getDec(),
+                                  srcv1.getXAstrom(), srcv1.getYAstrom()))
+
+            if len(pairs) > 0:
+                ra1, dec1, ra2, dec2, x, y = num.array(pairs, dtype=num.float64).T
+                # coords originally in degrees
+                dRa, dDec = qaAnaUtil.skyOffsets(ra2, dec2, ra1, dec1)
+                self.dRa.extend(raft, ccd, dRa)
+                self.dDec.extend(raft, ccd, dDec)
+                self.x.extend(raft, ccd, x)
+                self.y.extend(raft, ccd, y)
 
         testSet = self.getTestSet(data, dataId)
         testSet.addMetadata({"Description": self.description})
@@ -135,19 +130,16 @@ class VisitToVisitAstromQaTask(AstrometricErrorQaTask):
         self.medErrArcsec = raftCcdData.RaftCcdData(self.detector)
         self.medThetaRad  = raftCcdData.RaftCcdData(self.detector)
     
-        for raft, ccd in self.dRa.raftCcdKeys():
-            dRa  = self.dRa.get(raft, ccd)
-            dDec = self.dDec.get(raft, ccd)
-                
-            errArcsec = 206265.0*num.sqrt(dRa**2 + dDec**2)
-            thetaRad  = num.arctan2(dDec, dRa)
-    
-            if len(errArcsec) > 0:
-                stat  = afwMath.makeStatistics(errArcsec, afwMath.NPOINT | afwMath.MEDIAN)
-                medErrArcsec = stat.getValue(afwMath.MEDIAN)
-                stat  = afwMath.makeStatistics(thetaRad, afwMath.NPOINT | afwMath.MEDIAN)
-                medThetaRad = stat.getValue(afwMath.MEDIAN)
-                n = stat.getValue(afwMath.NPOINT)
+        keys, dRa, offsets = self.dRa.concatenate()
+        keys, dDec, offsets = self.dDec.concatenate()
+        errStats = groupStats.groupStatistics(206265.0*num.sqrt(dRa**2 + dDec**2), offsets)
+        thetaStats = groupStats.groupStatistics(num.arctan2(dDec, dRa), offsets)
+
+        for i, (raft, ccd) in enumerate(keys):
+            if offsets[i+1] > offsets[i]:
+                medErrArcsec = errStats["median"][i]
+                medThetaRad = thetaStats["median"][i]
+                n = thetaStats["n"][i]
             else:
                 medErrArcsec = -1.0
                 medThetaRad = 0.0
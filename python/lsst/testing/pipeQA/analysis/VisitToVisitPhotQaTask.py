@@ -12,6 +12,7 @@ import lsst.testing.pipeQA.TestCode as testCode
 import lsst.testing.pipeQA.figures.QaFigureUtils as qaFigUtils
 import RaftCcdData as raftCcdData
 import QaAnalysisUtils as qaAnaUtil
+import GroupStatistics as groupStats
 
 import matplotlib.cm as cm
 import matplotlib.colors as colors
@@ -158,8 +159,10 @@ class VisitToVisitPhotQaTask(QaAnalysisTask):
         else:
             visitList = self.visits
 
+        # load the matches to all the visits together
+        visitMatches = data.getVisitMatchesBySensorForVisits(self.database, visitList, dataId)
         for visit in visitList:
-            self.visitMatches[visit] = data.getVisitMatchesBySensor(self.database, visit, dataId)
+            self.visitMatches[visit] = visitMatches[visit]
             kvs = self.visitMatches[visit].keys()
             self.visitFilters[visit] = None
             if len(kvs) > 0:
@@ -193,9 +196,9 @@ class VisitToVisitPhotQaTask(QaAnalysisTask):
                 visMatchList = self.visitMatches[visit][key]
 
                 # List of reference object ids
-                srcObjIds = num.array([x[0].getId() for x in srcMatchList])
+                srcObjIds = srcMatchList.getRefColumn('Id')
                 visObjIds = num.array([x[0].getId() for x in visMatchList])
-                common    = list(set(srcObjIds) & set(visObjIds))
+                common    = num.intersect1d(srcObjIds, visObjIds)
 
                 self.log.log(self.log.INFO, "%s :" % (key))
                 if len(common) == 0:
@@ -205,24 +208,19 @@ class VisitToVisitPhotQaTask(QaAnalysisTask):
                     visObjIds *= 2
                     isStar     = (num.array([x[0].getFlagForDetection() for x in visMatchList]) & measAlg.Flags.STAR) > 0
                     visObjIds += isStar
-                    common     = list(set(srcObjIds) & set(visObjIds))
+                    common     = num.intersect1d(srcObjIds, visObjIds)
                 self.log.log(self.log.INFO, "Found %d matches" % (len(common)))
                     
-                # Iterate over all object ids
-                for i in range(len(common)):
-                    srcObjId  = common[i]
-                    idxS = num.where(srcObjIds == srcObjId)[0]
-                    idxV = num.where(visObjIds == srcObjId)[0] 
-
-                    # only take 1-to-1 matches
-                    if len(idxS) != 1 or len(idxV) != 1:
-                        continue
-    
-                    sref1 = srcMatchList[idxS[0]][0]
-                    srcv1 = srcMatchList[idxS[0]][1]
+                # only take 1-to-1 matches
+                idxS, idxV = qaAnaUtil.joinIds(srcObjIds, visObjIds, unique=True)
+                for iS, iV in zip(idxS, idxV):
+                    srcObjId = srcObjIds[iS]
+                    
+                    sref1 = srcMatchList[iS][0]
+                    srcv1 = srcMatchList[iS][1]
     
-                    sref2 = visMatchList[idxV[0]][0]
-                    srcv2 = visMatchList[idxV[0]][1]
+                    sref2 = visMatchList[iV][0]
+                    srcv2 = visMatchList[iV][1]
     
                     f1  = self._getFlux(self.magType, srcv1, sref1)
                     f2  = self._getFlux(self.magType, srcv2, sref2)
@@ -273,27 +271,26 @@ class VisitToVisitPhotQaTask(QaAnalysisTask):
             self.medianDmags[visit] = raftCcdData.RaftCcdData(self.detector)
             self.stdDmags[visit]    = raftCcdData.RaftCcdData(self.detector)
     
-            for raft, ccd in self.mag[visit].raftCcdKeys():
-                m1  = self.mag[visit].get(raft, ccd)
-                m2  = self.visitMag[visit].get(raft, ccd)
-                dm1 = self.magErr[visit].get(raft, ccd)
-                dm2 = self.visitMagErr[visit].get(raft, ccd)
-                M1  = self.refMag[visit].get(raft, ccd)
-                M2  = self.visitRefMag[visit].get(raft, ccd)
-                star= self.star[visit].get(raft, ccd)
-    
-                idxS = num.where( (M1 > 10) & (M1 < self.magCut) & (star > 0) )[0]
-                
-                dmS  = m1[idxS] - m2[idxS] - (M1[idxS] - M2[idxS])
-                ddmS = num.sqrt(dm1[idxS]**2 + dm2[idxS]**2)
+            # all vectors for a visit are appended together, so they share the same offsets
+            keys, m1, offsets = self.mag[visit].concatenate()
+            keys, m2, offsets = self.visitMag[visit].concatenate()
+            keys, M1, offsets = self.refMag[visit].concatenate()
+            keys, M2, offsets = self.visitRefMag[visit].concatenate()
+            keys, star, offsets = self.star[visit].concatenate()
+
+            # bright stars only; the rest are ignored by the statistics as NaN
+            keep = (M1 > 10) & (M1 < self.magCut) & (star > 0)
+            dmS = num.where(keep, m1 - m2 - (M1 - M2), num.NaN)
+            nKeep = num.bincount(groupStats.groupIds(offsets)[keep], minlength=len(keys))
+            stats = groupStats.groupStatistics(dmS, offsets)
     
-                if len(dmS) > 0:
-                    stat   = afwMath.makeStatistics(dmS, afwMath.NPOINT | afwMath.MEANCLIP |
-                                                    afwMath.STDEVCLIP | afwMath.MEDIAN)
-                    mean   = stat.getValue(afwMath.MEANCLIP)
-                    median = stat.getValue(afwMath.MEDIAN)
-                    std    = stat.getValue(afwMath.STDEVCLIP)
-                    npts   = stat.getValue(afwMath.NPOINT)
+            for i, (raft, ccd) in enumerate(keys):
+                if nKeep[i] > 0:
+                    mean   = stats["meanClip"][i]
+                    median = stats["median"][i]
+                    std    = stats["stdevClip"][i]
+                    npts   = stats["n"][i]
+                    nstar  = nKeep[i]
     
                     # Common
                     tag = self.magType
@@ -302,19 +299,19 @@ class VisitToVisitPhotQaTask(QaAnalysisTask):
                     # MEAN
                     self.meanDmags[visit].set(raft, ccd, mean)
                     label = "mean "+tag 
-                    comment = "mean "+tag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, len(dmS), npts)
+                    comment = "mean "+tag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, nstar, npts)
                     testSet.addTest( testCode.Test(label, mean, self.deltaLimits, comment, areaLabel=areaLabel))
     
                     # MEDIAN
                     self.medianDmags[visit].set(raft, ccd, median)
                     label = "median "+tag 
-                    comment = "median "+tag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, len(dmS), npts)
+                    comment = "median "+tag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, nstar, npts)
                     testSet.addTest( testCode.Test(label, median, self.deltaLimits, comment, areaLabel=areaLabel))
     
                     # STD
                     self.stdDmags[visit].set(raft, ccd, std)
                     label = "stdev "+tag 
-                    comment = "stdev "+tag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, len(dmS), npts)
+                    comment = "stdev "+tag+" (mag lt %.1f, nstar/clip=%d/%d)" % (self.magCut, nstar, npts)
                     testSet.addTest( testCode.Test(label, std, self.rmsLimits, comment, areaLabel=areaLabel))
                 
 
@@ -591,8 +588,7 @@ class VisitToVisitPhotQaTask(QaAnalysisTask):
         for raft, ccd in self.mag[visitA].raftCcdKeys():
             idA = self.refId[visitA].get(raft, ccd)
             idB = self.refId[visitB].get(raft, ccd)
-            idX = num.intersect1d(idA, idB)
-            sliceA, sliceB = num.where(num.equal.outer(idA, idB) == True)
+            sliceA, sliceB = qaAnaUtil.joinIds(idA, idB)
             
             m1A  = self.mag[visitA].get(raft, ccd)[sliceA]
             m2A  = self.visitMag[visitA].get(raft, ccd)[sliceA]
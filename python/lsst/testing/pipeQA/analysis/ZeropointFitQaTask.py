@@ -174,16 +174,11 @@ class ZeropointFitQaTask(QaAnalysisTask):
                                                        "Imgerr": num.array([x[2] for x in galaxies])})
             
                 # Non-detections
-                undetectedStars = []
-                undetectedGalaxies = []
-                for nondet in self.matchListDictSrc[key]['undetected']:
-                    mag = nondet.getMag(filterName)
-                    if nondet.getIsStar():
-                        undetectedStars.append(mag)
-                    else:
-                        undetectedGalaxies.append(mag)
-                self.undetectedStar.set(raftId, ccdId, num.array(undetectedStars))
-                self.undetectedGalaxy.set(raftId, ccdId, num.array(undetectedGalaxies))
+                undetected = self.matchListDictSrc[key]['undetected']
+                mags = undetected.mags(filterName)
+                isStar = undetected.isStar != 0
+                self.undetectedStar.set(raftId, ccdId, mags[isStar])
+                self.undetectedGalaxy.set(raftId, ccdId, mags[~isStar])
 
                 # Orphans
                 orphans = []
@@ -10,10 +10,131 @@ fields = [
 
 
 
-class SimRefObjectSet(list):
+class SimRefObjectSet(object):
+    """Reference objects stored as one array per column, rather than one object each.
+
+    The columns are refObjectId, isStar, ra, decl (degrees) and mag, which has one row per
+    filter (in SimRefObject.flookup order), so mags(filter) is contiguous.
+
+    Like the list this used to be, it can be iterated and indexed: an integer index gives a
+    SimRefObject view of that row (setting it sets the row), a slice or an array of indices
+    or booleans gives a new SimRefObjectSet.
+    """
+
+    nMag = 6
+
+    def __init__(self, refObjectId=(), isStar=(), ra=(), decl=(), mag=None):
+        """
+        @param refObjectId Array of the ids
+        @param isStar      Array of the star (1) / galaxy (0) flags
+        @param ra          Array of the ra's (degrees)
+        @param decl        Array of the decl's (degrees)
+        @param mag         Array of the magnitudes, shape (nMag, n)
+        """
+        self._refObjectId = numpy.array(refObjectId, dtype=numpy.int64)
+        self._isStar      = numpy.array(isStar, dtype=numpy.int32)
+        self._ra          = numpy.array(ra, dtype=numpy.float64)
+        self._decl        = numpy.array(decl, dtype=numpy.float64)
+        n = len(self._refObjectId)
+        if mag is None:
+            mag = numpy.zeros((self.nMag, n))
+        self._mag         = numpy.array(mag, dtype=numpy.float32).reshape(self.nMag, n)
+
+        # rows push_back()'d since the columns were last made
+        self._pending = []
+
+    def _flush(self):
+        if len(self._pending) == 0:
+            return
+        rows = numpy.array(self._pending, dtype=numpy.float64).reshape(-1, 4 + self.nMag)
+        ids = numpy.array([row[0] for row in self._pending], dtype=numpy.int64) # ids may not fit a float
+        self._pending = []
+        self._append(ids, rows[:,1], rows[:,2], rows[:,3], rows[:,4:].T)
+
+    def _append(self, refObjectId, isStar, ra, decl, mag):
+        self._refObjectId = numpy.concatenate((self._refObjectId, numpy.asarray(refObjectId, dtype=numpy.int64)))
+        self._isStar      = numpy.concatenate((self._isStar, numpy.asarray(isStar).astype(numpy.int32)))
+        self._ra          = numpy.concatenate((self._ra, numpy.asarray(ra, dtype=numpy.float64)))
+        self._decl        = numpy.concatenate((self._decl, numpy.asarray(decl, dtype=numpy.float64)))
+        self._mag         = numpy.concatenate((self._mag, numpy.asarray(mag, dtype=numpy.float32)), axis=1)
+
+    def _column(name):
+        def get(self):
+            self._flush()
+            return getattr(self, name)
+        return property(get)
+    refObjectId = _column("_refObjectId")
+    isStar      = _column("_isStar")
+    ra          = _column("_ra")
+    decl        = _column("_decl")
+    mag         = _column("_mag")
+    del _column
+    
     def push_back(self, sro):
-        self.append(sro)
+        """Add a reference object.
 
+        @param sro A SimRefObject, or a sequence of refObjectId, isStar, ra, decl, and the mags
+        """
+        if isinstance(sro, SimRefObject):
+            row = [sro.getId(), sro.getIsStar(), sro.getRa(), sro.getDecl()] + list(sro.mag)
+        else:
+            row = list(sro)
+        if len(row) != 4 + self.nMag:
+            raise ValueError("A SimRefObject needs %d values, not %d" % (4 + self.nMag, len(row)))
+        self._pending.append(row)
+    append = push_back
+
+    def extend(self, refObjectId, isStar, ra, decl, mag):
+        """Add many reference objects at once, given as columns.
+
+        @param refObjectId Array of the ids
+        @param isStar      Array of the star (1) / galaxy (0) flags
+        @param ra          Array of the ra's (degrees)
+        @param decl        Array of the decl's (degrees)
+        @param mag         Array of the magnitudes, shape (nMag, n)
+        """
+        n = len(refObjectId)
+        mag = numpy.asarray(mag, dtype=numpy.float32)
+        if mag.shape != (self.nMag, n) or len(isStar) != n or len(ra) != n or len(decl) != n:
+            raise ValueError("SimRefObject columns need %d rows and mag shape (%d, %d)" % (n, self.nMag, n))
+        self._flush()
+        self._append(refObjectId, isStar, ra, decl, mag)
+
+    def __len__(self):
+        return len(self._refObjectId) + len(self._pending)
+
+    def __getitem__(self, index):
+        self._flush()
+        if isinstance(index, (int, long, numpy.integer)):
+            if index < 0:
+                index += len(self)
+            if index < 0 or index >= len(self):
+                raise IndexError("SimRefObjectSet index out of range")
+            return _SimRefObjectRow(self, index)
+        return SimRefObjectSet(self._refObjectId[index], self._isStar[index],
+                               self._ra[index], self._decl[index], self._mag[:,index])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+    
+    def mags(self, filter):
+        """Get the array of magnitudes in a filter.
+
+        @param filter The filter name, eg. 'r'
+        """
+        return self.mag[SimRefObject.flookup[filter]]
+
+    def fluxes(self, filter):
+        """Get the array of fluxes in a filter.
+
+        @param filter The filter name, eg. 'r'
+        """
+        return 10.0**(-0.4*self.mags(filter))
+
+    def getIds(self):
+        return self.refObjectId
+    
 
 class SimRefObject(object):
 
@@ -97,3 +218,31 @@ class SimRefObject(object):
     #    cov = getattr(self, filter+"Cov")
     #    return cov
 
+
+
+class _SimRefObjectRow(SimRefObject):
+    """A SimRefObject which is a view of one row of a SimRefObjectSet."""
+
+    def __init__(self, sroSet, i):
+        self.sroSet = sroSet
+        self.i      = i
+
+    def _field(name):
+        def get(self):
+            return getattr(self.sroSet, name)[self.i]
+        def set(self, value):
+            getattr(self.sroSet, name)[self.i] = value
+        return property(get, set)
+    refObjectId = _field("refObjectId")
+    isStar      = _field("isStar")
+    del _field
+
+    # a copy, use setRa()/setDecl() to set them
+    radec = property(lambda self: numpy.array([self.sroSet.ra[self.i], self.sroSet.decl[self.i]]))
+    # a view of the column, so setting it sets the row
+    mag   = property(lambda self: self.sroSet.mag[:,self.i])
+
+    def getRa(self):         return self.sroSet.ra[self.i]
+    def setRa(self, ra):     self.sroSet.ra[self.i] = ra
+    def getDecl(self):       return self.sroSet.decl[self.i]
+    def setDecl(self, dec):  self.sroSet.decl[self.i] = dec
@@ -131,7 +131,194 @@ class _Catalog(object):
         self.table = afwTab.SourceTable.make(self.schema)
         self.catalog = afwTab.SourceCatalog(self.table)
 
-        
+
+##################################################
+# a column-oriented catalog
+
+# afw Keys are schema-specific objects, but every _Catalog (or _RefCatalog) builds its
+# schema the same way, so the field offset identifies the accessor name.
+_keyNameLookups = {}
+
+def keyToName(key, catalogClass=_Catalog):
+    """Get the accessor name (eg. 'PsfFlux') for a _Catalog key, or a name.
+
+    @param key          An afw Key from a _Catalog (eg. Catalog().PsfFluxKey), or an accessor name.
+    @param catalogClass The catalog class the key comes from (_Catalog or _RefCatalog)
+    """
+    if isinstance(key, str):
+        return key
+    if not _keyNameLookups.has_key(catalogClass):
+        catObj = catalogClass()
+        lookup = {}
+        for name, k in catObj.keyDict.items():
+            lookup[k.getOffset()] = name
+        _keyNameLookups[catalogClass] = lookup
+    return _keyNameLookups[catalogClass][key.getOffset()]
+
+
+class ColumnCatalog(object):
+    """Source measurements stored as one numpy array per accessor name.
+
+    Columns are named by qaDataUtils.getSourceSetAccessors(), plus 'Id'.
+    Iterating gives ColumnRecord views which mimic the getId()/getD()/setD()
+    interface of afw records, so record-by-record callers still work.
+    """
+
+    keyCatalog = _Catalog
+
+    def __init__(self, nRow=0):
+        """
+        @param nRow The number of sources; float columns are NaN-filled, as for afw records.
+        """
+        self.names = ['Id'] + self._floatNames()
+        self.columns = {}
+        self.columns['Id'] = numpy.zeros(nRow, dtype=numpy.int64)
+        for name in self.names[1:]:
+            column = numpy.empty(nRow, dtype=numpy.float64)
+            column.fill(numpy.NaN)
+            self.columns[name] = column
+
+    def _floatNames(self):
+        return [x for x in qaDataUtils.getSourceSetAccessors()]
+
+    def __len__(self):
+        return len(self.columns['Id'])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield ColumnRecord(self, i)
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.columns[item]
+        if item < 0:
+            item += len(self)
+        if item < 0 or item >= len(self):
+            raise IndexError("ColumnCatalog index out of range: " + str(item))
+        return ColumnRecord(self, item)
+
+    def keyToName(self, key):
+        """Get the column name for a key of this catalog's keyCatalog, or a name."""
+        return keyToName(key, self.keyCatalog)
+
+    def getColumn(self, key):
+        """Get the array for a column.
+
+        @param key The accessor name or a _Catalog key
+        """
+        return self.columns[self.keyToName(key)]
+
+    def setColumn(self, key, values):
+        """Replace a column with values, which must have one entry per source.
+
+        @param key    The accessor name or a _Catalog key
+        @param values Sequence of values to store
+        """
+        name = self.keyToName(key)
+        values = numpy.asarray(values, dtype=self.columns[name].dtype)
+        if len(values) != len(self):
+            raise ValueError("Column %s has %d values, catalog has %d rows." % (name, len(values), len(self)))
+        self.columns[name] = values
+
+    def select(self, index):
+        """Get a new ColumnCatalog with the rows picked out by index.
+
+        @param index A boolean mask or an integer index array
+        """
+        subset = self.__class__()
+        for name in self.names:
+            subset.columns[name] = self.columns[name][index]
+        return subset
+
+
+class RefColumnCatalog(ColumnCatalog):
+    """Matched reference objects stored as columns, named as the fields of a _RefCatalog."""
+
+    keyCatalog = _RefCatalog
+
+    def _floatNames(self):
+        return ["Ra", "Dec", "PsfFlux", "ApFlux", "ModelFlux", "InstFlux"]
+
+
+class MatchList(object):
+    """A list of matches, kept as a ColumnCatalog of sources and a RefColumnCatalog of reference objects.
+
+    Match i is row index[i] of both catalogs, at distance dist[index[i]].  Columns of
+    the matches are got with getColumn() and getRefColumn(); indexing or iterating
+    gives [sref, s, dist] lists of ColumnRecord views, for callers which go a match at a time.
+    """
+
+    def __init__(self, sources, refs, dist=None, index=None):
+        """
+        @param sources ColumnCatalog of the matched sources
+        @param refs    RefColumnCatalog of the matched reference objects, a row for each source row
+        @param dist    Array of match distances (zeros if None)
+        @param index   Array of the rows in the match list (all of them if None)
+        """
+        self.sources = sources
+        self.refs    = refs
+        self.dist    = numpy.zeros(len(sources)) if dist is None else dist
+        self.index   = numpy.arange(len(sources)) if index is None else index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        row = self.index[i]
+        return [ColumnRecord(self.refs, row), ColumnRecord(self.sources, row), float(self.dist[row])]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def getColumn(self, key):
+        """Get an array of a source column, one entry per match.
+
+        @param key The accessor name or a _Catalog key
+        """
+        return self.sources.getColumn(key)[self.index]
+
+    def getRefColumn(self, key):
+        """Get an array of a reference object column, one entry per match.
+
+        @param key The accessor name or a _RefCatalog key
+        """
+        return self.refs.getColumn(key)[self.index]
+
+    def select(self, index):
+        """Get a MatchList of the matches picked out by index, sharing these catalogs.
+
+        @param index A boolean mask or an integer index array into the matches
+        """
+        return MatchList(self.sources, self.refs, self.dist, self.index[index])
+
+
+class ColumnRecord(object):
+    """A view of one row of a ColumnCatalog."""
+
+    __slots__ = ('catalog', 'index')
+
+    def __init__(self, catalog, index):
+        self.catalog = catalog
+        self.index   = index
+
+    def getId(self):       return int(self.catalog.columns['Id'][self.index])
+    def setId(self, val):  self.catalog.columns['Id'][self.index] = val
+
+    def getD(self, key):
+        return float(self.catalog.columns[self.catalog.keyToName(key)][self.index])
+    def setD(self, key, val):
+        self.catalog.columns[self.catalog.keyToName(key)][self.index] = val
+    get = getD
+
+    def __getattr__(self, name):
+        # old Source-style getters, eg. getPsfFlux()
+        if name.startswith('get') and name[3:] in self.catalog.columns:
+            column = self.catalog.columns[name[3:]]
+            return lambda: column[self.index]
+        raise AttributeError(name)
+
+
 ##################################################
 # a local Source object
 class _Source(object):
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+import unittest
+import numpy
+import lsst.utils.tests as tests
+from lsst.testing.pipeQA.CacheManager import CacheManager, approxSize
+
+class CacheManagerTestCases(unittest.TestCase):
+    """Test the LRU eviction of cached data within a memory budget."""
+    def setUp(self):
+        # each value is the same size, so a budget of n values holds n of them
+        self.value = lambda: numpy.zeros(100)
+        self.size = approxSize(self.value())
+        self.evicted = []
+
+    def makeManager(self, nValue):
+        return CacheManager(maxBytes=nValue*self.size, onEvict=self.evicted.extend)
+
+    def testLru(self):
+        manager = self.makeManager(3)
+        cache = manager.makeCache("sources")
+        for key in "abc":
+            cache[key] = self.value()
+        self.assertEqual(manager.nBytes, 3*self.size)
+
+        # using 'a' makes 'b' the least recently used
+        cache['a']
+        cache['d'] = self.value()
+        self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+        self.assertEqual(self.evicted, ['b'])
+        self.assertEqual(manager.nBytes, 3*self.size)
+
+        # a pinned entry is kept, however old
+        manager.pin(lambda key: key == 'a')
+        cache['e'] = self.value()
+        cache['f'] = self.value()
+        self.assertEqual(sorted(cache.keys()), ['a', 'e', 'f'])
+
+        # setting an entry again replaces its size, and deleting it forgets it
+        cache['e'] = numpy.zeros(10)
+        del cache['f']
+        self.assertEqual(manager.nBytes, self.size + approxSize(numpy.zeros(10)))
+        cache.clear()
+        self.assertEqual(manager.nBytes, 0)
+        self.assertEqual(len(manager.entries), 0)
+
+    def testUnlimited(self):
+        manager = CacheManager()
+        cache = manager.makeCache("sources")
+        for i in range(100):
+            cache[i] = self.value()
+        self.assertEqual(len(cache), 100)
+
+    def testLinked(self):
+        manager = self.makeManager(5)
+        calexp = manager.makeCache("calexp")
+        wcs = manager.makeCache("wcs")
+        other = manager.makeCache("sources")
+        manager.link([calexp, wcs])
+
+        calexp['K'] = self.value()
+        wcs['K'] = self.value()
+        other['K'] = self.value()
+        calexp['J'] = self.value()
+        wcs['J'] = self.value()
+        # over budget: calexp['K'] goes, and wcs['K'] with it, but not the unlinked cache's 'K'
+        calexp['L'] = self.value()
+        self.assertEqual(sorted(calexp.keys()), ['J', 'L'])
+        self.assertEqual(sorted(wcs.keys()), ['J'])
+        self.assertEqual(other.keys(), ['K'])
+        self.assertEqual(self.evicted, ['K'])
+        self.assertEqual(manager.nBytes, 4*self.size)
+
+    def testLinkedNewEntry(self):
+        # the parts of the entry being added aren't evicted, even if they're the oldest
+        manager = self.makeManager(1)
+        calexp = manager.makeCache("calexp")
+        wcs = manager.makeCache("wcs")
+        manager.link([calexp, wcs])
+
+        calexp['K'] = self.value()
+        wcs['K'] = self.value()
+        self.assertTrue(calexp.has_key('K') and wcs.has_key('K'))
+        self.assertEqual(self.evicted, [])
+
+        # the next entry pushes both parts out
+        calexp['J'] = self.value()
+        self.assertEqual(calexp.keys(), ['J'])
+        self.assertEqual(wcs.keys(), [])
+        self.assertEqual(self.evicted, ['K'])
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(CacheManagerTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)
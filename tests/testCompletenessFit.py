@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+import unittest
+import numpy
+import lsst.utils.tests as tests
+import lsst.testing.pipeQA.analysis.CompletenessFit as completenessFit
+
+class CompletenessFitTestCases(unittest.TestCase):
+    """Test the photometric depths found from stacked completeness histograms."""
+    def setUp(self):
+        self.rng = numpy.random.RandomState(12345)
+        self.bins = numpy.arange(14, 27, 0.5)
+
+    def simulate(self, depth, width, nPerBin):
+        """Histograms of found and all objects, with completeness 0.5 - arctan((mag - depth)/width)/pi."""
+        centers = 0.5*(self.bins[1:] + self.bins[:-1])
+        total = numpy.zeros(len(centers), dtype=int) + nPerBin
+        prob = 0.5 - numpy.arctan((centers - depth)/width)/numpy.pi
+        found = self.rng.binomial(total, prob)
+        return found, total
+
+    def testStackedHistograms(self):
+        arrays = [self.rng.uniform(13.0, 28.0, n) for n in (0, 1, 50, 500)]
+        arrays[2][0:3] = [numpy.NaN, self.bins[0], self.bins[-1]]
+        hist = completenessFit.stackedHistograms(arrays, self.bins)
+        self.assertEqual(hist.shape, (4, len(self.bins) - 1))
+        for a, h in zip(arrays, hist):
+            a = a[numpy.isfinite(a)]
+            self.assertTrue((h == numpy.histogram(a, bins=self.bins)[0]).all())
+
+    def testFitArctan(self):
+        depths = [21.0, 22.3, 23.7, 24.5]
+        rows = [self.simulate(d, 0.3, 2000) for d in depths]
+        found = numpy.array([r[0] for r in rows])
+        total = numpy.array([r[1] for r in rows])
+
+        depth, A, B = completenessFit.limitingMags(found, total, self.bins, fit=True)
+        self.assertTrue((A > 0).all())
+        for d, dFit in zip(depths, depth):
+            self.assertAlmostEqual(d, dFit, delta=0.05)
+        self.assertTrue(numpy.allclose(depth, -B/A))
+
+        # the fit is started at the crossing, which is near too
+        crossing = completenessFit.crossingMags(found, total, self.bins)
+        self.assertTrue((numpy.abs(crossing - depths) < 0.3).all())
+
+        # without the fit, the depth is the crossing
+        depth, A, B = completenessFit.limitingMags(found, total, self.bins, fit=False)
+        self.assertTrue((depth == crossing).all())
+        self.assertTrue((A == 0).all() and (B == 0).all())
+
+    def testFitFallback(self):
+        found, total = self.simulate(22.0, 0.3, 2000)
+        # only two bins with detections: too few points for the fit
+        few = numpy.zeros(len(total), dtype=int)
+        few[9:11] = [100, 90]
+        fewTotal = numpy.zeros(len(total), dtype=int)
+        fewTotal[9:13] = 100
+        found = numpy.array([found, few, numpy.zeros(len(total), dtype=int)])
+        total = numpy.array([total, fewTotal, numpy.zeros(len(total), dtype=int)])
+
+        depth, A, B = completenessFit.limitingMags(found, total, self.bins, fit=True)
+        crossing = completenessFit.crossingMags(found, total, self.bins)
+        self.assertTrue(A[0] > 0)
+        self.assertEqual(A[1], 0.0)
+        self.assertEqual(depth[1], crossing[1])
+        self.assertTrue(depth[1] > 0.0)
+        # no objects at all: no fit, and no crossing
+        self.assertEqual(A[2], 0.0)
+        self.assertEqual(depth[2], 0.0)
+    def crossingLoop(self, found, total):
+        """The completeness crossing of one ccd, a bin at a time."""
+        magbins = 0.5*(self.bins[1:] + self.bins[:-1])
+        w = numpy.where(total != 0)
+        if len(w[0]) == 0:
+            return 0.0
+        x = magbins[w]
+        y = 1.0*found[w]/total[w]
+
+        binsize = self.bins[1] - self.bins[0]
+        x = numpy.append(x, x[-1] + binsize)
+        y = numpy.append(y, 0.0)
+        for i in numpy.arange(len(y) - 1, 1, -1):
+            if y[i] <= 0.5 and y[i-1] > 0.5:
+                return (0.5 - y[i-1]) / (y[i] - y[i-1]) * (x[i] - x[i-1]) + x[i-1]
+        return 0.0
+
+    def testCrossingMags(self):
+        rows = [self.simulate(self.rng.uniform(19.0, 26.0), self.rng.uniform(0.1, 1.0),
+                              self.rng.randint(1, 50)) for i in range(40)]
+        found = numpy.array([r[0] for r in rows])
+        total = numpy.array([r[1] for r in rows])
+        # gaps in the histograms, a row that's complete everywhere, and an empty row
+        total[0:20:3, 5:9] = 0
+        found[0:20:3, 5:9] = 0
+        found[1] = total[1]
+        found[2] = total[2] = 0
+
+        depth = completenessFit.crossingMags(found, total, self.bins)
+        for i in range(len(rows)):
+            self.assertAlmostEqual(depth[i], self.crossingLoop(found[i], total[i]), places=10)
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(CompletenessFitTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import lsst.utils.tests as tests
+from lsst.testing.pipeQA.DatabaseQuery import ConnectionPool, LsstSimDbInterface
+from lsst.testing.pipeQA.QueryCache import QueryCache
+
+class SqliteDbId(object):
+    """Stands in for a DatabaseIdentity; the connections come from connectFunc."""
+    def __init__(self, mySqlDb):
+        self.mySqlDb = mySqlDb
+
+
+class ConnectionPoolTestCases(unittest.TestCase):
+    """Test the connection pool and LsstSimDbInterface against a local sqlite3 database."""
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbFile = os.path.join(self.tmpDir, "pipeQA.db")
+        self.nConnect = 0
+
+        conn = sqlite3.connect(self.dbFile)
+        conn.execute("CREATE TABLE Source (sourceId INTEGER, psfFlux REAL)")
+        conn.executemany("INSERT INTO Source VALUES (?, ?)", [(i, 10.0*i) for i in range(25)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def connect(self):
+        self.nConnect += 1
+        return sqlite3.connect(self.dbFile)
+
+    def isOpen(self, pooled):
+        try:
+            pooled.conn.execute("SELECT 1")
+        except sqlite3.ProgrammingError:
+            return False
+        return True
+
+    def testAcquireRelease(self):
+        pool = ConnectionPool(self.connect, maxIdle=1)
+        pooled1 = pool.acquire()
+        pooled2 = pool.acquire()
+        self.assertEqual(self.nConnect, 2)
+        self.assertTrue(pooled1 is not pooled2)
+
+        # only maxIdle connections are kept; the others are closed
+        pool.release(pooled1)
+        pool.release(pooled2)
+        self.assertEqual(len(pool.idle), 1)
+        self.assertTrue(self.isOpen(pooled1))
+        self.assertFalse(self.isOpen(pooled2))
+
+        # an idle connection is reused
+        pooled3 = pool.acquire()
+        self.assertTrue(pooled3 is pooled1)
+        self.assertEqual(self.nConnect, 2)
+        self.assertEqual(len(pool.idle), 0)
+
+    def testDiscard(self):
+        pool = ConnectionPool(self.connect)
+        pooled = pool.acquire()
+        pool.discard(pooled)
+        self.assertFalse(self.isOpen(pooled))
+        self.assertEqual(len(pool.idle), 0)
+
+        # a closed connection fails the liveness check, and is replaced
+        pool.pingInterval = -1.0
+        pool.idle.append(pooled)
+        pooled2 = pool.acquire()
+        self.assertTrue(pooled2 is not pooled)
+        self.assertTrue(self.isOpen(pooled2))
+        self.assertEqual(self.nConnect, 2)
+
+    def testForkedPid(self):
+        pool = ConnectionPool(self.connect)
+        parent1 = pool.acquire()
+        parent2 = pool.acquire()
+        pool.release(parent1)
+        pool.release(parent2)
+
+        # pretend we're the child of a fork: the connections belong to the parent
+        parent1.pid = parent2.pid = os.getpid() + 1
+
+        pooled = pool.acquire()
+        self.assertTrue(pooled is not parent1 and pooled is not parent2)
+        self.assertEqual(pooled.pid, os.getpid())
+
+        # the parent's connections are kept (not closed), and recorded once each
+        self.assertEqual(len(pool.inherited), 2)
+        self.assertFalse(pool.isUsable(parent1))
+        pool.release(parent1)
+        pool.discard(parent2)
+        self.assertEqual(len(pool.inherited), 2)
+        self.assertTrue(self.isOpen(parent1))
+        self.assertTrue(self.isOpen(parent2))
+        self.assertEqual(len(pool.idle), 0)
+
+    def testExecuteStream(self):
+        interface = LsstSimDbInterface(SqliteDbId("pipeQA"), connectFunc=self.connect)
+
+        batches = []
+        for rows in interface.executeStream("SELECT sourceId, psfFlux FROM Source ORDER BY sourceId",
+                                            batchSize=10):
+            batches.append(rows)
+            # other queries can run while the stream is open
+            nRow = interface.execute("SELECT COUNT(*) FROM Source")[0][0]
+            self.assertEqual(nRow, 25)
+            self.assertTrue(interface.streaming)
+
+        self.assertFalse(interface.streaming)
+        self.assertEqual([len(rows) for rows in batches], [10, 10, 5])
+        ids = [row[0] for rows in batches for row in rows]
+        self.assertEqual(ids, range(25))
+        self.assertEqual(batches[2][4][1], 240.0)
+
+        # the spare connection used during the stream went back to the pool
+        self.assertEqual(len(interface.pool.idle), 1)
+        self.assertEqual(self.nConnect, 2)
+
+    def testExecuteStreamCached(self):
+        interface = LsstSimDbInterface(SqliteDbId("pipeQA"), connectFunc=self.connect)
+        interface.setQueryCache(QueryCache(os.path.join(self.tmpDir, "cache")))
+        sql = "SELECT sourceId, psfFlux FROM Source ORDER BY sourceId"
+
+        # a stream which isn't read to the end isn't cached
+        for rows in interface.executeStream(sql, batchSize=10):
+            break
+        interface.execute("DELETE FROM Source WHERE sourceId >= 20")
+        ids = [row[0] for rows in interface.executeStream(sql, batchSize=10) for row in rows]
+        self.assertEqual(ids, range(20))
+
+        # now it comes from the cache, in batches, with the values as they were
+        interface.execute("DELETE FROM Source")
+        batches = list(interface.executeStream(sql, batchSize=8))
+        self.assertEqual([len(rows) for rows in batches], [8, 8, 4])
+        self.assertEqual(batches[1][0], (8, 80.0))
+        self.assertFalse(interface.streaming)
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(ConnectionPoolTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)
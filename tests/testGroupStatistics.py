@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+import unittest
+import numpy
+import lsst.utils.tests as tests
+import lsst.testing.pipeQA.analysis.GroupStatistics as groupStats
+import lsst.testing.pipeQA.analysis.RaftCcdData as raftCcdData
+
+class NamedId(object):
+    def __init__(self, name):
+        self.name = name
+    def getName(self):
+        return self.name
+
+class Detector(object):
+    """Stands in for a cameraGeom Detector; only the raft and ccd names are used."""
+    def __init__(self, raft, ccd, parent=None):
+        self.id = NamedId(ccd)
+        self.parent = parent
+    def getId(self):
+        return self.id
+    def getParent(self):
+        return self.parent
+
+
+class GroupStatisticsTestCases(unittest.TestCase):
+    """Test the statistics of many groups at once against a loop over the groups."""
+    def setUp(self):
+        self.rng = numpy.random.RandomState(2718)
+
+    def groupLoop(self, values, nSigmaClip=3.0, nIter=3):
+        """The statistics of one group, a value at a time."""
+        v = values[numpy.isfinite(values)]
+        n = len(v)
+        if n == 0:
+            return dict(n=0, nClip=0)
+        stats = dict(n=n, mean=v.mean(), median=numpy.median(v))
+        if n > 1:
+            stats['stdev'] = v.std(ddof=1)
+        q25, q75 = numpy.percentile(v, [25.0, 75.0])
+        stats['iqr'] = q75 - q25
+
+        center, hwidth = stats['median'], nSigmaClip*groupStats.IQ_TO_STDEV*stats['iqr']
+        nClip, stdevClip = 0, numpy.NaN
+        for i in range(nIter):
+            use = [x for x in v if abs(x - center) <= hwidth]
+            if len(use) == 0:
+                continue
+            use = numpy.array(use)
+            center, nClip = use.mean(), len(use)
+            stdevClip = use.std(ddof=1) if len(use) > 1 else numpy.NaN
+            if len(use) > 1:
+                hwidth = nSigmaClip*stdevClip
+        stats.update(nClip=nClip, meanClip=center, stdevClip=stdevClip)
+        return stats
+
+    def testGroupStatistics(self):
+        arrays = [self.rng.normal(10.0*i, 1.0 + i, self.rng.randint(2, 200)) for i in range(30)]
+        # outliers, NaNs, empty and single-valued groups
+        arrays[0][0:3] = [1000.0, numpy.NaN, -500.0]
+        arrays += [numpy.array([]), numpy.array([3.0]), numpy.array([numpy.NaN, 4.0]),
+                   numpy.array([5.0, 5.0, 5.0])]
+
+        values, offsets = groupStats.concatenateGroups(arrays)
+        self.assertEqual(len(offsets), len(arrays) + 1)
+        for i, a in enumerate(arrays):
+            self.assertEqual(offsets[i+1] - offsets[i], len(a))
+            self.assertTrue(numpy.allclose(values[offsets[i]:offsets[i+1]], a, rtol=0.0, equal_nan=True))
+        self.assertTrue((groupStats.groupIds(offsets) == numpy.repeat(range(len(arrays)),
+                                                                      [len(a) for a in arrays])).all())
+
+        stats = groupStats.groupStatistics(values, offsets)
+        for i, a in enumerate(arrays):
+            expected = self.groupLoop(a)
+            self.assertEqual(stats['n'][i], expected['n'])
+            for name in ('mean', 'stdev', 'median', 'iqr', 'nClip', 'meanClip', 'stdevClip'):
+                value = expected.get(name, numpy.NaN)
+                self.assertTrue(numpy.allclose(stats[name][i], value, rtol=1.0e-10, equal_nan=True),
+                                "%s of group %d: %s != %s" % (name, i, stats[name][i], value))
+        self.assertTrue(numpy.allclose(stats['sigmaIqr'], groupStats.IQ_TO_STDEV*stats['iqr'],
+                                       equal_nan=True))
+
+    def testGroupQuantiles(self):
+        arrays = [self.rng.uniform(size=self.rng.randint(0, 40)) for i in range(50)]
+        values, offsets = groupStats.concatenateGroups(arrays)
+        fractions = (0.0, 0.1, 0.5, 0.9, 1.0)
+        quantiles = groupStats.groupQuantiles(values, offsets, fractions)
+        for i, a in enumerate(arrays):
+            if len(a) == 0:
+                self.assertTrue(numpy.isnan(quantiles[:,i]).all())
+            else:
+                self.assertTrue(numpy.allclose(quantiles[:,i], numpy.percentile(a, [100.0*f for f in fractions])))
+
+        values, offsets = groupStats.concatenateGroups([])
+        self.assertEqual(groupStats.groupQuantiles(values, offsets, fractions).shape, (5, 0))
+
+    def testRaftCcdVector(self):
+        detector = {}
+        for raft in ("R:0,1", "R:1,1"):
+            for ccd in ("S:0,0", "S:1,1", "S:2,2"):
+                detector[raft+" "+ccd] = Detector(raft, ccd, Detector(None, raft))
+        vec = raftCcdData.RaftCcdVector(detector)
+
+        # numpy.append onto each ccd, as RaftCcdVector used to
+        expected = {}
+        for raft, ccd in vec.raftCcdKeys():
+            expected[(raft, ccd)] = numpy.array([])
+        for i in range(200):
+            raft, ccd = vec.raftCcdKeys()[self.rng.randint(0, 6)]
+            if i % 3 == 0:
+                value = self.rng.normal()
+                vec.append(raft, ccd, value)
+            else:
+                value = self.rng.normal(size=self.rng.randint(0, 20))
+                vec.extend(raft, ccd, value)
+            expected[(raft, ccd)] = numpy.append(expected[(raft, ccd)], value)
+            if i % 50 == 0:
+                # reading part way through sees the values so far
+                self.assertTrue((vec.get(raft, ccd) == expected[(raft, ccd)]).all())
+        vec.set("R:1,1", "S:2,2", numpy.array([1.0, 2.0]))
+        expected[("R:1,1", "S:2,2")] = numpy.array([1.0, 2.0])
+        vec.extend("R:1,1", "S:2,2", [3.0])
+        expected[("R:1,1", "S:2,2")] = numpy.append(expected[("R:1,1", "S:2,2")], 3.0)
+
+        keys, values, offsets = vec.concatenate()
+        self.assertEqual(keys, vec.raftCcdKeys())
+        for i, (raft, ccd) in enumerate(keys):
+            self.assertTrue((values[offsets[i]:offsets[i+1]] == expected[(raft, ccd)]).all())
+            self.assertTrue((vec.get(raft, ccd) == expected[(raft, ccd)]).all())
+
+        keys, stats = vec.groupStatistics()
+        for i, (raft, ccd) in enumerate(keys):
+            if len(expected[(raft, ccd)]) > 0:
+                self.assertAlmostEqual(stats['median'][i], numpy.median(expected[(raft, ccd)]), places=12)
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(GroupStatisticsTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)
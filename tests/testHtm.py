@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+import unittest
+import numpy
+import lsst.utils.tests as tests
+import lsst.testing.pipeQA.Htm as htm
+
+class HtmTestCases(unittest.TestCase):
+    """Test the HTM ids and the htmId20 ranges covering sensor polygons."""
+    def setUp(self):
+        self.rng = numpy.random.RandomState(42)
+
+    def inRanges(self, ids, htmMin, htmMax):
+        i = numpy.searchsorted(htmMin, ids, side='right') - 1
+        return (i >= 0) & (ids <= htmMax[numpy.maximum(i, 0)])
+
+    def testIds(self):
+        # one point in each of the root triangles
+        ra   = [45.0, 135.0, 225.0, 315.0, 315.0, 225.0, 135.0, 45.0]
+        decl = [-45.0, -45.0, -45.0, -45.0, 45.0, 45.0, 45.0, 45.0]
+        self.assertEqual(list(htm.htmIds(ra, decl, 0)), range(8, 16))
+
+        # each level appends two bits to the id of the level above
+        ra = self.rng.uniform(0.0, 360.0, 1000)
+        decl = numpy.degrees(numpy.arcsin(self.rng.uniform(-1.0, 1.0, 1000)))
+        ids20 = htm.htmIds(ra, decl, 20)
+        ids7 = htm.htmIds(ra, decl, 7)
+        self.assertTrue(((ids20 >> 26) == ids7).all())
+
+    def testPolygonRanges(self):
+        nPoly = 50
+        raC = self.rng.uniform(0.0, 360.0, nPoly)
+        declC = self.rng.uniform(-85.0, 85.0, nPoly)
+        half = 0.12
+        dra = half/numpy.cos(numpy.radians(declC))
+        ra = numpy.array([raC - dra, raC + dra, raC + dra, raC - dra]).transpose()
+        decl = numpy.array([declC - half, declC - half, declC + half, declC + half]).transpose()
+
+        poly, htmMin, htmMax = htm.polygonRanges(ra, decl)
+        self.assertTrue((htmMin <= htmMax).all())
+
+        for i in range(nPoly):
+            mine = poly == i
+            self.assertTrue(mine.sum() > 0)
+            # sorted, and not touching
+            self.assertTrue((htmMin[mine][1:] > htmMax[mine][:-1] + 1).all())
+
+            # every point inside the polygon is covered
+            u = self.rng.uniform(-0.99, 0.99, (200, 2))
+            ids = htm.htmIds(raC[i] + u[:,0]*dra[i], declC[i] + u[:,1]*half)
+            self.assertTrue(self.inRanges(ids, htmMin[mine], htmMax[mine]).all())
+
+            # and points well away from it aren't
+            ids = htm.htmIds(raC[i] + 5.0*dra[i], declC[i] + 5.0*half)
+            self.assertFalse(self.inRanges(ids, htmMin[mine], htmMax[mine]).any())
+
+    def testNoPolygons(self):
+        poly, htmMin, htmMax = htm.polygonRanges(numpy.zeros((0, 4)), numpy.zeros((0, 4)))
+        self.assertEqual(len(poly), 0)
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(HtmTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+import unittest
+import warnings
+import numpy
+import lsst.utils.tests as tests
+import lsst.testing.pipeQA.analysis.QaAnalysisUtils as qaAnaUtil
+
+class QaAnalysisUtilsTestCases(unittest.TestCase):
+    """Test the array versions of the analysis loops against the loops they replaced."""
+    def setUp(self):
+        self.rng = numpy.random.RandomState(314159)
+
+    def testSectorCounts(self):
+        xwid, ywid = 2048.0, 4096.0
+        x = self.rng.uniform(-100.0, xwid + 100.0, 500)
+        y = self.rng.uniform(-100.0, ywid + 100.0, 500)
+        # on the edges, just outside them, and not finite
+        x[0:6] = [0.0, xwid, -0.5, xwid - 1.0e-9, numpy.NaN, 10.0]
+        y[0:6] = [0.0, 10.0, 10.0, ywid - 1.0e-9, 10.0, numpy.inf]
+
+        grids = [(4, 4), (8, 16), (1, 1)]
+        countsList = qaAnaUtil.sectorCounts(x, y, xwid, ywid, grids)
+        for (nx, ny), counts in zip(grids, countsList):
+            expected = numpy.zeros([nx, ny])
+            for i in range(len(x)):
+                if not (numpy.isfinite(x[i]) and numpy.isfinite(y[i])):
+                    continue
+                xi, yi = int(nx*x[i]/xwid), int(ny*y[i]/ywid)
+                if xi >= 0 and xi < nx and yi >= 0 and yi < ny:
+                    expected[xi,yi] += 1
+            self.assertEqual(counts.shape, (nx, ny))
+            self.assertTrue((counts == expected).all())
+
+        self.assertEqual(qaAnaUtil.sectorCounts([], [], xwid, ywid, [(2, 2)])[0].sum(), 0)
+    def testJoinIds(self):
+        ids1 = self.rng.randint(0, 60, 200)
+        ids2 = self.rng.randint(0, 60, 150)
+
+        # every pair, ordered as numpy.where(numpy.equal.outer()) gives them
+        i1, i2 = qaAnaUtil.joinIds(ids1, ids2)
+        e1, e2 = numpy.where(numpy.equal.outer(ids1, ids2))
+        self.assertTrue((i1 == e1).all() and (i2 == e2).all())
+
+        # only the ids which appear once in each, as the common-id loop took them
+        i1, i2 = qaAnaUtil.joinIds(ids1, ids2, unique=True)
+        pairs = []
+        for objId in set(ids1) & set(ids2):
+            idx1 = numpy.where(ids1 == objId)[0]
+            idx2 = numpy.where(ids2 == objId)[0]
+            if len(idx1) != 1 or len(idx2) != 1:
+                continue
+            pairs.append((idx1[0], idx2[0]))
+        self.assertEqual(sorted(pairs), zip(i1, i2))
+        self.assertTrue((numpy.diff(i1) > 0).all())
+
+        i1, i2 = qaAnaUtil.joinIds([], ids2, unique=True)
+        self.assertEqual(len(i1), 0)
+        self.assertEqual(len(i2), 0)
+    def testMomentsToEllipse(self):
+        n = 300
+        ixx = self.rng.uniform(0.5, 5.0, n)
+        iyy = self.rng.uniform(0.5, 5.0, n)
+        ixy = self.rng.uniform(-3.0, 3.0, n)
+        # round, degenerate, negative and missing moments
+        ixx[0:5] = [2.0, 0.0, -1.0, numpy.NaN, 1.0]
+        iyy[0:5] = [2.0, 0.0, -2.0, 1.0, 1.0]
+        ixy[0:5] = [0.0, 0.0, 0.0, 0.0, -1.0e-12]
+
+        shape = qaAnaUtil.momentsToEllipse(ixx, iyy, ixy)
+        sigmaToFwhm = 2.0*numpy.sqrt(2.0*numpy.log(2.0))
+        for i in range(n):
+            tmp = 0.25*(ixx[i]-iyy[i])**2 + ixy[i]**2
+            a2 = 0.5*(ixx[i]+iyy[i]) + numpy.sqrt(tmp)
+            b2 = 0.5*(ixx[i]+iyy[i]) - numpy.sqrt(tmp)
+            if not numpy.isfinite(tmp) or a2 == 0 or b2/a2 < 0:
+                self.assertFalse(numpy.isfinite(shape['ellip'][i]))
+                continue
+
+            ellip = 1.0 - numpy.sqrt(b2/a2)
+            theta = 0.5*numpy.arctan2(2.0*ixy[i], ixx[i]-iyy[i])
+            if theta < 0.0:
+                theta += numpy.pi
+            self.assertAlmostEqual(shape['ellip'][i], ellip, places=12)
+            self.assertAlmostEqual(shape['theta'][i], theta, places=12)
+            # (a2 + b2 < 0 has a real ellipticity, but no fwhm)
+            with numpy.errstate(invalid='ignore'):
+                fwhm = sigmaToFwhm*numpy.sqrt(0.5*(a2 + b2))
+            self.assertTrue(numpy.allclose(shape['fwhm'][i], fwhm, rtol=1.0e-12, equal_nan=True))
+            self.assertTrue(0.0 <= shape['theta'][i] < numpy.pi)
+    def testSkyOffsets(self):
+        n = 200
+        ra = self.rng.uniform(0.0, 360.0, n)
+        dec = self.rng.uniform(-89.0, 89.0, n)
+        raRef = ra + self.rng.normal(0.0, 1.0e-4, n)
+        decRef = dec + self.rng.normal(0.0, 1.0e-4, n)
+
+        dRa, dDec, dist = qaAnaUtil.skyOffsets(ra, dec, raRef, decRef, withDistance=True)
+        for i in range(n):
+            r, d, rRef, dRef = [numpy.radians(x) for x in [ra[i], dec[i], raRef[i], decRef[i]]]
+            self.assertAlmostEqual(dRa[i], (rRef - r)*abs(numpy.cos(dRef)), places=12)
+            self.assertAlmostEqual(dDec[i], dRef - d, places=12)
+            # small offsets: the distance is the length of the offset
+            self.assertAlmostEqual(dist[i], numpy.hypot(dRa[i], dDec[i]), delta=1.0e-9)
+
+        # radians, and offsets across ra = 0 are small
+        dRa, dDec = qaAnaUtil.skyOffsets([359.9999], [0.0], [0.0001], [0.0])
+        self.assertAlmostEqual(dRa[0], numpy.radians(0.0002), places=12)
+        dRa2, dDec2 = qaAnaUtil.skyOffsets(numpy.radians(ra), numpy.radians(dec),
+                                           numpy.radians(raRef), numpy.radians(decRef), degrees=False)
+        self.assertTrue(numpy.allclose(dRa2, qaAnaUtil.skyOffsets(ra, dec, raRef, decRef)[0]))
+    def robustLineFitLoop(self, x, y, nbin=3, sigma=3.0, niter=1):
+        """The robust line fit of one group, a bin at a time."""
+        epsilon = 1.0e-6
+        xmin, xmax = x.min() - epsilon, x.max() + epsilon
+        step = (xmax - xmin)/nbin
+        xMeds, yMeds, yErrs = [], [], []
+        for i in range(nbin):
+            w = numpy.where((x > xmin + i*step) & (x <= xmin + (i+1)*step))
+            if len(x[w]) == 0:
+                continue
+            xMeds.append(numpy.median(x[w]))
+            yMeds.append(numpy.median(y[w]))
+            yErrs.append(numpy.std(y[w])/numpy.sqrt(len(y[w])))
+        xNew, yNew, dyNew = numpy.array(xMeds), numpy.array(yMeds), numpy.array(yErrs)
+
+        w0 = numpy.where(dyNew == 0)[0]
+        wnot0 = numpy.where(dyNew > 0)[0]
+        if len(w0) > 0:
+            meanError = numpy.mean(dyNew[wnot0]) if len(wnot0) > 0 else numpy.std(yNew)
+            if meanError == 0.0:
+                meanError = 1.0
+            dyNew[w0] = meanError
+
+        for i in range(niter):
+            a, da, b, db, rab, x2 = qaAnaUtil.lineFit(xNew, yNew, dyNew)
+            residuals = yNew - (b*xNew + a)
+            mean = numpy.median(residuals) if i == 0 else numpy.mean(residuals)
+            std = numpy.std(residuals)
+            if niter > 1:
+                w = numpy.where((numpy.abs(residuals - mean)/std) < sigma)
+                xNew, yNew, dyNew = xNew[w], yNew[w], dyNew[w]
+        return b, db, a, da
+
+    def testGroupRobustLineFit(self):
+        nGroup = 12
+        xs, ys, groups = [], [], []
+        for i in range(nGroup):
+            n = [500, 3, 1, 40][i % 4]
+            x = self.rng.uniform(15.0, 23.0, n)
+            y = 0.02*i*x - 0.3 + self.rng.normal(0.0, 0.05, n)
+            if i % 4 == 3:
+                y[:] = 0.5  # identical values: zero errors
+            xs.append(x)
+            ys.append(y)
+            groups.append(numpy.zeros(n, dtype=int) + i)
+        # the groups' points are mixed together
+        order = self.rng.permutation(sum([len(x) for x in xs]))
+        x, y, group = [numpy.concatenate(a)[order] for a in (xs, ys, groups)]
+
+        for nbin, niter in ((3, 1), (8, 1), (8, 3)):
+            fit = qaAnaUtil.groupRobustLineFit(x, y, group, nGroup + 1, nbin=nbin, niter=niter)
+            self.assertEqual(fit.shape, (nGroup + 1, 4))
+            for i in range(nGroup):
+                with warnings.catch_warnings():
+                    # the loop takes the mean of empty bins, for groups with few points
+                    warnings.simplefilter("ignore")
+                    expected = self.robustLineFitLoop(xs[i], ys[i], nbin=nbin, niter=niter)
+                if len(xs[i]) < 2:
+                    # too few bins for a line
+                    self.assertTrue((fit[i] == 0.0).all())
+                else:
+                    self.assertTrue(numpy.allclose(fit[i], expected, rtol=1.0e-8, atol=1.0e-12),
+                                    "group %d: %s != %s" % (i, fit[i], expected))
+            # a group with no points
+            self.assertTrue((fit[nGroup] == 0.0).all())
+
+        # robustPolyFit is the one-group case
+        self.assertTrue(numpy.allclose(qaAnaUtil.robustPolyFit(xs[0], ys[0], 1, nbin=5, niter=2),
+                                       self.robustLineFitLoop(xs[0], ys[0], nbin=5, niter=2)))
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(QaAnalysisUtilsTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)
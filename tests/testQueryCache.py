@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy
+import lsst.utils.tests as tests
+from lsst.testing.pipeQA.QueryCache import QueryCache, normalizeSql
+
+class QueryCacheTestCases(unittest.TestCase):
+    """Test the on-disk cache of query results."""
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.rows = tuple([(i, 0.5*i, "s%d" % i, None if i % 3 else 1.0) for i in range(50)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def cacheSize(self):
+        total = 0
+        for dirPath, dirNames, fileNames in os.walk(self.tmpDir):
+            total += sum([os.path.getsize(os.path.join(dirPath, f)) for f in fileNames])
+        return total
+
+    def testGetPut(self):
+        cache = QueryCache(self.tmpDir)
+        sql = "SELECT a, b FROM Source  WHERE x = 1;"
+        self.assertTrue(cache.get("db", sql) is None)
+
+        cache.put("db", sql, (), self.rows)
+        self.assertEqual(cache.get("db", sql), self.rows)
+        # whitespace and a trailing ';' don't matter, but the database and context do
+        self.assertEqual(normalizeSql(sql), "SELECT a, b FROM Source WHERE x = 1")
+        self.assertEqual(cache.get("db", "SELECT a, b\n FROM Source WHERE x = 1"), self.rows)
+        self.assertTrue(cache.get("db2", sql) is None)
+        self.assertTrue(cache.get("db", sql, ["SELECT poly INTO @poly"]) is None)
+
+        # no rows, and rows given as columns
+        cache.put("db", "SELECT nothing", (), ())
+        self.assertEqual(cache.get("db", "SELECT nothing"), ())
+        cache.putColumns("db", "SELECT columns", (), 3, [numpy.arange(3), numpy.array([1.5, 2.5, 3.5])])
+        self.assertEqual(cache.get("db", "SELECT columns"), ((0, 1.5), (1, 2.5), (2, 3.5)))
+        nRow, columns = cache.getColumns("db", "SELECT columns")
+        self.assertEqual(nRow, 3)
+        self.assertEqual(columns[1].dtype, numpy.float64)
+
+        cache.invalidate("db")
+        self.assertTrue(cache.get("db", sql) is None)
+
+    def testEvict(self):
+        cache = QueryCache(self.tmpDir, maxBytes=10**9, rescanInterval=1000)
+        for i in range(10):
+            cache.put("db", "SELECT %d" % i, (), self.rows)
+        # the running total is kept up to date without rescanning
+        self.assertEqual(cache.totalBytes, self.cacheSize())
+        self.assertEqual(cache.nPutSinceScan, 9)
+
+        # make the first results the oldest, and use the second so it's kept
+        for i in range(10):
+            t = time.time() - 1000 + i
+            os.utime(cache._path("db", "SELECT %d" % i, ()), (t, t))
+        self.assertTrue(cache.get("db", "SELECT 1") is not None)
+
+        # going over the budget removes the least recently used, down to 90% of it
+        entrySize = self.cacheSize()//10
+        cache.maxBytes = 5*entrySize + entrySize//2
+        cache.put("db", "SELECT 10", (), self.rows)
+        kept = [i for i in range(11) if cache.get("db", "SELECT %d" % i) is not None]
+        self.assertEqual(kept, [1, 8, 9, 10])
+        self.assertEqual(cache.totalBytes, self.cacheSize())
+        self.assertTrue(cache.totalBytes <= 0.9*cache.maxBytes)
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(QueryCacheTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import unittest
+import numpy
+import lsst.utils.tests as tests
+import lsst.testing.pipeQA.simRefObject as simRefObj
+
+class SimRefObjectSetTestCases(unittest.TestCase):
+    """Test adding reference objects to a SimRefObjectSet, a row or many columns at a time."""
+    def setUp(self):
+        n = 5
+        self.ids = numpy.arange(n, dtype=numpy.int64) + 2**60  # too big for a float
+        self.isStar = numpy.array([1, 0, 1, 1, 0])
+        self.ra = numpy.linspace(10.0, 11.0, n)
+        self.decl = numpy.linspace(-5.0, -4.0, n)
+        self.mag = numpy.arange(6*n, dtype=numpy.float32).reshape(6, n)
+
+    def testExtend(self):
+        sros = simRefObj.SimRefObjectSet()
+        sros.push_back([1, 1, 0.5, 0.25] + [20.0]*6)
+        sros.extend(self.ids, self.isStar, self.ra, self.decl, self.mag)
+        sros.push_back(simRefObj.SimRefObject(7, 0, 1.0, 2.0, 1, 2, 3, 4, 5, 6))
+
+        self.assertEqual(len(sros), 7)
+        self.assertEqual(list(sros.getIds()), [1] + list(self.ids) + [7])
+        self.assertEqual(list(sros.isStar[1:6]), list(self.isStar))
+        self.assertTrue((sros.ra[1:6] == self.ra).all())
+        self.assertTrue((sros.mags('r')[1:6] == self.mag[2]).all())
+        self.assertEqual(sros[6].getMag('z'), 5.0)
+        self.assertEqual(sros[0].getDecl(), 0.25)
+
+        self.assertRaises(ValueError, sros.extend, self.ids, self.isStar, self.ra, self.decl, self.mag[:,:2])
+
+    def testExtendEmpty(self):
+        sros = simRefObj.SimRefObjectSet(self.ids, self.isStar, self.ra, self.decl, self.mag)
+        sros.extend([], [], [], [], numpy.zeros((6, 0)))
+        self.assertEqual(len(sros), 5)
+        self.assertEqual(sros.mag.shape, (6, 5))
+#####
+
+def suite():
+    """Returns a suite containing all the test cases in this module."""
+    tests.init()
+
+    suites = []
+    suites += unittest.makeSuite(SimRefObjectSetTestCases)
+    suites += unittest.makeSuite(tests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(doExit=False):
+    """Run the tests"""
+    tests.run(suite(), doExit)
+
+if __name__ == "__main__":
+    run(True)